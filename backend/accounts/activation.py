@@ -0,0 +1,62 @@
+"""
+First login of students registered by a cohort import.
+
+Imported accounts have no usable password (the matric number, which is
+also the username, is public). A student asks for an activation link with
+their matric number, it is mailed to the address of the import, and the
+link's uid + token let them choose a password. The token is Django's
+password reset token: it stops working once the password is set.
+ACTIVATION_URL is the app page that asks for the new password.
+"""
+import logging
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import send_mail
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+logger = logging.getLogger(__name__)
+
+
+def send_activation(matric_number):
+    """mail an activation link when the account exists and was never activated"""
+    user = (
+        User.objects
+        .filter(username__iexact=matric_number, is_active=True)
+        .exclude(email="")
+        .first()
+    )
+    if user is None or user.has_usable_password():
+        return False
+    if not settings.ACTIVATION_URL:
+        logger.error("ACTIVATION_URL is not set, no activation mail for %s", user.username)
+        return False
+
+    uid = urlsafe_base64_encode(force_bytes(user.pk))
+    token = default_token_generator.make_token(user)
+    try:
+        send_mail(
+            "Activate your campus navigator account",
+            f"Choose a password for {user.username}:\n"
+            f"{settings.ACTIVATION_URL}?uid={uid}&token={token}\n",
+            None,
+            [user.email],
+        )
+    except Exception:
+        # any backend error: the caller answers as for an unknown account
+        logger.exception("Could not send the activation mail of %s", user.username)
+        return False
+    return True
+
+
+def activation_user(uid, token):
+    """the user the link was made for, None when it is invalid or used"""
+    try:
+        user = User.objects.get(pk=urlsafe_base64_decode(uid).decode())
+    except (TypeError, ValueError, OverflowError, User.DoesNotExist):
+        return None
+    if user.has_usable_password() or not default_token_generator.check_token(user, token):
+        return None
+    return user
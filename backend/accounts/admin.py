@@ -1,6 +1,56 @@
-from django.contrib import admin
+import logging
+import os
+import tempfile
+import threading
+
+from django import forms
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+
 from campus.admin import campus_admin_site
-from .models import Profile, School, Department
+from campus.models import University
+from .cohort import CohortImporter
+from .models import CohortCount, Profile, School, Department
+
+logger = logging.getLogger(__name__)
+
+
+class CohortImportForm(forms.Form):
+    university = forms.ModelChoiceField(queryset=University.objects.all())
+    csv_file = forms.FileField(label="CSV file")
+
+
+def run_cohort_import(university, path, cache_key):
+    """
+    background thread: import the saved upload and keep the report.
+    Passwords are hashed in this thread, no process pool is forked from
+    a web worker; use the import_cohort command for files full of them.
+    """
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as fh:
+            result = CohortImporter(university, workers=0).run(fh)
+
+        report = {
+            "summary": result.summary(),
+            "errors": result.errors[:100],
+        }
+    except Exception as exc:
+        # rows of the batches before the failure stay imported
+        logger.exception("Cohort import into %s failed", university)
+        report = {
+            "summary": "Import failed, the rows imported before the error were kept.",
+            "errors": [f"{type(exc).__name__}: {exc}"],
+        }
+    finally:
+        os.remove(path)
+        connections.close_all()
+
+    cache.set(cache_key, report, 60 * 60 * 24)
 
 
 @admin.register(Profile, site=campus_admin_site)
@@ -20,6 +70,59 @@ class ProfileAdmin(admin.ModelAdmin):
         "matric_number",
     )
 
+    def get_urls(self):
+        urls = [
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_cohort_view),
+                name="accounts_profile_import",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def import_cohort_view(self, request):
+        """
+        Upload a cohort CSV. The import runs in the background because
+        a whole cohort takes a while to insert (and to hash, with passwords).
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        cache_key = f"cohort_import:{request.user.id}"
+        form = CohortImportForm(request.POST or None, request.FILES or None)
+
+        # campus admins can only import into their own university
+        if not request.user.is_superuser:
+            form.fields["university"].queryset = University.objects.filter(
+                id=request.user.campus_admin.university_id
+            )
+
+        if request.method == "POST" and form.is_valid():
+            # copy the upload to disk in chunks, the request is gone
+            # by the time the import thread reads it
+            upload = form.cleaned_data["csv_file"]
+            fd, path = tempfile.mkstemp(suffix=".csv")
+            with os.fdopen(fd, "wb") as out:
+                for chunk in upload.chunks():
+                    out.write(chunk)
+
+            threading.Thread(
+                target=run_cohort_import,
+                args=(form.cleaned_data["university"], path, cache_key),
+                daemon=True,
+            ).start()
+
+            messages.info(request, "Import started, refresh this page for the report.")
+            return redirect("campus_admin:accounts_profile_import")
+
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Import cohort",
+            "form": form,
+            "last_import": cache.get(cache_key),
+        }
+        return TemplateResponse(request, "admin/accounts/profile/import_cohort.html", context)
+
 
 @admin.register(School, site=campus_admin_site)
 class SchoolAdmin(admin.ModelAdmin):
@@ -32,4 +135,30 @@ class DepartmentAdmin(admin.ModelAdmin):
     list_display = (
         "name",
         "school", )
-    search_fields = ("name",)
\ No newline at end of file
+    search_fields = ("name",)
+
+
+@admin.register(CohortCount, site=campus_admin_site)
+class CohortCountAdmin(admin.ModelAdmin):
+    """Read-only student counts, kept by accounts.cohort_stats."""
+    list_display = ("university", "school", "department", "level", "students", "updated_at")
+    list_filter = (
+        ("school", admin.RelatedOnlyFieldListFilter),
+        "level",
+    )
+    readonly_fields = ("university", "school", "department", "level", "students", "updated_at")
+    exclude = ("key",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related(
+            "university", "school", "department"
+        ).filter(students__gt=0)
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(university=request.user.campus_admin.university)
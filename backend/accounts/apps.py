@@ -1,6 +1,24 @@
+from urllib.parse import urlsplit
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+def require_activation_url():
+    """the activation mail is read outside the site, a relative link leads nowhere"""
+    url = urlsplit(settings.ACTIVATION_URL)
+    if settings.ACTIVATION_URL and (url.scheme not in ("http", "https") or not url.netloc):
+        raise ImproperlyConfigured(
+            f"ACTIVATION_URL must be an absolute http(s) URL, not {settings.ACTIVATION_URL!r}"
+        )
 
 
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        require_activation_url()
@@ -0,0 +1,145 @@
+"""
+JWT authentication with a short-lived per-worker user cache.
+
+simplejwt's JWTAuthentication loads the User on every request, and most
+views then load the profile too. CachedJWTAuthentication loads user +
+profile (with university, school, department) and the campus admin link
+in one query and keeps them in this worker's memory for AUTH_CACHE_TTL
+seconds.
+
+The cache holds the loaded rows pickled, never the instances: every
+request unpickles its own User, so a view changing request.user (or its
+profile) can't leak into a concurrent request of the same user.
+
+Entries are keyed by (user id, auth version). The version lives in the
+shared cache and changes whenever the User, Profile or campus admin link
+is saved (see accounts.signals), so every worker stops using its copy
+straight away, role changes included.
+"""
+import pickle
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+User = get_user_model()
+
+# keeps a worker from growing without bound on a busy day
+MAX_ENTRIES = 5000
+
+
+def auth_version_key(user_id):
+    return f"auth_version:{user_id}"
+
+
+def auth_version(user_id):
+    version = cache.get(auth_version_key(user_id))
+
+    if version is None:
+        # random, so a lost key can never bring an old entry back to life
+        cache.add(auth_version_key(user_id), uuid.uuid4().hex, None)
+        version = cache.get(auth_version_key(user_id))
+
+    return version
+
+
+def bump_auth_version(user_id):
+    cache.set(auth_version_key(user_id), uuid.uuid4().hex, None)
+
+
+class UserCache:
+    """tiny TTL dict, one per worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            if len(self._entries) >= MAX_ENTRIES:
+                self._entries.clear()
+            self._entries[key] = (value, time.monotonic() + ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = (str(user_id), auth_version(user_id))
+        cached = user_cache.get(key)
+
+        if cached is not None:
+            # a fresh instance per request, with the related rows
+            user = pickle.loads(cached)
+        else:
+            try:
+                user = User.objects.select_related(
+                    "profile",
+                    "profile__university",
+                    "profile__school",
+                    "profile__department",
+                    "campus_admin",
+                ).get(**{api_settings.USER_ID_FIELD: user_id})
+            except User.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+            user_cache.set(key, pickle.dumps(user, pickle.HIGHEST_PROTOCOL), settings.AUTH_CACHE_TTL)
+
+        # same checks as JWTAuthentication.get_user
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return user
+
+
+class CampusTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Adds university_id and role to the token, as of login. They are only
+    hints (the feedback throttle buckets by university_id); permissions
+    read the profile, which is current.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+
+        profile = getattr(user, "profile", None)
+        if profile is not None:
+            token["university_id"] = profile.university_id
+            token["role"] = profile.role
+
+        return token
@@ -0,0 +1,78 @@
+"""
+University → schools → departments catalog for the registration flow.
+
+The whole tree is built with three flat queries and cached under a version
+number. Saving or deleting a University, School or Department bumps the
+version (see accounts.signals), so the next request rebuilds it.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from campus.models import University
+from .models import Department, School
+
+VERSION_KEY = "catalog_version"
+
+# safety net for caches that are not shared between workers
+CATALOG_TTL = 60 * 60
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+
+
+def build_catalog(university_id=None):
+    universities = University.objects.order_by("name")
+    schools = School.objects.order_by("name")
+    departments = Department.objects.order_by("name")
+
+    if university_id is not None:
+        universities = universities.filter(id=university_id)
+        schools = schools.filter(university_id=university_id)
+        departments = departments.filter(school__university_id=university_id)
+
+    departments_by_school = {}
+    for department in departments.values("id", "name", "school_id"):
+        departments_by_school.setdefault(department.pop("school_id"), []).append(department)
+
+    schools_by_university = {}
+    for school in schools.values("id", "name", "university_id"):
+        school["departments"] = departments_by_school.get(school["id"], [])
+        schools_by_university.setdefault(school.pop("university_id"), []).append(school)
+
+    return [
+        dict(university, schools=schools_by_university.get(university["id"], []))
+        for university in universities.values("id", "name", "short_name")
+    ]
+
+
+def get_catalog(university_id=None):
+    """
+    Returns (etag, json bytes) for the whole catalog or one university.
+    The ETag is a hash of the content, so it is the same on every worker.
+    """
+    key = f"catalog:{catalog_version()}:{university_id or 'all'}"
+    cached = cache.get(key)
+
+    if cached is None:
+        body = json.dumps(build_catalog(university_id)).encode()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        cached = (etag, body)
+        cache.set(key, cached, CATALOG_TTL)
+
+    return cached
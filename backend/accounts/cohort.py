@@ -0,0 +1,202 @@
+"""
+Bulk student registration from a CSV file.
+
+Expected columns (header row required):
+    matric_number, first_name, last_name, school, department
+optional:
+    email, level, password
+
+Rows are read one batch at a time, checked against school/department maps
+loaded once for the university, passwords are hashed in a process pool and
+every batch is inserted with bulk_create inside a transaction.
+The matric number is the username. It is public, so it is never used as a
+password: rows without one get an unusable password and the student sets
+theirs from an activation link (accounts.activation), so a row needs an
+email or a password.
+"""
+import csv
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .cohort_stats import track_created
+from .hashing import PasswordHasherPool
+from .models import Department, Profile, School
+
+REQUIRED_COLUMNS = {"matric_number", "first_name", "last_name", "school", "department"}
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+    errors: list = field(default_factory=list)
+
+    @property
+    def users_per_second(self):
+        return self.created / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        return (
+            f"{self.created} users created, {self.skipped} rows skipped "
+            f"in {self.seconds:.1f}s ({self.users_per_second:.1f} users/s)"
+        )
+
+
+class CohortImporter:
+
+    def __init__(self, university, batch_size=500, workers=None):
+        self.university = university
+        self.batch_size = batch_size
+        self.workers = workers
+
+        # one query each for the whole import
+        self.schools = {
+            school.name.strip().lower(): school
+            for school in School.objects.filter(university=university)
+        }
+        self.departments = {
+            (department.school_id, department.name.strip().lower()): department
+            for department in Department.objects.filter(school__university=university)
+        }
+
+    def run(self, fileobj):
+        """Import every row of an open text file."""
+        result = ImportResult()
+        start = time.perf_counter()
+
+        reader = csv.DictReader(fileobj)
+        missing = REQUIRED_COLUMNS - set(reader.fieldnames or ())
+        if missing:
+            result.errors.append(f"missing columns: {', '.join(sorted(missing))}")
+            return result
+
+        # line numbers as seen in a spreadsheet (header is line 1)
+        rows = enumerate(reader, start=2)
+
+        with PasswordHasherPool(self.workers) as pool:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch, pool, result)
+
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def clean_row(self, row):
+        """Returns (cleaned dict, None) or (None, error message)."""
+        matric_number = (row.get("matric_number") or "").strip()
+        if not matric_number:
+            return None, "matric_number is empty"
+
+        school = self.schools.get((row.get("school") or "").strip().lower())
+        if school is None:
+            return None, f"unknown school {row.get('school')!r}"
+
+        department = self.departments.get(
+            (school.id, (row.get("department") or "").strip().lower())
+        )
+        if department is None:
+            return None, f"department {row.get('department')!r} not in {school.name}"
+
+        email = (row.get("email") or "").strip()
+        if not email and not row.get("password"):
+            # no password and nowhere to send the activation link
+            return None, "needs an email or a password"
+
+        level = (row.get("level") or "").strip()
+        if level and (not level.isdigit() or int(level) < 100):
+            return None, "level must be at least 100"
+
+        return {
+            "matric_number": matric_number,
+            "first_name": (row.get("first_name") or "").strip()[:150],
+            "last_name": (row.get("last_name") or "").strip()[:150],
+            "email": email,
+            "password": row.get("password") or None,
+            "school": school,
+            "department": department,
+            "level": int(level) if level else None,
+        }, None
+
+    def import_batch(self, batch, pool, result):
+        cleaned = []
+        seen = set()
+
+        for line, row in batch:
+            data, error = self.clean_row(row)
+
+            if data and data["matric_number"].lower() in seen:
+                error = "duplicate matric_number in file"
+
+            if error:
+                result.skipped += 1
+                result.errors.append(f"line {line}: {error}")
+                continue
+
+            seen.add(data["matric_number"].lower())
+            cleaned.append((line, data))
+
+        # rows already registered (one query per table for the batch)
+        matric_numbers = [data["matric_number"] for _, data in cleaned]
+        taken = set(
+            User.objects.filter(username__in=matric_numbers).values_list("username", flat=True)
+        ) | set(
+            Profile.objects.filter(matric_number__in=matric_numbers)
+            .values_list("matric_number", flat=True)
+        )
+
+        fresh = []
+        for line, data in cleaned:
+            if data["matric_number"] in taken:
+                result.skipped += 1
+                result.errors.append(f"line {line}: {data['matric_number']} already registered")
+            else:
+                fresh.append(data)
+
+        if not fresh:
+            return
+
+        # only the passwords given in the file cost a hash
+        given = [data["password"] for data in fresh if data["password"]]
+        hashed = iter(pool.hash(given))
+        hashes = [
+            next(hashed) if data["password"] else make_password(None)
+            for data in fresh
+        ]
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(
+                    username=data["matric_number"],
+                    first_name=data["first_name"],
+                    last_name=data["last_name"],
+                    email=data["email"],
+                    password=password_hash,
+                )
+                for data, password_hash in zip(fresh, hashes)
+            ])
+
+            profiles = Profile.objects.bulk_create([
+                Profile(
+                    user=user,
+                    university=self.university,
+                    school=data["school"],
+                    department=data["department"],
+                    level=data["level"],
+                    matric_number=data["matric_number"],
+                    role="student",
+                )
+                for user, data in zip(users, fresh)
+            ])
+
+            # bulk_create sends no post_save
+            track_created(profiles)
+
+        result.created += len(fresh)
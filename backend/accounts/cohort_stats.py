@@ -0,0 +1,164 @@
+"""
+Student counts per (university, school, department, level).
+
+Profile signals (accounts.signals) queue a -1 for the group a student
+leaves and a +1 for the group they join, after the transaction commits.
+CohortBuffer adds the deltas up and applies one UPDATE per touched group,
+so registering or editing a profile costs no extra query on the request.
+Reads sum CohortCount rows: O(groups), however many profiles there are.
+
+Writes that skip model signals (QuerySet.update, raw SQL, a school or
+department being deleted, which nulls the profiles in bulk) make the
+counters drift; rebuild() recounts everything in one aggregate pass.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from campus.buffers import BufferedWriter
+from .models import CohortCount, Profile
+
+GROUP_FIELDS = ("university_id", "school_id", "department_id", "level")
+
+# ?by= names -> what a row shows for them
+DIMENSIONS = {
+    "school": ("school_id", "school__name"),
+    "department": ("department_id", "department__name"),
+    "level": ("level",),
+}
+
+
+def cohort_group(profile):
+    """The group a profile counts towards, None if it isn't a student."""
+    if profile.role != "student":
+        return None
+    return tuple(getattr(profile, field) for field in GROUP_FIELDS)
+
+
+def group_key(group):
+    return ":".join("" if value is None else str(value) for value in group)
+
+
+class CohortBuffer(BufferedWriter):
+    """Items are (group, delta) tuples."""
+
+    def write(self, items):
+        totals = Counter()
+        for group, delta in items:
+            totals[group] += delta
+
+        totals = {group: delta for group, delta in totals.items() if delta}
+        if not totals:
+            return
+
+        # make sure every row exists, then add to it in place
+        CohortCount.objects.bulk_create(
+            [
+                CohortCount(key=group_key(group), **dict(zip(GROUP_FIELDS, group)))
+                for group in totals
+            ],
+            ignore_conflicts=True,
+        )
+
+        now = timezone.now()
+        for group, delta in totals.items():
+            CohortCount.objects.filter(key=group_key(group)).update(
+                students=F("students") + delta,
+                updated_at=now,
+            )
+
+
+cohort_buffer = CohortBuffer(
+    flush_size=settings.COUNTER_FLUSH_SIZE,
+    flush_interval=settings.COUNTER_FLUSH_INTERVAL,
+)
+
+
+def track(old, new):
+    """A student moved from group `old` to `new` (either may be None)."""
+    if old == new:
+        return
+
+    changes = []
+    if old is not None:
+        changes.append((old, -1))
+    if new is not None:
+        changes.append((new, 1))
+
+    # a rolled back registration never counts
+    transaction.on_commit(lambda: cohort_buffer.add(*changes))
+
+
+def track_created(profiles):
+    """bulk_create skips post_save, the cohort import reports its rows here"""
+    changes = [(cohort_group(profile), 1) for profile in profiles]
+    changes = [change for change in changes if change[0] is not None]
+    if changes:
+        transaction.on_commit(lambda: cohort_buffer.add(*changes))
+
+
+def cohort_stats(university_id, by=("school", "department", "level"), **filters):
+    """
+    [{"school": .., "department": .., "level": .., "students": n}, ...]
+    grouped by the `by` dimensions, from the counter table only.
+    filters: school=<id>, department=<id>, level=<int>.
+    """
+    qs = CohortCount.objects.filter(university_id=university_id, students__gt=0)
+
+    for name, value in filters.items():
+        if value is not None:
+            qs = qs.filter(**{DIMENSIONS[name][0]: value})
+
+    fields = [field for name in by for field in DIMENSIONS[name]]
+
+    rows = (
+        qs.values(*fields)
+        .annotate(total=Sum("students"))
+        .order_by(*fields)
+    )
+
+    groups = []
+    for row in rows:
+        group = {}
+        for name in by:
+            if name == "level":
+                group["level"] = row["level"]
+            else:
+                group[name] = (
+                    {"id": row[f"{name}_id"], "name": row[f"{name}__name"]}
+                    if row[f"{name}_id"] else None
+                )
+        group["students"] = row["total"]
+        groups.append(group)
+
+    return groups
+
+
+def rebuild(university_id=None):
+    """
+    Recount from Profile in one GROUP BY pass and replace the counters
+    (of one university, or all). Returns (groups, students).
+    """
+    profiles = Profile.objects.filter(role="student")
+    counters = CohortCount.objects.all()
+    if university_id is not None:
+        profiles = profiles.filter(university_id=university_id)
+        counters = counters.filter(university_id=university_id)
+
+    rows = [
+        CohortCount(
+            key=group_key(tuple(row[field] for field in GROUP_FIELDS)),
+            students=row["students"],
+            **{field: row[field] for field in GROUP_FIELDS},
+        )
+        for row in profiles.values(*GROUP_FIELDS).annotate(students=Count("id")).order_by()
+    ]
+
+    with transaction.atomic():
+        counters.delete()
+        CohortCount.objects.bulk_create(rows, batch_size=1000)
+
+    return len(rows), sum(row.students for row in rows)
@@ -0,0 +1,53 @@
+"""
+Password hashing in a process pool.
+
+make_password is deliberately slow (PBKDF2), so hashing a whole cohort in
+one process is CPU bound on a single core. This module imports no models so
+pool workers started with spawn/forkserver can load it before Django is set up.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def init_worker():
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "unimap_project.settings")
+    django.setup()
+
+
+def hash_password(raw_password):
+    from django.contrib.auth.hashers import make_password
+
+    return make_password(raw_password)
+
+
+class PasswordHasherPool:
+    """
+    with PasswordHasherPool(workers=4) as pool:
+        hashes = pool.hash(["pw1", "pw2"])
+
+    workers=0 hashes in the current process (tests, tiny imports).
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self._executor = None
+
+    def __enter__(self):
+        if self.workers != 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=init_worker,
+            )
+        return self
+
+    def __exit__(self, *exc):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def hash(self, passwords):
+        if self._executor is None:
+            return [hash_password(password) for password in passwords]
+
+        return list(self._executor.map(hash_password, passwords, chunksize=16))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.cohort import CohortImporter
+from campus.models import University
+
+
+class Command(BaseCommand):
+    """
+    python manage.py import_cohort UBa students.csv --workers 4
+    see accounts.cohort for the expected columns.
+    """
+
+    help = "Register a whole cohort of students from a CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("university", help="short_name of the university")
+        parser.add_argument("csv_path")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="password hashing processes (default: one per CPU, 0: no pool)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            university = University.objects.get(short_name__iexact=options["university"])
+        except University.DoesNotExist:
+            raise CommandError(f"University {options['university']!r} not found")
+
+        importer = CohortImporter(
+            university,
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+        )
+
+        # utf-8-sig drops the BOM Excel likes to add
+        with open(options["csv_path"], newline="", encoding="utf-8-sig") as fh:
+            result = importer.run(fh)
+
+        for error in result.errors:
+            self.stderr.write(error)
+
+        self.stdout.write(self.style.SUCCESS(result.summary()))
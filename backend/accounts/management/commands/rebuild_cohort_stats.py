@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.cohort_stats import rebuild
+from campus.models import University
+
+
+class Command(BaseCommand):
+    """
+    Recount the CohortCount table from Profile in one pass. Needed after
+    bulk edits that skip model signals (QuerySet.update, raw SQL);
+    counter changes still queued in running workers are applied on top,
+    so run it when registrations are quiet.
+    """
+
+    help = "Rebuild the per school / department / level student counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--university", help="short_name, default: all universities")
+
+    def handle(self, *args, **options):
+        university_id = None
+        if options["university"]:
+            try:
+                university_id = University.objects.get(
+                    short_name__iexact=options["university"]
+                ).id
+            except University.DoesNotExist:
+                raise CommandError(f"University {options['university']!r} not found")
+
+        groups, students = rebuild(university_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{students} students counted in {groups} groups"
+        ))
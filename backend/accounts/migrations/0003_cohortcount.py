@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-19 19:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def count_existing_profiles(apps, schema_editor):
+    Profile = apps.get_model("accounts", "Profile")
+    CohortCount = apps.get_model("accounts", "CohortCount")
+    fields = ("university_id", "school_id", "department_id", "level")
+
+    CohortCount.objects.bulk_create([
+        CohortCount(
+            key=":".join("" if row[field] is None else str(row[field]) for field in fields),
+            students=row["students"],
+            **{field: row[field] for field in fields},
+        )
+        for row in Profile.objects.filter(role="student")
+        .values(*fields).annotate(students=models.Count("id")).order_by()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_department_remove_profile_department_name_and_more'),
+        ('campus', '0013_dailystats_route_requests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('level', models.IntegerField(blank=True, null=True)),
+                ('students', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('department', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='cohort_counts', to='accounts.department')),
+                ('school', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='cohort_counts', to='accounts.school')),
+                ('university', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='cohort_counts', to='campus.university')),
+            ],
+            options={
+                'ordering': ['university', 'school', 'department', 'level'],
+            },
+        ),
+        migrations.RunPython(count_existing_profiles, migrations.RunPython.noop),
+    ]
@@ -97,4 +97,59 @@ class Profile(models.Model):
     )
 
     def __str__(self):
-        return f"{self.user.username} - {self.university.short_name}"
\ No newline at end of file
+        return f"{self.user.username} - {self.university.short_name}"
+
+
+class CohortCount(models.Model):
+    """
+    Number of students per (university, school, department, level),
+    kept up to date by accounts.cohort_stats so nobody has to count
+    Profile rows.
+    """
+
+    # derived data: no FK constraints, so a counter flush that lands after
+    # a school was deleted can't fail; the delete triggers a recount anyway
+
+    # "university:school:department:level", unique even where the
+    # columns below are NULL (NULLs never collide in a unique index)
+    key = models.CharField(max_length=64, unique=True)
+
+    university = models.ForeignKey(
+        University,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="cohort_counts"
+    )
+
+    school = models.ForeignKey(
+        School,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="cohort_counts"
+    )
+
+    department = models.ForeignKey(
+        Department,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="cohort_counts"
+    )
+
+    level = models.IntegerField(
+        null=True,
+        blank=True
+    )
+
+    students = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["university", "school", "department", "level"]
+
+    def __str__(self):
+        return f"{self.key}: {self.students}"
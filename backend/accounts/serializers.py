@@ -1,6 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
 
+from .activation import activation_user
 from .models import (
     Profile,
     School,
@@ -12,15 +18,17 @@ class RegisterSerializer(serializers.ModelSerializer):
 
     password = serializers.CharField(write_only=True)
 
-    university = serializers.IntegerField()
-    school = serializers.IntegerField(required=False)
-    department = serializers.IntegerField(required=False)
+    # profile fields, write only because they don't exist on User
+    university = serializers.IntegerField(write_only=True)
+    school = serializers.IntegerField(required=False, write_only=True)
+    department = serializers.IntegerField(required=False, write_only=True)
 
-    level = serializers.IntegerField(required=False)
+    level = serializers.IntegerField(required=False, write_only=True)
 
     matric_number = serializers.CharField(
         required=False,
-        allow_blank=True
+        allow_blank=True,
+        write_only=True
     )
 
     class Meta:
@@ -38,14 +46,11 @@ class RegisterSerializer(serializers.ModelSerializer):
             "level",
             "matric_number"
         ]
-        
-    def validate_email(self, value):
-        if User.objects.filter(email=value).exists():
-            raise serializers.ValidationError(
-                "Email already exists"
-            )
 
-        return value
+        # uniqueness of username and email is checked together in validate()
+        extra_kwargs = {
+            "username": {"validators": [UnicodeUsernameValidator()]},
+        }
 
     def validate_level(self, value):
 
@@ -59,11 +64,12 @@ class RegisterSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
 
+        # school / department objects were loaded in validate()
         university_id = validated_data.pop("university")
 
-        school_id = validated_data.pop("school", None)
+        school = validated_data.pop("school", None)
 
-        department_id = validated_data.pop("department", None)
+        department = validated_data.pop("department", None)
 
         level = validated_data.pop("level", None)
 
@@ -72,65 +78,45 @@ class RegisterSerializer(serializers.ModelSerializer):
             None
         )
 
-        user = User.objects.create_user(
-            **validated_data
-        )
-
-        school = None
-        department = None
-
-        if school_id:
-            school = School.objects.get(
-                id=school_id
+        with transaction.atomic():
+            user = User.objects.create_user(
+                **validated_data
             )
 
-        if department_id:
-            department = Department.objects.get(
-                id=department_id
-            )
+            Profile.objects.create(
+                user=user,
+                university_id=university_id,
 
-        Profile.objects.create(
-            user=user,
-            university_id=university_id,
+                school=school,
+                department=department,
 
-            school=school,
-            department=department,
+                level=level,
 
-            level=level,
+                matric_number=matric_number or None,
 
-            matric_number=matric_number or None,
-
-            role="student"
-        )
+                role="student"
+            )
 
         return user
     
     
     def validate(self, attrs):
+        self.validate_unique_user(attrs)
+
         university_id = attrs.get("university")
         school_id = attrs.get("school")
         department_id = attrs.get("department")
 
-        if school_id:
-
-            try:
-                school = School.objects.get(id=school_id)
-            except School.DoesNotExist:
-                raise serializers.ValidationError(
-                    "School not found"
-                )
-
-            if school.university_id != university_id:
-                raise serializers.ValidationError(
-                    "School does not belong to selected university"
-                )
+        school = None
+        department = None
 
         if department_id:
 
+            # one query gives us the department and its school
             try:
-                department = Department.objects.get(
-                    id=department_id
-                )
+                department = Department.objects.select_related(
+                    "school"
+                ).get(id=department_id)
             except Department.DoesNotExist:
                 raise serializers.ValidationError(
                     "Department not found"
@@ -141,7 +127,51 @@ class RegisterSerializer(serializers.ModelSerializer):
                     "Department does not belong to selected school"
                 )
 
+            if school_id:
+                school = department.school
+
+        if school_id and school is None:
+
+            try:
+                school = School.objects.get(id=school_id)
+            except School.DoesNotExist:
+                raise serializers.ValidationError(
+                    "School not found"
+                )
+
+        if school and school.university_id != university_id:
+            raise serializers.ValidationError(
+                "School does not belong to selected university"
+            )
+
+        # hand the loaded objects to create() instead of the ids
+        attrs["school"] = school
+        attrs["department"] = department
+
         return attrs
+
+    def validate_unique_user(self, attrs):
+        """username and email taken? one query for both"""
+        username = attrs.get("username")
+        email = attrs.get("email")
+
+        lookup = Q(username=username)
+        if email:
+            lookup |= Q(email=email)
+
+        errors = {}
+        for taken_username, taken_email in User.objects.filter(
+            lookup
+        ).values_list("username", "email"):
+
+            if taken_username == username:
+                errors["username"] = "A user with that username already exists."
+
+            if email and taken_email == email:
+                errors["email"] = "Email already exists"
+
+        if errors:
+            raise serializers.ValidationError(errors)
     
     
 class ProfileUpdateSerializer(serializers.ModelSerializer):
@@ -176,4 +206,35 @@ class ProfileUpdateSerializer(serializers.ModelSerializer):
                     "Department does not belong to selected school"
                 )
 
-        return attrs
\ No newline at end of file
+        return attrs
+
+class ActivationRequestSerializer(serializers.Serializer):
+    matric_number = serializers.CharField(max_length=150)
+
+
+class ActivationConfirmSerializer(serializers.Serializer):
+    """the uid + token of an activation link and the chosen password"""
+    uid = serializers.CharField()
+    token = serializers.CharField()
+    password = serializers.CharField(write_only=True)
+
+    def validate(self, attrs):
+        user = activation_user(attrs["uid"], attrs["token"])
+        if user is None:
+            raise serializers.ValidationError(
+                "The activation link is invalid or was already used"
+            )
+
+        try:
+            validate_password(attrs["password"], user)
+        except DjangoValidationError as exc:
+            raise serializers.ValidationError({"password": list(exc.messages)})
+
+        attrs["user"] = user
+        return attrs
+
+    def save(self):
+        user = self.validated_data["user"]
+        user.set_password(self.validated_data["password"])
+        user.save(update_fields=["password"])
+        return user
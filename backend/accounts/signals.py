@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from django.contrib.auth.models import User
+
+from campus.models import CampusAdminUser, University
+from .authentication import bump_auth_version
+from .catalog import bump_catalog_version
+from .cohort_stats import cohort_buffer, cohort_group, rebuild, track
+from .models import Department, Profile, School
+
+
+@receiver(post_save, sender=University)
+@receiver(post_delete, sender=University)
+@receiver(post_save, sender=School)
+@receiver(post_delete, sender=School)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def invalidate_catalog(sender, **kwargs):
+    """any change to the tree makes the cached catalog stale"""
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """cached auth entries of this user are stale on every worker"""
+    bump_auth_version(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_save, sender=CampusAdminUser)
+@receiver(post_delete, sender=CampusAdminUser)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    bump_auth_version(instance.user_id)
+
+
+@receiver(post_init, sender=Profile)
+def remember_cohort(sender, instance, **kwargs):
+    """the group as loaded, so a save knows which counter to take from"""
+    if instance.get_deferred_fields() & {"role", "university_id", "school_id", "department_id", "level"}:
+        # .only()/.defer() without the group columns, don't load them
+        # here; a save of such an instance is left to rebuild_cohort_stats
+        instance._cohort_group = None
+        return
+    instance._cohort_group = cohort_group(instance)
+
+
+@receiver(post_save, sender=Profile)
+def count_cohort(sender, instance, created, **kwargs):
+    old = None if created else getattr(instance, "_cohort_group", None)
+    new = cohort_group(instance)
+    track(old, new)
+    instance._cohort_group = new
+
+
+@receiver(post_delete, sender=Profile)
+def uncount_cohort(sender, instance, **kwargs):
+    track(getattr(instance, "_cohort_group", None), None)
+
+
+@receiver(post_delete, sender=University)
+@receiver(post_delete, sender=School)
+@receiver(post_delete, sender=Department)
+def recount_cohorts(sender, instance, **kwargs):
+    """
+    profiles were moved to "none" (or deleted) in bulk without signals,
+    and the counters have no FK cascade
+    """
+    if sender is University:
+        university_id = instance.pk
+    elif sender is School:
+        university_id = instance.university_id
+    else:
+        # the school is still there, departments are deleted first
+        university_id = School.objects.filter(
+            pk=instance.school_id
+        ).values_list("university_id", flat=True).first()
+
+    if university_id is None:
+        return
+
+    def recount():
+        cohort_buffer.flush()
+        rebuild(university_id)
+
+    transaction.on_commit(recount)
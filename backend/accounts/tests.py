@@ -1,3 +1,561 @@
-from django.test import TestCase
+import io
+import os
+import re
+import tempfile
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from campus.counters import counter_buffer
+from campus.models import CampusAdminUser, University
+from .admin import run_cohort_import
+from .apps import require_activation_url
+from .authentication import CachedJWTAuthentication, CampusTokenObtainPairSerializer, user_cache
+from .cohort import CohortImporter
+from .cohort_stats import cohort_buffer, rebuild
+from .models import CohortCount, Department, Profile, School
+from .views import CohortStatsView, ProfileUpdateView, ProfileView, RegisterView
+
+"""tests for the accounts app, run them with 'python manage.py test accounts'."""
+
+
+class CatalogAPITestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.url = "/api/auth/catalog/"
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon"
+        )
+
+        self.school = School.objects.create(
+            university=self.university,
+            name="College of Technology"
+        )
+
+        Department.objects.create(
+            school=self.school,
+            name="Computer Engineering"
+        )
+
+    def tearDown(self):
+        # requests went through the visit counter, don't flush them at exit
+        counter_buffer.clear()
+
+    def test_catalog_returns_nested_tree(self):
+        """
+        One request returns the university with schools and departments.
+        """
+
+        response = self.client.get(self.url, {"university": self.university.id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        data = response.json()
+
+        self.assertEqual(data[0]["short_name"], "UBa")
+        self.assertEqual(
+            data[0]["schools"][0]["departments"][0]["name"],
+            "Computer Engineering"
+        )
+
+    def test_catalog_is_cached_and_supports_etag(self):
+        """
+        A repeat request is not rebuilt and a matching ETag gives 304.
+        """
+
+        first = self.client.get(self.url)
+
+        with mock.patch("accounts.catalog.build_catalog") as build:
+            second = self.client.get(
+                self.url,
+                HTTP_IF_NONE_MATCH=first["ETag"]
+            )
+
+        build.assert_not_called()
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_catalog_is_invalidated_on_change(self):
+        """
+        Adding a department changes the catalog and its ETag.
+        """
+
+        first = self.client.get(self.url)
+
+        Department.objects.create(
+            school=self.school,
+            name="Electrical Engineering"
+        )
+
+        second = self.client.get(self.url)
+
+        self.assertNotEqual(first["ETag"], second["ETag"])
+        self.assertEqual(len(second.json()[0]["schools"][0]["departments"]), 2)
+
+
+class CohortImportTestCase(APITestCase):
+
+    def setUp(self):
+        # the activation endpoints are throttled through the cache
+        cache.clear()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon"
+        )
+
+        school = School.objects.create(
+            university=self.university,
+            name="College of Technology"
+        )
+
+        self.department = Department.objects.create(
+            school=school,
+            name="Computer Engineering"
+        )
+
+    def test_import_creates_users_and_profiles(self):
+        """
+        Valid rows are registered, bad and duplicate rows are reported.
+        """
+
+        User.objects.create_user(username="UBA24E001")
+
+        csv_file = io.StringIO(
+            "matric_number,first_name,last_name,school,department,level,email\n"
+            "UBA24E001,Already,There,College of Technology,Computer Engineering,100,a@example.com\n"
+            "UBA24E002,Bodeh,Delton,college of technology,computer engineering,200,b@example.com\n"
+            "UBA24E003,Kwanyi,Se,College of Technology,Civil Engineering,100,c@example.com\n"
+            "UBA24E004,Ngwa,Ade,College of Technology,Computer Engineering,,d@example.com\n"
+            "UBA24E005,Tanyi,Eno,College of Technology,Computer Engineering,100,\n"
+        )
+
+        result = CohortImporter(self.university, batch_size=2, workers=0).run(csv_file)
+
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.skipped, 3)
+        # could never be activated
+        self.assertIn("line 6: needs an email or a password", result.errors)
+
+        profile = Profile.objects.select_related("user").get(matric_number="UBA24E002")
+
+        self.assertEqual(profile.department, self.department)
+        self.assertEqual(profile.level, 200)
+        # the matric number is public, it must not open the account
+        self.assertFalse(profile.user.has_usable_password())
+        self.assertFalse(profile.user.check_password("UBA24E002"))
+
+    def test_import_hashes_given_passwords(self):
+        csv_file = io.StringIO(
+            "matric_number,first_name,last_name,school,department,password\n"
+            "UBA24E001,Bodeh,Delton,College of Technology,Computer Engineering,s3cret-pass\n"
+        )
+
+        CohortImporter(self.university, workers=0).run(csv_file)
+
+        self.assertTrue(User.objects.get(username="UBA24E001").check_password("s3cret-pass"))
+
+    @override_settings(ACTIVATION_URL="https://app.example.org/activate/")
+    def test_imported_student_activates_account(self):
+        CohortImporter(self.university, workers=0).run(io.StringIO(
+            "matric_number,first_name,last_name,school,department,email\n"
+            "UBA24E001,Bodeh,Delton,College of Technology,Computer Engineering,bodeh@example.com\n"
+        ))
+
+        response = self.client.post("/api/auth/activate/", {"matric_number": "UBA24E001"})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(len(mail.outbox), 1)
+
+        # same answer for an unknown matric number, and no mail
+        unknown = self.client.post("/api/auth/activate/", {"matric_number": "UBA99X999"})
+        self.assertEqual(unknown.data, response.data)
+        self.assertEqual(len(mail.outbox), 1)
+
+        query = parse_qs(urlsplit(re.search(r"\S+\?uid=\S+", mail.outbox[0].body).group()).query)
+        confirm = {"uid": query["uid"][0], "token": query["token"][0], "password": "a-long-new-password"}
+
+        response = self.client.post("/api/auth/activate/confirm/", confirm)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(User.objects.get(username="UBA24E001").check_password("a-long-new-password"))
+
+        # the link is spent once a password is set
+        response = self.client.post("/api/auth/activate/confirm/", confirm)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(ACTIVATION_URL="https://app.example.org/activate/")
+    def test_failed_mail_gets_the_same_answer(self):
+        CohortImporter(self.university, workers=0).run(io.StringIO(
+            "matric_number,first_name,last_name,school,department,email\n"
+            "UBA24E001,Bodeh,Delton,College of Technology,Computer Engineering,bodeh@example.com\n"
+        ))
+
+        unknown = self.client.post("/api/auth/activate/", {"matric_number": "UBA99X999"})
+        with mock.patch("accounts.activation.send_mail", side_effect=ConnectionRefusedError), \
+                self.assertLogs("accounts.activation", "ERROR"):
+            response = self.client.post("/api/auth/activate/", {"matric_number": "UBA24E001"})
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, unknown.data)
+
+    def test_activation_url_must_be_absolute(self):
+        with override_settings(ACTIVATION_URL="/activate/"):
+            with self.assertRaisesMessage(ImproperlyConfigured, "ACTIVATION_URL"):
+                require_activation_url()
+
+        with override_settings(ACTIVATION_URL="https://app.example.org/activate/"):
+            require_activation_url()
+
+    def test_failed_admin_import_leaves_a_report(self):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+
+        with mock.patch.object(CohortImporter, "run", side_effect=RuntimeError("disk full")), \
+                self.assertLogs("accounts.admin", "ERROR"):
+            run_cohort_import(self.university, path, "cohort_import:test")
+
+        report = cache.get("cohort_import:test")
+        self.assertIn("failed", report["summary"])
+        self.assertEqual(report["errors"], ["RuntimeError: disk full"])
+        self.assertFalse(os.path.exists(path))
+
+    def test_import_rejects_missing_columns(self):
+        result = CohortImporter(self.university, workers=0).run(
+            io.StringIO("matric_number,first_name\nUBA24E001,Bodeh\n")
+        )
+
+        self.assertEqual(result.created, 0)
+        self.assertIn("missing columns", result.errors[0])
+
+
+class AccountsQueryBudgetTestCase(APITestCase):
+    """
+    Pins how many queries the accounts flows run. Views are called
+    directly so the site middleware is not part of the count.
+    """
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon"
+        )
+
+        self.school = School.objects.create(
+            university=self.university,
+            name="College of Technology"
+        )
+
+        self.department = Department.objects.create(
+            school=self.school,
+            name="Computer Engineering"
+        )
+
+        self.user = User.objects.create_user(
+            username="student",
+            password="testpassword123"
+        )
+
+        Profile.objects.create(
+            user=self.user,
+            university=self.university,
+            school=self.school,
+            department=self.department,
+            level=200
+        )
+
+    def authorized(self, request):
+        token = RefreshToken.for_user(self.user).access_token
+        request.META["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        return request
+
+    def test_register_query_budget(self):
+        """
+        unique check, department + school, user insert, profile insert
+        (plus the savepoint around the two inserts).
+        """
+
+        request = self.factory.post("/api/auth/register/", {
+            "username": "newstudent",
+            "email": "new@example.com",
+            "password": "testpassword123",
+            "university": self.university.id,
+            "school": self.school.id,
+            "department": self.department.id,
+            "level": 100,
+        }, format="json")
+
+        with self.assertNumQueries(6):
+            response = RegisterView.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        profile = Profile.objects.get(user__username="newstudent")
+        self.assertEqual(profile.department, self.department)
+
+    def test_register_rejects_taken_email(self):
+        User.objects.create_user(username="other", email="taken@example.com")
+
+        request = self.factory.post("/api/auth/register/", {
+            "username": "newstudent",
+            "email": "taken@example.com",
+            "password": "testpassword123",
+            "university": self.university.id,
+        }, format="json")
+
+        response = RegisterView.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("email", response.data)
+
+    def test_profile_query_budget(self):
+        """
+        user and profile with all its relations in one query.
+        """
+
+        user_cache.clear()
+        request = self.authorized(self.factory.get("/api/auth/profile/"))
+
+        with self.assertNumQueries(1):
+            response = ProfileView.as_view()(request)
+
+        self.assertEqual(response.data["department"], "Computer Engineering")
+
+    def test_profile_update_query_budget(self):
+        """
+        user + profile, school and department lookups, one update.
+        """
+
+        user_cache.clear()
+
+        request = self.authorized(self.factory.patch("/api/auth/profile/update/", {
+            "school": self.school.id,
+            "department": self.department.id,
+            "level": 300,
+        }, format="json"))
+
+        with self.assertNumQueries(4):
+            response = ProfileUpdateView.as_view()(request)
+
+        self.assertEqual(response.data["level"], 300)
+        self.assertEqual(response.data["school"], "College of Technology")
+
+
+    def test_cached_user_needs_no_query(self):
+        """
+        A second request within AUTH_CACHE_TTL is answered from memory.
+        """
+
+        ProfileView.as_view()(self.authorized(self.factory.get("/api/auth/profile/")))
+
+        with self.assertNumQueries(0):
+            response = ProfileView.as_view()(
+                self.authorized(self.factory.get("/api/auth/profile/"))
+            )
+
+        self.assertEqual(response.data["level"], 200)
+
+    def test_profile_save_invalidates_cached_user(self):
+        ProfileView.as_view()(self.authorized(self.factory.get("/api/auth/profile/")))
+
+        profile = Profile.objects.get(user=self.user)
+        profile.level = 400
+        profile.save()
+
+        response = ProfileView.as_view()(
+            self.authorized(self.factory.get("/api/auth/profile/"))
+        )
+
+        self.assertEqual(response.data["level"], 400)
+
+    def test_cached_user_is_a_fresh_instance_per_request(self):
+        authentication = CachedJWTAuthentication()
+        token = authentication.get_validated_token(str(RefreshToken.for_user(self.user).access_token))
+
+        first = authentication.get_user(token)
+        first.profile.level = 999
+
+        with self.assertNumQueries(0):
+            second = authentication.get_user(token)
+
+        self.assertIsNot(second, first)
+        self.assertEqual(second.profile.level, 200)
+        self.assertEqual(second.profile.department, self.department)
+
+    def test_becoming_campus_admin_invalidates_cached_user(self):
+        authentication = CachedJWTAuthentication()
+        token = authentication.get_validated_token(str(RefreshToken.for_user(self.user).access_token))
+        self.assertFalse(hasattr(authentication.get_user(token), "campus_admin"))
+
+        CampusAdminUser.objects.create(user=self.user, university=self.university)
+
+        self.assertEqual(authentication.get_user(token).campus_admin.university, self.university)
+
+    def test_token_carries_university_and_role(self):
+        token = CampusTokenObtainPairSerializer.get_token(self.user)
+
+        self.assertEqual(token["university_id"], self.university.id)
+        self.assertEqual(token["role"], "student")
+
+
+class CohortStatsTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        cohort_buffer.clear()
+
+        self.factory = APIRequestFactory()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon"
+        )
+
+        self.school = School.objects.create(
+            university=self.university,
+            name="College of Technology"
+        )
+
+        self.computer = Department.objects.create(
+            school=self.school,
+            name="Computer Engineering"
+        )
+
+        self.civil = Department.objects.create(
+            school=self.school,
+            name="Civil Engineering"
+        )
+
+        self.admin = User.objects.create_user(username="ubaadmin")
+        CampusAdminUser.objects.create(user=self.admin, university=self.university)
+
+    def tearDown(self):
+        cohort_buffer.clear()
+        counter_buffer.clear()
+
+    def register(self, username, department, level=100, role="student"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Profile.objects.create(
+                user=User.objects.create_user(username=username),
+                university=self.university,
+                school=self.school,
+                department=department,
+                level=level,
+                role=role
+            )
+
+    def counts(self):
+        cohort_buffer.flush()
+        return {
+            (row.department_id, row.level): row.students
+            for row in CohortCount.objects.filter(students__gt=0)
+        }
+
+    def test_counters_follow_profile_changes(self):
+        first = self.register("s1", self.computer)
+        self.register("s2", self.computer)
+        self.register("s3", self.civil, level=200)
+        self.register("lecturer", self.civil, role="lecturer")
+
+        self.assertEqual(
+            self.counts(),
+            {(self.computer.id, 100): 2, (self.civil.id, 200): 1}
+        )
+
+        first.department = self.civil
+        first.level = 200
+        with self.captureOnCommitCallbacks(execute=True):
+            first.save()
+
+        self.assertEqual(
+            self.counts(),
+            {(self.computer.id, 100): 1, (self.civil.id, 200): 2}
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.user.delete()
+
+        self.assertEqual(
+            self.counts(),
+            {(self.computer.id, 100): 1, (self.civil.id, 200): 1}
+        )
+
+    def test_stats_are_read_from_the_counters(self):
+        """
+        auth (user + profile + campus admin) and one query on the counter
+        table, however many students there are.
+        """
+
+        for i in range(3):
+            self.register(f"c{i}", self.computer)
+        self.register("v1", self.civil, level=300)
+        cohort_buffer.flush()
+
+        request = self.factory.get("/api/auth/cohort-stats/", {"by": "department"})
+        token = RefreshToken.for_user(self.admin).access_token
+        request.META["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+
+        with self.assertNumQueries(2):
+            response = CohortStatsView.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["students"], 4)
+        self.assertEqual(response.data["groups"], [
+            {"department": {"id": self.computer.id, "name": "Computer Engineering"}, "students": 3},
+            {"department": {"id": self.civil.id, "name": "Civil Engineering"}, "students": 1},
+        ])
+
+    def test_stats_need_campus_staff(self):
+        student = self.register("s1", self.computer)
+        self.client.force_authenticate(student.user)
+
+        response = self.client.get("/api/auth/cohort-stats/")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_rebuild_fixes_drift(self):
+        self.register("s1", self.computer)
+        self.register("s2", self.computer)
+        self.counts()
+
+        # bulk update, no signals
+        Profile.objects.update(level=400)
+
+        self.assertEqual(rebuild(), (1, 2))
+        self.assertEqual(self.counts(), {(self.computer.id, 400): 2})
+
+    def test_deleting_a_department_recounts(self):
+        self.register("s1", self.civil)
+        self.counts()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.civil.delete()
+
+        self.assertEqual(self.counts(), {(None, 100): 1})
+
+    def test_cohort_import_is_counted(self):
+        csv_file = io.StringIO(
+            "matric_number,first_name,last_name,school,department,level,email\n"
+            "UBA24E002,Bodeh,Delton,College of Technology,Computer Engineering,200,b@example.com\n"
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CohortImporter(self.university, workers=0).run(csv_file)
+
+        self.assertEqual(self.counts(), {(self.computer.id, 200): 1})
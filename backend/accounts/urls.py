@@ -2,16 +2,22 @@ from django.urls import path
 
 from .views import (
     RegisterView,
+    ActivationRequestView,
+    ActivationConfirmView,
     ProfileView,
     ProfileUpdateView,
     UniversityListView,
     SchoolListView,
     DepartmentListView,
+    CatalogView,
+    CohortStatsView,
 )
 
 
 urlpatterns = [
     path("register/", RegisterView.as_view(), name="register"),
+    path("activate/", ActivationRequestView.as_view(), name="activate"),
+    path("activate/confirm/", ActivationConfirmView.as_view(), name="activate-confirm"),
     path("profile/", ProfileView.as_view(), name="profile"),
 
     path(
@@ -29,6 +35,16 @@ urlpatterns = [
         DepartmentListView.as_view(),
         name="departments"),
     
+    path(
+        "catalog/",
+        CatalogView.as_view(),
+        name="catalog"),
+
+    path(
+        "cohort-stats/",
+        CohortStatsView.as_view(),
+        name="cohort-stats"),
+
     path(
     "profile/update/",
     ProfileUpdateView.as_view(),
@@ -1,26 +1,85 @@
+from django.contrib.auth.models import User
+from django.http import HttpResponse
 from rest_framework import generics
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework_simplejwt.views import TokenObtainPairView
 from campus.models import University
-from .models import School, Department
+from campus.permissions import IsCampusStaff, staff_university_id
+from campus.throttling import RegisterThrottle
+from .activation import send_activation
+from .authentication import CampusTokenObtainPairSerializer
+from .catalog import get_catalog
+from .cohort_stats import DIMENSIONS, cohort_stats
+from .models import Profile, School, Department
 from .serializers import (
+    ActivationConfirmSerializer,
+    ActivationRequestSerializer,
     RegisterSerializer,
     ProfileUpdateSerializer
 )
 
 
+def get_profile(user):
+    """
+    the user's profile with university, school and department.
+    CachedJWTAuthentication already loaded it with the user, only other
+    authentication paths need the query.
+    """
+    if User.profile.related.is_cached(user):
+        return user.profile
+
+    return Profile.objects.select_related(
+        "university",
+        "school",
+        "department",
+    ).get(user=user)
 
 
 class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
+    throttle_classes = [RegisterThrottle]
+
+
+class ActivationRequestView(APIView):
+    """
+    mail the activation link of an imported account. The answer is the
+    same whether or not the matric number exists, so it can't be used to
+    find out who is registered.
+    """
+    throttle_classes = [RegisterThrottle]
+
+    def post(self, request):
+        serializer = ActivationRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        send_activation(serializer.validated_data["matric_number"].strip())
+
+        return Response(
+            {"message": "If the account needs activating, a link was sent to its email address"},
+            status=202
+        )
+
+
+class ActivationConfirmView(APIView):
+    """set the first password of an imported account from its link"""
+    throttle_classes = [RegisterThrottle]
+
+    def post(self, request):
+        serializer = ActivationConfirmSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        user = serializer.save()
+
+        return Response({"message": "Account activated", "username": user.username})
 
 
 class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        profile = request.user.profile
+        profile = get_profile(request.user)
         
         return Response({
             "username": request.user.username,
@@ -125,12 +184,42 @@ class DepartmentListView(APIView):
         return Response(data)
     
     
+class CatalogView(APIView):
+    """
+    universities with their schools and departments in one response.
+    ?university=<id> limits it to one university.
+    Served from cache, answers 304 when the client's ETag is still current.
+    """
+    authentication_classes = []
+
+    def get(self, request):
+
+        university_id = request.GET.get("university")
+
+        if university_id and not university_id.isdigit():
+            return Response(
+                {"error": "university must be an id"},
+                status=400
+            )
+
+        etag, body = get_catalog(int(university_id) if university_id else None)
+
+        if request.headers.get("If-None-Match") == etag:
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(body, content_type="application/json")
+
+        response["ETag"] = etag
+        response["Cache-Control"] = "public, max-age=300"
+        return response
+
+
 class ProfileUpdateView(APIView):
     permission_classes = [IsAuthenticated]
 
     def patch(self, request):
 
-        profile = request.user.profile
+        profile = get_profile(request.user)
 
         serializer = ProfileUpdateSerializer(
             profile,
@@ -161,4 +250,54 @@ class ProfileUpdateView(APIView):
             "level": profile.level,
 
             "matric_number": profile.matric_number
-        })
\ No newline at end of file
+        })
+
+
+class CohortStatsView(APIView):
+    """
+    students per school / department / level for campus admins.
+    ?by=school,department,level picks the grouping (default: all three),
+    ?school= ?department= ?level= narrow it down, superusers pick the
+    ?university=. Read from the CohortCount counters, never from Profile.
+    """
+    permission_classes = [IsCampusStaff]
+
+    def get(self, request):
+
+        university_id = staff_university_id(request)
+        if university_id is None:
+            return Response(
+                {"error": "university is required"},
+                status=400
+            )
+
+        by = [name for name in request.GET.get("by", "school,department,level").split(",") if name]
+        if not by or any(name not in DIMENSIONS for name in by):
+            return Response(
+                {"error": f"by must be a comma separated list of {', '.join(DIMENSIONS)}"},
+                status=400
+            )
+
+        filters = {}
+        for name in DIMENSIONS:
+            value = request.GET.get(name)
+            if value:
+                if not value.isdigit():
+                    return Response(
+                        {"error": f"{name} must be a number"},
+                        status=400
+                    )
+                filters[name] = int(value)
+
+        groups = cohort_stats(university_id, by, **filters)
+
+        return Response({
+            "university": university_id,
+            "students": sum(group["students"] for group in groups),
+            "groups": groups,
+        })
+
+
+class CampusTokenObtainPairView(TokenObtainPairView):
+    """login, the access token carries university_id and role"""
+    serializer_class = CampusTokenObtainPairSerializer
@@ -1,10 +1,22 @@
 from django.contrib.admin import AdminSite
 from django.contrib import admin
-from django.utils import timezone
-from django.db import models
+from django.core.exceptions import PermissionDenied
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.urls import path
+
+from . import live, metrics, stats
+from .exports import ExportMixin
 
 # Import models
-from .models import Building, SiteVisit, DailyStats, University, CampusAdminUser
+from .models import (
+    Building,
+    BuildingPopularity,
+    SiteVisit,
+    DailyStats,
+    University,
+    CampusAdminUser,
+)
 
 # Import default auth models
 from django.contrib.auth.models import User, Group
@@ -29,6 +41,39 @@ class CampusAdminSite(AdminSite):
         extra_context.update(admin_index(request))
         return super().index(request, extra_context)
 
+    def get_urls(self):
+        urls = [
+            path("metrics/", self.admin_view(self.metrics_view), name="metrics"),
+            path("live/", self.admin_view(self.live_view), name="live"),
+        ]
+        return urls + super().get_urls()
+
+    def metrics_view(self, request):
+        """Prometheus text exposition, merged across all workers."""
+        if not request.user.is_superuser:
+            raise PermissionDenied
+
+        return HttpResponse(
+            metrics.render_prometheus(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+    def live_view(self, request):
+        """Visitor / route-request deltas since ?cursor=, polled by the index page."""
+        if request.user.is_superuser:
+            university_id = None
+        elif hasattr(request.user, "campus_admin"):
+            university_id = request.user.campus_admin.university_id
+        else:
+            raise PermissionDenied
+
+        # admin_view already marks it never_cache
+        return JsonResponse(dict(
+            live.deltas(university_id, request.GET.get("cursor")),
+            interval=settings.LIVE_STATS_INTERVAL,
+        ))
+
 
 # Instantiate custom admin site
 campus_admin_site = CampusAdminSite(name="campus_admin")
@@ -53,49 +98,18 @@ except AlreadyRegistered:
 # ---------------------------
 def admin_index(request):
     """
-    Returns visitor statistics.
+    Returns visitor statistics from the cached snapshot (see campus.stats).
     Superuser → sees all universities
     Campus admin → sees only their university
     """
 
-    today = timezone.now().date()
-
     # super user global stats
     if request.user.is_superuser:
-        total_visitors = DailyStats.objects.aggregate(
-            total=models.Sum("visitors")
-        )["total"] or 0
-
-        visitors_today = DailyStats.objects.filter(date=today).aggregate(
-            total=models.Sum("visitors")
-        )["total"] or 0
-
-        return {
-            "total_visitors": total_visitors,
-            "visitors_today": visitors_today,
-        }
+        return stats.get_snapshot()
 
     # campus admin only their university
     if hasattr(request.user, "campus_admin"):
-        university = request.user.campus_admin.university
-
-        total_visitors = DailyStats.objects.filter(
-            university=university
-        ).aggregate(
-            total=models.Sum("visitors")
-        )["total"] or 0
-
-        visitors_today = DailyStats.objects.filter(
-            university=university,
-            date=today
-        ).aggregate(
-            total=models.Sum("visitors")
-        )["total"] or 0
-
-        return {
-            "total_visitors": total_visitors,
-            "visitors_today": visitors_today,
-        }
+        return stats.get_snapshot(request.user.campus_admin.university)
 
     return {}
 
@@ -135,16 +149,19 @@ class BuildingAdmin(admin.ModelAdmin):
 # Admin for DailyStats
 # ---------------------------
 @admin.register(DailyStats, site=campus_admin_site)
-class DailyStatsAdmin(admin.ModelAdmin):
+class DailyStatsAdmin(ExportMixin, admin.ModelAdmin):
 
     list_display = (
         "university",
         "date",
         "visitors",
+        "route_requests",
     )
 
     ordering = ("-date",)
 
+    export_fields = ("university__short_name", "date", "visitors", "route_requests")
+
     def get_queryset(self, request):
         qs = super().get_queryset(request)
 
@@ -159,13 +176,35 @@ class DailyStatsAdmin(admin.ModelAdmin):
 # Admin for SiteVisit
 # ---------------------------
 @admin.register(SiteVisit, site=campus_admin_site)
-class SiteVisitAdmin(admin.ModelAdmin):
+class SiteVisitAdmin(ExportMixin, admin.ModelAdmin):
     """Filter site visits per university via building."""
     list_display = ("session_key","university","first_visit","last_visit",)
 
+    export_fields = ("id", "session_key", "university__short_name", "first_visit", "last_visit")
+
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         if request.user.is_superuser:
             return qs
         # Filter by user's university through building
-        return qs.filter(university=request.user.campus_admin.university)
\ No newline at end of file
+        return qs.filter(university=request.user.campus_admin.university)
+
+
+# ---------------------------
+# Admin for BuildingPopularity
+# ---------------------------
+@admin.register(BuildingPopularity, site=campus_admin_site)
+class BuildingPopularityAdmin(admin.ModelAdmin):
+    """Read-only totals, filled by the analytics event buffer."""
+    list_display = ("building", "university", "searches", "views", "route_requests", "updated_at")
+    ordering = ("-route_requests",)
+    readonly_fields = ("building", "university", "searches", "views", "route_requests")
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related("building", "university")
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(university=request.user.campus_admin.university)
@@ -0,0 +1,129 @@
+"""
+Batched analytics events (searches, popup opens, route requests).
+
+The event API only validates and queues; EventBuffer resolves universities
+and buildings and writes the whole batch with bulk_create. Each flush also
+folds the batch into BuildingPopularity so other features can ask for the
+most looked-up buildings without scanning the events table.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .buffers import BufferedWriter
+from .models import AnalyticsEvent, Building, BuildingPopularity, University
+
+# event kind -> BuildingPopularity column
+POPULARITY_FIELDS = {
+    "search": "searches",
+    "popup": "views",
+    "route": "route_requests",
+}
+
+
+class EventBuffer(BufferedWriter):
+
+    def write(self, items):
+        # a handful of universities, cheaper than matching case-insensitively
+        universities = {
+            short_name.lower(): uni_id
+            for uni_id, short_name in University.objects.values_list("id", "short_name")
+        }
+
+        building_ids = {item["building"] for item in items if item.get("building")}
+        buildings = dict(
+            Building.objects.filter(id__in=building_ids).values_list("id", "university_id")
+        )
+
+        events = []
+        for item in items:
+            university_id = universities.get(item["university"])
+            if university_id is None:
+                continue
+
+            # ignore buildings that are gone or belong to another campus
+            building_id = item.get("building")
+            if buildings.get(building_id) != university_id:
+                building_id = None
+
+            origin = item.get("origin") or (None, None)
+            destination = item.get("destination") or (None, None)
+
+            events.append(AnalyticsEvent(
+                university_id=university_id,
+                kind=item["kind"],
+                building_id=building_id,
+                query=item.get("query", "")[:100],
+                origin_lat=origin[0],
+                origin_lng=origin[1],
+                destination_lat=destination[0],
+                destination_lng=destination[1],
+                created_at=item["created_at"],
+            ))
+
+        with transaction.atomic():
+            AnalyticsEvent.objects.bulk_create(events)
+            update_popularity(events)
+
+        # top buildings changed, rebuild the admin dashboards that show them
+        from .stats import refresh_snapshots
+        refresh_snapshots({event.university_id for event in events})
+
+
+def update_popularity(events):
+    """Add a batch of events to the BuildingPopularity totals."""
+    totals = Counter()
+    owners = {}
+
+    for event in events:
+        if event.building_id is None:
+            continue
+        totals[(event.building_id, POPULARITY_FIELDS[event.kind])] += 1
+        owners[event.building_id] = event.university_id
+
+    if not totals:
+        return
+
+    BuildingPopularity.objects.bulk_create(
+        [
+            BuildingPopularity(building_id=building_id, university_id=university_id)
+            for building_id, university_id in owners.items()
+        ],
+        ignore_conflicts=True,
+    )
+
+    for building_id in owners:
+        changes = {
+            field: F(field) + totals[(building_id, field)]
+            for field in POPULARITY_FIELDS.values()
+            if totals[(building_id, field)]
+        }
+        BuildingPopularity.objects.filter(building_id=building_id).update(**changes)
+
+
+def popular_buildings(university, kind=None, limit=10):
+    """
+    Most looked-up buildings of a university (of every campus when None).
+
+    kind narrows the ranking to "search", "popup" or "route",
+    otherwise all interactions are added up.
+    """
+    qs = BuildingPopularity.objects.select_related("building")
+
+    if university is not None:
+        qs = qs.filter(university=university)
+
+    if kind:
+        qs = qs.order_by(f"-{POPULARITY_FIELDS[kind]}")
+    else:
+        qs = qs.order_by((F("searches") + F("views") + F("route_requests")).desc())
+
+    return list(qs[:limit])
+
+
+event_buffer = EventBuffer(
+    flush_size=settings.ANALYTICS_FLUSH_SIZE,
+    flush_interval=settings.ANALYTICS_FLUSH_INTERVAL,
+)
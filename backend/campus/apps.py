@@ -1,6 +1,33 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# caches that live inside one process
+LOCAL_CACHES = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+def require_shared_cache():
+    """
+    Page versions, the catalog, cached users, cluster tokens and geofence
+    tokens are invalidated through the cache; with a cache per process the
+    other workers would serve the old ones for up to a day.
+    """
+    backend = settings.CACHES["default"]["BACKEND"]
+    if settings.WEB_CONCURRENCY > 1 and backend in LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            f"{settings.WEB_CONCURRENCY} workers need a shared cache: set REDIS_URL "
+            "or run a single worker (WEB_CONCURRENCY=1)"
+        )
 
 
 class CampusConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'campus'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        require_shared_cache()
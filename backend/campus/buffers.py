@@ -0,0 +1,129 @@
+"""
+In-memory write buffers.
+
+Collects rows in memory and writes them in one go once the buffer is big
+enough or old enough, so hot endpoints never wait on an INSERT per event.
+Each buffer has one background flusher thread (started on first use in
+every worker process): add() wakes it when the buffer is full, and on its
+own it wakes every flush_interval, so items added in a quiet period are
+written too, not only when the next one arrives.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedWriter(ABC):
+    """
+    Base class for size/time triggered batch writers.
+
+    Subclasses implement write(items) which receives the whole batch.
+    """
+
+    def __init__(self, flush_size=200, flush_interval=10):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._items = []
+        self._last_flush = time.monotonic()
+
+        self._wake = threading.Event()
+        self._flusher_pid = None
+
+        # don't lose what is still buffered when the worker shuts down
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self._items)
+
+    @abstractmethod
+    def write(self, items):
+        """Write one batch; an exception drops it (logged and counted)."""
+
+    def add(self, *items):
+        """Queue items; never blocks on the database."""
+        with self._lock:
+            self._items.extend(items)
+            full = len(self._items) >= self.flush_size
+
+        if not getattr(settings, "BUFFERED_WRITES_ASYNC", True):
+            if full:
+                self.flush()
+            return
+
+        self._ensure_flusher()
+        if full:
+            self._wake.set()
+
+    def _ensure_flusher(self):
+        # threads don't survive a fork, each gunicorn worker starts its own
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(
+            target=self._run_flusher, name=f"{type(self).__name__}-flusher", daemon=True
+        ).start()
+
+    def _run_flusher(self):
+        while True:
+            woken = self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+            due = woken or (
+                self._items and time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if not due:
+                continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("%s flusher failed", type(self).__name__)
+            finally:
+                # each flush gets a fresh connection, don't keep one open
+                connections.close_all()
+
+    def flush(self):
+        """Write everything buffered so far. Returns the number of items."""
+        # only one flush at a time, a second caller just waits its turn
+        with self._flush_lock:
+            with self._lock:
+                items, self._items = self._items, []
+                self._last_flush = time.monotonic()
+
+            if not items:
+                return 0
+
+            try:
+                self.write(items)
+            except Exception:
+                logger.exception(
+                    "%s dropped %d buffered items", type(self).__name__, len(items)
+                )
+                metrics.inc(
+                    "campus_buffered_items_dropped_total", len(items),
+                    writer=type(self).__name__,
+                )
+                return 0
+
+            return len(items)
+
+    def clear(self):
+        """Drop everything buffered without writing it."""
+        with self._lock:
+            self._items = []
+            self._last_flush = time.monotonic()
@@ -0,0 +1,196 @@
+"""
+Offline bundle of one university's map data for the PWA.
+
+Everything the map loads after the page itself (university, boundary,
+buildings and their icons as data URIs, the walkway graph) is packed
+into one gzip'd JSON document named after the hash of its content. The
+hash changes exactly when the content does, so the bundle can be served
+as immutable and the service worker only needs to poll a tiny manifest
+to know whether its copy is current.
+
+Bundles follow the same data version as the page cache (bumped by
+campus.signals on University/Building changes, and by an OSM import of
+the walkways): the change schedules a rebuild after commit, and a
+request that finds no bundle for the current version builds it itself.
+The JSON is serialised with sorted keys and compressed with mtime=0, so
+every worker builds byte-identical bundles.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Building, University, WalkEdge, WalkNode
+from .pagecache import campus_boundary
+from .serializers import BuildingSerializer
+from .sync import to_version
+from .versions import map_version
+
+logger = logging.getLogger(__name__)
+
+# old bundles stay downloadable a while after a change, clients that just
+# read the previous manifest can finish their download
+BUNDLE_TTL = 60 * 60 * 24 * 7
+
+_pending = set()  # university ids waiting for a rebuild, for the job thread
+_running = False
+_jobs_lock = threading.Lock()
+
+
+def manifest_key(university_id):
+    return f"bundle_manifest:{university_id}:{map_version(university_id)}"
+
+
+def data_key(university_id, version):
+    return f"bundle_data:{university_id}:{version}"
+
+
+def icon_data_uri(storage, name):
+    """the icon file as a data URI, None if it's missing or too big"""
+    try:
+        if storage.size(name) > settings.BUNDLE_MAX_ICON_BYTES:
+            return None
+        with storage.open(name, "rb") as fh:
+            data = fh.read()
+    except (OSError, ValueError):
+        return None
+
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    return f"data:{content_type};base64,{base64.b64encode(data).decode()}"
+
+
+def walkways(university):
+    """the walking network: nodes [id, lat, lng], edges [source, target, metres, geometry]"""
+    return {
+        "nodes": [
+            list(node)
+            for node in WalkNode.objects
+            .filter(university=university)
+            .order_by("id")
+            .values_list("id", "latitude", "longitude")
+        ],
+        "edges": [
+            list(edge)
+            for edge in WalkEdge.objects
+            .filter(university=university)
+            .order_by("id")
+            .values_list("source_id", "target_id", "length", "geometry")
+        ],
+    }
+
+
+def build_bundle(university):
+    buildings = Building.objects.filter(university=university).order_by("id")
+    last_change = buildings.aggregate(last=Max("updated_at"))["last"]
+
+    icons = {}
+    for building in buildings:
+        if building.icon:
+            # the resized icon the serializer points at, the upload until it exists
+            name = (building.images or {}).get("icon", {}).get("icon", {}).get("png")
+            storage = default_storage if name else building.icon.storage
+            name = name or building.icon.name
+            uri = icon_data_uri(storage, name)
+            if uri:
+                icons[storage.url(name)] = uri
+
+    return {
+        "university": {
+            "id": university.id,
+            "name": university.name,
+            "short_name": university.short_name,
+        },
+        "boundary": campus_boundary(university),
+        # ?since= for the buildings API (campus.sync), so a client holding
+        # this bundle only downloads what changed afterwards
+        "version": (
+            max(to_version(last_change) - settings.BUILDINGS_SYNC_OVERLAP * 1000, 0)
+            if last_change else 0
+        ),
+        "buildings": BuildingSerializer(buildings, many=True).data,
+        "icons": icons,
+        "walkways": walkways(university),
+    }
+
+
+def refresh_bundle(university_id):
+    """Build and store the bundle for the current data version."""
+    key = manifest_key(university_id)
+
+    university = University.objects.filter(id=university_id, active=True).first()
+    if university is None:
+        return None
+
+    body = json.dumps(build_bundle(university), sort_keys=True, separators=(",", ":")).encode()
+    gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+    version = hashlib.sha256(body).hexdigest()[:16]
+
+    manifest = {
+        "university": university.short_name,
+        "version": version,
+        "size": len(gzipped),
+        "generated_at": timezone.now().isoformat(),
+    }
+
+    cache.set(data_key(university_id, version), gzipped, BUNDLE_TTL)
+    cache.set(key, manifest, BUNDLE_TTL)
+    return manifest
+
+
+def get_manifest(university_id):
+    return cache.get(manifest_key(university_id)) or refresh_bundle(university_id)
+
+
+def get_bundle(university_id, version):
+    """gzip bytes of that bundle version, None once it's gone"""
+    return cache.get(data_key(university_id, version))
+
+
+def _run_pending():
+    global _running
+    try:
+        while True:
+            with _jobs_lock:
+                if not _pending:
+                    _running = False
+                    return
+                university_id = _pending.pop()
+
+            try:
+                # a request may have built it since
+                if cache.get(manifest_key(university_id)) is None:
+                    refresh_bundle(university_id)
+            except Exception:
+                logger.exception("Bundle rebuild failed for university %s", university_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_refresh(university_id):
+    """
+    after a data change: rebuild in the background (inline under tests).
+    One thread per process works through the pending universities, a
+    burst of edits to one university rebuilds its bundle once.
+    """
+    global _running
+    if not settings.BUFFERED_WRITES_ASYNC:
+        refresh_bundle(university_id)
+        return
+
+    with _jobs_lock:
+        _pending.add(university_id)
+        if _running:
+            return
+        _running = True
+
+    threading.Thread(target=_run_pending, name="offline-bundle", daemon=True).start()
@@ -0,0 +1,162 @@
+"""
+Server side marker clustering for the map.
+
+The browser used to cluster every building itself (Leaflet.markercluster)
+on each zoom, which freezes low-end phones on campuses with many points.
+The clusters of a university are computed once per data version for the
+map's zoom range (TILE_MIN_ZOOM..TILE_MAX_ZOOM) and /api/clusters/ only
+returns the clusters and points inside the requested bbox.
+
+The index is hierarchical, from the highest zoom down: the highest zoom
+shows every building, each lower zoom greedily merges the nodes of the
+zoom above that lie within CLUSTER_RADIUS pixels (grid buckets, so a level
+costs O(n)), placing the cluster at their weighted centre. A cluster's
+expansion_zoom is the zoom it was merged from, where it falls apart.
+Buildings with a footprint carry the outline simplified for the level.
+
+The index follows the page cache's data version (bumped by campus.signals
+on every Building change), is shared through the cache and kept in each
+worker's memory while it is current.
+"""
+import math
+import threading
+import uuid
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .footprints import footprint_at
+from .models import Building
+from .versions import map_version
+
+INDEX_TTL = 60 * 60 * 24
+
+_local_indexes = {}  # university id -> (token, index)
+_lock = threading.Lock()
+
+
+def world_pixel(lat, lng, zoom):
+    size = 256 * 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = (lng + 180.0) / 360.0 * size
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * size
+    return x, y
+
+
+def cluster_level(nodes, zoom, radius):
+    """merge the nodes of zoom + 1 that are within radius pixels at zoom"""
+    projected = [world_pixel(node["lat"], node["lng"], zoom) for node in nodes]
+
+    grid = {}
+    for index, (x, y) in enumerate(projected):
+        grid.setdefault((int(x // radius), int(y // radius)), []).append(index)
+
+    taken = [False] * len(nodes)
+    merged = []
+    for index, node in enumerate(nodes):
+        if taken[index]:
+            continue
+        taken[index] = True
+
+        x, y = projected[index]
+        cell_x, cell_y = int(x // radius), int(y // radius)
+        group = [index]
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other in grid.get((cell_x + dx, cell_y + dy), ()):
+                    if taken[other]:
+                        continue
+                    ox, oy = projected[other]
+                    if (ox - x) ** 2 + (oy - y) ** 2 <= radius ** 2:
+                        taken[other] = True
+                        group.append(other)
+
+        if len(group) == 1:
+            merged.append(node)
+            continue
+
+        count = sum(nodes[i]["count"] for i in group)
+        merged.append({
+            "cluster_id": f"{zoom}:{len(merged)}",
+            "lat": sum(nodes[i]["lat"] * nodes[i]["count"] for i in group) / count,
+            "lng": sum(nodes[i]["lng"] * nodes[i]["count"] for i in group) / count,
+            "count": count,
+            "expansion_zoom": zoom + 1,
+        })
+
+    return merged
+
+
+def with_footprint(node, outlines, zoom):
+    """a building with its outline simplified for zoom, when it has one"""
+    footprint = footprint_at(outlines.get(node.get("id")), zoom)
+    return dict(node, footprint=footprint) if footprint else node
+
+
+def build_index(university_id):
+    """{zoom: (nodes sorted by lng, their lngs)} for the map's zoom range"""
+    buildings = (
+        Building.objects
+        .filter(university_id=university_id)
+        .order_by("id")
+        .values("id", "name", "category", "latitude", "longitude", "footprint_levels")
+    )
+    nodes = [
+        {
+            "id": b["id"],
+            "name": b["name"],
+            "category": b["category"],
+            "lat": b["latitude"],
+            "lng": b["longitude"],
+            "count": 1,
+        }
+        for b in buildings
+    ]
+    outlines = {b["id"]: b["footprint_levels"] for b in buildings if b["footprint_levels"]}
+
+    levels = {}
+    for zoom in range(settings.TILE_MAX_ZOOM, settings.TILE_MIN_ZOOM - 1, -1):
+        if zoom < settings.TILE_MAX_ZOOM:
+            nodes = cluster_level(nodes, zoom, settings.CLUSTER_RADIUS)
+        ordered = sorted(
+            (with_footprint(node, outlines, zoom) for node in nodes),
+            key=lambda node: node["lng"],
+        )
+        levels[zoom] = (ordered, [node["lng"] for node in ordered])
+
+    return levels
+
+
+def get_index(university_id):
+    key = f"cluster_index:{university_id}:{map_version(university_id)}"
+
+    # a small token tells whether the worker's copy is still the shared one,
+    # also after the cache was flushed and the version numbers started over
+    token = cache.get(f"{key}:token")
+    local = _local_indexes.get(university_id)
+    if token is not None and local is not None and local[0] == token:
+        return local[1]
+
+    index = cache.get(key) if token is not None else None
+    if index is None:
+        index = build_index(university_id)
+        token = uuid.uuid4().hex
+        cache.set_many({key: index, f"{key}:token": token}, INDEX_TTL)
+
+    with _lock:
+        _local_indexes[university_id] = (token, index)
+    return index
+
+
+def clusters(university_id, bbox, zoom):
+    """clusters and points of one zoom inside bbox (west, south, east, north)"""
+    zoom = min(max(zoom, settings.TILE_MIN_ZOOM), settings.TILE_MAX_ZOOM)
+    nodes, lngs = get_index(university_id)[zoom]
+    west, south, east, north = bbox
+
+    return zoom, [
+        node
+        for node in nodes[bisect_left(lngs, west):bisect_right(lngs, east)]
+        if south <= node["lat"] <= north
+    ]
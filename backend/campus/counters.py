@@ -0,0 +1,113 @@
+"""
+In-memory visitor / route-request counters.
+
+count() is called on the hot path. It queues the increment for the
+DailyStats flush (one UPDATE per university and day instead of one per
+visitor) and bumps a per-day total in the cache, which is what the live
+admin dashboard reads its deltas from.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .buffers import BufferedWriter
+from .models import DailyStats, University
+
+KINDS = ("visitors", "route_requests")
+
+# live totals only matter for today, keep them a bit longer for the rollover
+LIVE_TTL = 60 * 60 * 48
+
+
+def live_key(date, university_id, kind):
+    return f"live:{date.isoformat()}:{university_id}:{kind}"
+
+
+class CounterBuffer(BufferedWriter):
+    """Items are (kind, university_id, date) tuples."""
+
+    def write(self, items):
+        totals = Counter(items)
+        days = {(university_id, date) for _, university_id, date in totals}
+
+        # make sure every row exists, then add to it in place
+        DailyStats.objects.bulk_create(
+            [
+                DailyStats(university_id=university_id, date=date)
+                for university_id, date in days
+            ],
+            ignore_conflicts=True,
+        )
+
+        for university_id, date in days:
+            changes = {
+                kind: F(kind) + totals[(kind, university_id, date)]
+                for kind in KINDS
+                if totals[(kind, university_id, date)]
+            }
+            DailyStats.objects.filter(
+                university_id=university_id,
+                date=date,
+            ).update(**changes)
+
+        from .stats import refresh_snapshots
+        refresh_snapshots({university_id for university_id, _ in days})
+
+
+counter_buffer = CounterBuffer(
+    flush_size=settings.COUNTER_FLUSH_SIZE,
+    flush_interval=settings.COUNTER_FLUSH_INTERVAL,
+)
+
+
+def count(kind, university_id):
+    """Record one visitor / route request for today."""
+    today = timezone.now().date()
+
+    counter_buffer.add((kind, university_id, today))
+
+    key = live_key(today, university_id, kind)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # first hit of the day
+        cache.add(key, 0, LIVE_TTL)
+        cache.incr(key)
+
+
+def live_totals(university_ids):
+    """Today's totals per university straight from the cache."""
+    today = timezone.now().date()
+    keys = {
+        live_key(today, university_id, kind): (university_id, kind)
+        for university_id in university_ids
+        for kind in KINDS
+    }
+
+    found = cache.get_many(keys)
+
+    totals = {university_id: dict.fromkeys(KINDS, 0) for university_id in university_ids}
+    for key, value in found.items():
+        university_id, kind = keys[key]
+        totals[university_id][kind] = value
+
+    return totals
+
+
+def university_ids():
+    """short_name (lower case) -> id for every active university (cached)."""
+    ids = cache.get("active_university_ids")
+
+    if ids is None:
+        ids = {
+            short_name.lower(): university_id
+            for university_id, short_name in University.objects.filter(
+                active=True
+            ).values_list("id", "short_name")
+        }
+        cache.set("active_university_ids", ids, 300)
+
+    return ids
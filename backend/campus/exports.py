@@ -0,0 +1,163 @@
+"""
+Streaming CSV / NDJSON exports, for the admin and the staff API.
+
+Rows are read with .iterator() (a server-side cursor on Postgres) and
+written to the client one chunk at a time through StreamingHttpResponse,
+so memory stays flat no matter how many rows a university has.
+
+CSV cells that a spreadsheet would run as a formula (=, +, -, @, tab,
+carriage return first) are prefixed with a quote: feedback text is
+written by visitors.
+"""
+import csv
+import json
+
+from django.core.exceptions import PermissionDenied
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.urls import path
+from django.utils import timezone
+from rest_framework.views import APIView
+
+from .permissions import IsCampusStaff, staff_university_id
+
+# rows fetched from the cursor per round trip
+CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+class Echo:
+    """csv.writer target that hands the formatted line straight back"""
+
+    def write(self, value):
+        return value
+
+
+def csv_cell(value):
+    """the value, quoted when a spreadsheet would read it as a formula"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_rows(queryset, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+
+    for row in queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE):
+        yield writer.writerow([csv_cell(value) for value in row])
+
+
+def ndjson_rows(queryset, fields):
+    for row in queryset.values(*fields).iterator(chunk_size=CHUNK_SIZE):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+def export_format(params):
+    """?format=, csv unless it names another known format"""
+    fmt = params.get("format", "csv")
+    return fmt if fmt in CONTENT_TYPES else "csv"
+
+
+def stream_export(queryset, fields, name, fmt="csv"):
+    """StreamingHttpResponse over the queryset in csv or ndjson."""
+    rows = csv_rows if fmt == "csv" else ndjson_rows
+
+    # no Content-Length, so the server falls back to chunked encoding
+    response = StreamingHttpResponse(
+        rows(queryset.order_by(), fields),
+        content_type=CONTENT_TYPES[fmt],
+    )
+
+    stamp = timezone.now().strftime("%Y%m%d-%H%M")
+    response["Content-Disposition"] = f'attachment; filename="{name}-{stamp}.{fmt}"'
+
+    return response
+
+
+class ExportMixin:
+    """
+    Adds streaming exports to a ModelAdmin.
+
+    - admin actions to export the selected rows
+    - <changelist>/export/?format=csv|ndjson to export everything the
+      admin can see
+
+    Both go through get_queryset(), so the per-university filtering of the
+    ModelAdmin applies to exports as well.
+    """
+
+    export_fields = ()
+
+    actions = ["export_csv", "export_ndjson"]
+
+    def export_name(self):
+        return self.model._meta.model_name
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = [
+            path(
+                "export/",
+                self.admin_site.admin_view(self.export_view),
+                name="%s_%s_export" % info,
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def export_view(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        return stream_export(
+            self.get_queryset(request),
+            self.export_fields,
+            self.export_name(),
+            export_format(request.GET),
+        )
+
+    def export_csv(self, request, queryset):
+        return stream_export(queryset, self.export_fields, self.export_name(), "csv")
+
+    export_csv.short_description = "Export selected as CSV"
+
+    def export_ndjson(self, request, queryset):
+        return stream_export(queryset, self.export_fields, self.export_name(), "ndjson")
+
+    export_ndjson.short_description = "Export selected as NDJSON"
+
+
+class ExportView(APIView):
+    """
+    GET ?format=csv|ndjson streams export_fields of the model for staff:
+    a campus admin gets their own university's rows, a superuser those
+    of ?university=<id> or of every university.
+    """
+
+    permission_classes = [IsCampusStaff]
+    model = None
+    export_fields = ()
+
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= picks the export format here, not a DRF renderer
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        queryset = self.model.objects.all()
+
+        university_id = staff_university_id(request)
+        if university_id is not None:
+            queryset = queryset.filter(university_id=university_id)
+
+        return stream_export(
+            queryset,
+            self.export_fields,
+            self.model._meta.model_name,
+            export_format(request.query_params),
+        )
@@ -0,0 +1,168 @@
+"""
+Building footprints and entrances.
+
+Building.footprint is an optional GeoJSON Polygon / MultiPolygon of the
+building's outline ([lng, lat] positions) and Building.entrances a list of
+[lng, lat] doors. Routes to a building end at its entrance nearest to the
+start instead of at the marker, which is often in the middle of the roof.
+
+A surveyed outline can have hundreds of vertices, most of them invisible
+below the highest zoom. On save, the footprint is simplified once per map
+zoom (Douglas-Peucker with a tolerance of FOOTPRINT_TOLERANCE_PX at that
+zoom) into Building.footprint_levels, keeping only the zooms where the
+shape changes: {"16": geometry, "18": geometry, ...}. The buildings API
+(?zoom=) and the clusters API send the variant of the requested zoom; an
+outline smaller than a few pixels is dropped there and the marker alone
+is drawn.
+"""
+import math
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .geojson import polygons
+
+# metres per degree of latitude
+METRES_PER_DEGREE = 111_320.0
+
+# metres per pixel at zoom 0 on the equator (256px tiles)
+EQUATOR_RESOLUTION = 156_543.034
+
+
+# ---------------------------
+# Validation
+# ---------------------------
+def validate_entrances(value):
+    """a list of [lng, lat] positions"""
+    if not value:
+        return
+    if not isinstance(value, list):
+        raise ValidationError("Entrances must be a list of [longitude, latitude] positions.")
+
+    for position in value:
+        if (
+            not isinstance(position, (list, tuple))
+            or len(position) != 2
+            or not all(isinstance(v, (int, float)) for v in position)
+            or not (-180 <= position[0] <= 180 and -90 <= position[1] <= 90)
+        ):
+            raise ValidationError(f"{position!r} is not a [longitude, latitude] position.")
+
+
+# ---------------------------
+# Simplification
+# ---------------------------
+def resolution(zoom, lat):
+    """metres per screen pixel at zoom"""
+    return EQUATOR_RESOLUTION * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def _distance(point, start, end):
+    """distance from point to the segment start-end (planar)"""
+    (px, py), (ax, ay), (bx, by) = point, start, end
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    if length == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def douglas_peucker(points, tolerance):
+    """indexes of the points kept, first and last always are"""
+    keep = {0, len(points) - 1}
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, index = 0.0, None
+        for i in range(first + 1, last):
+            distance = _distance(points[i], points[first], points[last])
+            if distance > farthest:
+                farthest, index = distance, i
+        if index is not None and farthest > tolerance:
+            keep.add(index)
+            stack.append((first, index))
+            stack.append((index, last))
+    return sorted(keep)
+
+
+def simplify_ring(ring, tolerance, lat0):
+    """the ring ([lng, lat], open) simplified, None when it collapses"""
+    # a local metric plane, good enough at building scale
+    scale_x = METRES_PER_DEGREE * math.cos(math.radians(lat0))
+    points = [(lng * scale_x, lat * METRES_PER_DEGREE) for lng, lat in ring]
+
+    # split a closed ring at its point farthest from the first one
+    far = max(range(len(points)), key=lambda i: math.dist(points[0], points[i]))
+    if far == 0:
+        return None
+    closed = points + [points[0]]
+    kept = douglas_peucker(closed[:far + 1], tolerance)
+    kept += [far + i for i in douglas_peucker(closed[far:], tolerance)[1:-1]]
+
+    if len(kept) < 3:
+        return None
+    return [ring[i] for i in kept]
+
+
+def simplify(footprint, tolerance, lat0):
+    """GeoJSON geometry simplified with a tolerance in metres, None if nothing is left"""
+    simplified = []
+    for polygon in polygons(footprint):
+        outer = simplify_ring(polygon[0], tolerance, lat0)
+        if outer is None:
+            continue
+        holes = [hole for hole in (simplify_ring(ring, tolerance, lat0) for ring in polygon[1:]) if hole]
+        simplified.append([
+            [[round(lng, 7), round(lat, 7)] for lng, lat in ring + ring[:1]]
+            for ring in [outer] + holes
+        ])
+
+    if not simplified:
+        return None
+    if len(simplified) == 1:
+        return {"type": "Polygon", "coordinates": simplified[0]}
+    return {"type": "MultiPolygon", "coordinates": simplified}
+
+
+def footprint_levels(footprint):
+    """{zoom: geometry} from the lowest map zoom up, only where the shape changes"""
+    if not footprint:
+        return {}
+
+    parsed = polygons(footprint)
+    lats = [lat for polygon in parsed for _, lat in polygon[0]]
+    lat0 = sum(lats) / len(lats)
+
+    levels, previous = {}, None
+    for zoom in range(settings.TILE_MIN_ZOOM, settings.TILE_MAX_ZOOM + 1):
+        tolerance = settings.FOOTPRINT_TOLERANCE_PX * resolution(zoom, lat0)
+        geometry = simplify(footprint, tolerance, lat0)
+        if geometry != previous:
+            levels[str(zoom)] = geometry
+            previous = geometry
+    return levels
+
+
+def footprint_at(levels, zoom):
+    """the footprint variant to draw at zoom, None when there is none"""
+    zooms = [int(level) for level in levels or {} if int(level) <= zoom]
+    if not zooms:
+        return None
+    return levels[str(max(zooms))]
+
+
+# ---------------------------
+# Entrances
+# ---------------------------
+def nearest_entrance(entrances, lat, lng):
+    """(lat, lng) of the entrance closest to the point, None without entrances"""
+    if not entrances:
+        return None
+
+    scale_x = math.cos(math.radians(lat))
+    entrance_lng, entrance_lat = min(
+        entrances,
+        key=lambda position: ((position[0] - lng) * scale_x) ** 2 + (position[1] - lat) ** 2,
+    )
+    return entrance_lat, entrance_lng
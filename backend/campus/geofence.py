@@ -0,0 +1,188 @@
+"""
+Campus boundaries as polygons, and "which campus is this point on".
+
+University.boundary holds a GeoJSON Polygon or MultiPolygon ([lng, lat]
+positions, holes allowed); a university without one falls back to its
+min/max lat/lng rectangle.
+
+Lookups must be cheap enough to run on every GPS fix and to pick the
+tenant of a visitor, so each worker keeps the boundaries of the active
+universities prepared in memory:
+
+- a bounding box, which rejects most points with four comparisons
+- the edges bucketed into horizontal bands of latitude, so the ray cast
+  (even-odd rule, which also handles holes and MultiPolygons) only tests
+  the few edges of the point's band instead of every vertex
+
+The prepared set is rebuilt when a University is saved or deleted
+(campus.signals calls invalidate), which other workers notice through a
+token in the shared cache: one cache read per lookup.
+"""
+import math
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from .geojson import polygons
+from .models import University
+
+TOKEN_KEY = "geofence_token"
+
+# edges per latitude band, on average
+EDGES_PER_BAND = 4
+MAX_BANDS = 1024
+
+_local = {"token": None, "campuses": ()}
+_lock = threading.Lock()
+
+
+# ---------------------------
+# Polygons
+# ---------------------------
+def ring_area(ring):
+    """shoelace area in square degrees, only used to compare rings"""
+    return abs(sum(
+        x1 * y2 - x2 * y1
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1])
+    )) / 2
+
+
+def rectangle(university):
+    """the min/max lat/lng bounds as a polygon, None when incomplete"""
+    bounds = (university.min_lat, university.min_lng, university.max_lat, university.max_lng)
+    if any(value is None for value in bounds):
+        return None
+
+    south, west, north, east = bounds
+    return [[(west, south), (east, south), (east, north), (west, north)]]
+
+
+def campus_polygons(university):
+    """the boundary polygons, the rectangle without one, [] when neither is set"""
+    if university.boundary:
+        try:
+            return polygons(university.boundary)
+        except (KeyError, TypeError, IndexError, ValueError):
+            pass
+
+    box = rectangle(university)
+    return [box] if box else []
+
+
+def outline(university):
+    """
+    [[lat, lng], ...] outer ring of the largest polygon, for the map's
+    outline and mask; [] without a boundary
+    """
+    parsed = campus_polygons(university)
+    if not parsed:
+        return []
+
+    outer = max((polygon[0] for polygon in parsed), key=ring_area)
+    return [[lat, lng] for lng, lat in outer]
+
+
+# ---------------------------
+# Prepared polygons
+# ---------------------------
+class PreparedPolygon:
+    """point-in-polygon over a fixed set of rings, built once"""
+
+    __slots__ = ("west", "south", "east", "north", "band_height", "bands")
+
+    def __init__(self, polygons):
+        rings = [ring for polygon in polygons for ring in polygon if len(ring) >= 3]
+        points = [point for ring in rings for point in ring]
+        if not points:
+            raise ValueError("no rings")
+
+        self.west = min(lng for lng, _ in points)
+        self.east = max(lng for lng, _ in points)
+        self.south = min(lat for _, lat in points)
+        self.north = max(lat for _, lat in points)
+
+        # (lat1, lat2, lng at lat1, lng per lat) for every non horizontal edge
+        edges = []
+        for ring in rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                if y1 != y2:
+                    edges.append((y1, y2, x1, (x2 - x1) / (y2 - y1)))
+
+        count = max(1, min(MAX_BANDS, len(edges) // EDGES_PER_BAND))
+        self.band_height = (self.north - self.south) / count or 1.0
+        self.bands = [[] for _ in range(count)]
+        for edge in edges:
+            low, high = sorted(edge[:2])
+            for band in range(self._band(low), self._band(high) + 1):
+                self.bands[band].append(edge)
+
+    def _band(self, lat):
+        return min(int((lat - self.south) / self.band_height), len(self.bands) - 1)
+
+    def contains(self, lat, lng):
+        if not (self.south <= lat <= self.north and self.west <= lng <= self.east):
+            return False
+
+        # count the edges crossed by a ray going east from the point
+        inside = False
+        for y1, y2, x1, slope in self.bands[self._band(lat)]:
+            if (y1 > lat) != (y2 > lat) and lng < x1 + (lat - y1) * slope:
+                inside = not inside
+        return inside
+
+
+def prepare(university):
+    parsed = campus_polygons(university)
+    return PreparedPolygon(parsed) if parsed else None
+
+
+# ---------------------------
+# Per worker index
+# ---------------------------
+def invalidate():
+    cache.delete(TOKEN_KEY)
+
+
+def load_campuses():
+    """(university id, short_name, name, prepared) of every active campus"""
+    campuses = []
+    for university in University.objects.filter(active=True).order_by("id"):
+        prepared = prepare(university)
+        if prepared is not None:
+            campuses.append((university.pk, university.short_name, university.name, prepared))
+    return tuple(campuses)
+
+
+def campuses():
+    token = cache.get(TOKEN_KEY)
+    if token is not None and token == _local["token"]:
+        return _local["campuses"]
+
+    loaded = load_campuses()
+    if token is None:
+        cache.add(TOKEN_KEY, uuid.uuid4().hex, None)
+        token = cache.get(TOKEN_KEY)
+
+    with _lock:
+        _local["token"], _local["campuses"] = token, loaded
+    return loaded
+
+
+def locate(lat, lng):
+    """(id, short_name, name) of the campus containing the point, or None"""
+    if not (math.isfinite(lat) and math.isfinite(lng)):
+        return None
+
+    for university_id, short_name, name, prepared in campuses():
+        if prepared.contains(lat, lng):
+            return university_id, short_name, name
+    return None
+
+
+def inside(university_id, lat, lng):
+    """is the point on that university's campus"""
+    for campus_id, _, _, prepared in campuses():
+        if campus_id == university_id:
+            return prepared.contains(lat, lng)
+    return False
@@ -0,0 +1,50 @@
+"""
+GeoJSON geometry of University.boundary and Building.footprint.
+
+Parsing and validation only, without the models, so campus.models can
+validate with it and campus.geofence / campus.footprints build on it.
+"""
+from django.core.exceptions import ValidationError
+
+
+def _ring(positions):
+    """[(lng, lat), ...] without the closing position"""
+    ring = [(float(position[0]), float(position[1])) for position in positions]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+    return ring
+
+
+def polygons(geometry):
+    """[[outer ring, *holes], ...] of a GeoJSON Polygon / MultiPolygon"""
+    if geometry.get("type") == "Feature":
+        geometry = geometry.get("geometry") or {}
+
+    if geometry.get("type") == "Polygon":
+        return [[_ring(ring) for ring in geometry["coordinates"]]]
+    if geometry.get("type") == "MultiPolygon":
+        return [[_ring(ring) for ring in polygon] for polygon in geometry["coordinates"]]
+    raise ValueError("boundary must be a GeoJSON Polygon or MultiPolygon")
+
+
+def validate_boundary(value):
+    """University.boundary: a Polygon / MultiPolygon of [lng, lat] positions"""
+    if value in (None, {}, ""):
+        return
+
+    try:
+        parsed = polygons(value) if isinstance(value, dict) else None
+    except (KeyError, TypeError, IndexError, ValueError) as exc:
+        raise ValidationError(f"Not a GeoJSON Polygon or MultiPolygon: {exc}")
+    if not parsed:
+        raise ValidationError("Not a GeoJSON Polygon or MultiPolygon.")
+
+    for polygon in parsed:
+        if not polygon:
+            raise ValidationError("A polygon needs an outer ring.")
+        for ring in polygon:
+            if len(ring) < 3:
+                raise ValidationError("A ring needs at least three distinct positions.")
+            for lng, lat in ring:
+                if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+                    raise ValidationError(f"[{lng}, {lat}] is not a [longitude, latitude] position.")
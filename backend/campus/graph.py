@@ -0,0 +1,445 @@
+"""
+The walking network of a university compiled into one binary file.
+
+Loading WalkNode / WalkEdge rows into dicts in every gunicorn worker
+multiplies the memory by the worker count and slows the first route.
+Instead the network is compiled to GRAPH_DIR/<university id>.graph and
+each worker maps it read-only: the pages are shared by all workers
+through the OS page cache and "loading" is an mmap call.
+
+Layout, little-endian, every item 4 bytes so the arrays are aligned:
+
+    header   "UBAG", format version, nodes, links (uint32),
+             grid min_x, min_y (int32), width, height (uint32), scale (float32)
+    node_ids     uint32[nodes]       WalkNode pk
+    lat, lng     float32[nodes]      (~5 cm at campus latitudes)
+    indptr       uint32[nodes + 1]   CSR: links of node i are
+    indices      uint32[links]         indptr[i]:indptr[i + 1]
+    weights      float32[links]      metres
+    edge_ids     uint32[links]       WalkEdge pk, for the geometry
+    cell_ptr     uint32[cells + 1]   CSR: nodes of each GRID_CELL square,
+    cell_nodes   uint32[nodes]         row by row (see NodeGrid)
+
+Every edge is stored in both directions. A new file is written next to
+the old one and swapped in with os.replace, so a worker never sees half
+a file; workers notice the new inode on their next load() and keep using
+the old mapping until then. The graph is recompiled after an OSM import
+(in a background thread, inline under tests); changes arriving while a
+compile runs are picked up by one more compile once it is done, so two
+compiles of a university never race.
+
+The route API walks the graph (walking_route) for routes to a building
+that start on campus, instead of asking OpenRouteService. Both ends are
+snapped to their nearest node through the grid, so the route ends at
+the entrance the API picked, a few cells are searched per lookup.
+"""
+import heapq
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+
+from django.conf import settings
+from django.db import connections
+
+from .models import WalkEdge, WalkNode
+from .osm import EARTH_RADIUS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"UBAG"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<4sIIIiiIIf")
+
+# nearest node search grid, in degrees (~55 m)
+GRID_CELL = 0.0005
+
+METRES_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+# metres per second, the pace of the OpenRouteService foot profile
+WALKING_SPEED = 1.39
+
+_graphs = {}  # university id -> (file identity, CampusGraph)
+_lock = threading.Lock()
+
+_compiling = set()  # university ids with a compile thread
+_changed = set()  # ... and a change it hasn't seen yet
+_jobs_lock = threading.Lock()
+
+
+class GraphFileError(Exception):
+    """The file is not a compiled graph this code can read."""
+
+
+def graph_path(university_id):
+    return os.path.join(settings.GRAPH_DIR, f"{university_id}.graph")
+
+
+# ---------------------------
+# Nearest node grid
+# ---------------------------
+class NodeGrid:
+    """
+    The nodes bucketed into GRID_CELL squares (longitudes scaled by
+    cos(latitude), so cells are about square on the ground), stored as
+    CSR: the nodes of cell (x, y) are cell_nodes[cell_ptr[c]:cell_ptr[c + 1]]
+    with c = (y - min_y) * width + (x - min_x). Built when compiling, read
+    from the mapped file.
+    """
+
+    def __init__(self, lats, lngs, bounds, cell_ptr, cell_nodes):
+        self.lats, self.lngs = lats, lngs
+        self.min_x, self.min_y, self.width, self.height, self.scale = bounds
+        self.cell_ptr, self.cell_nodes = cell_ptr, cell_nodes
+
+    @classmethod
+    def build(cls, lats, lngs):
+        # the float32 values of the file, so both sides agree on the cells
+        lats, lngs = array("f", lats), array("f", lngs)
+        scale = array("f", [math.cos(math.radians(sum(lats) / len(lats)))])[0]
+
+        cells = [cls.cell_of(lat, lng, scale) for lat, lng in zip(lats, lngs)]
+        min_x, min_y = min(x for x, _ in cells), min(y for _, y in cells)
+        width = max(x for x, _ in cells) - min_x + 1
+        height = max(y for _, y in cells) - min_y + 1
+
+        buckets = [[] for _ in range(width * height)]
+        for i, (x, y) in enumerate(cells):
+            buckets[(y - min_y) * width + x - min_x].append(i)
+
+        cell_ptr, cell_nodes = [0], []
+        for bucket in buckets:
+            cell_nodes.extend(bucket)
+            cell_ptr.append(len(cell_nodes))
+
+        return cls(lats, lngs, (min_x, min_y, width, height, scale), cell_ptr, cell_nodes)
+
+    @staticmethod
+    def cell_of(lat, lng, scale):
+        return math.floor(lng * scale / GRID_CELL), math.floor(lat / GRID_CELL)
+
+    def nodes_in(self, x, y):
+        x, y = x - self.min_x, y - self.min_y
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return ()
+        c = y * self.width + x
+        return self.cell_nodes[self.cell_ptr[c]:self.cell_ptr[c + 1]]
+
+    @staticmethod
+    def ring(cx, cy, radius):
+        if radius == 0:
+            yield cx, cy
+            return
+        for x in range(cx - radius, cx + radius + 1):
+            yield x, cy - radius
+            yield x, cy + radius
+        for y in range(cy - radius + 1, cy + radius):
+            yield cx - radius, y
+            yield cx + radius, y
+
+    def nearest(self, lat, lng, within):
+        """index of the node nearest to the point, None when none is within `within` metres"""
+        within /= METRES_PER_DEGREE
+        cx, cy = self.cell_of(lat, lng, self.scale)
+        # rings past the grid or past `within` can't hold the answer
+        last = min(
+            max(abs(cx - self.min_x), abs(cx - self.min_x - self.width + 1),
+                abs(cy - self.min_y), abs(cy - self.min_y - self.height + 1)),
+            math.ceil(within / GRID_CELL) + 1,
+        )
+
+        best, best_distance = None, math.inf
+        for radius in range(last + 1):
+            for x, y in self.ring(cx, cy, radius):
+                for i in self.nodes_in(x, y):
+                    d = math.hypot((self.lngs[i] - lng) * self.scale, self.lats[i] - lat)
+                    if d < best_distance:
+                        best, best_distance = i, d
+            # every node within radius cells has been seen
+            if best_distance <= radius * GRID_CELL:
+                break
+        return best if best_distance <= within else None
+
+
+# ---------------------------
+# Compiling
+# ---------------------------
+def _write(fh, values, typecode):
+    data = array(typecode, values)
+    if sys.byteorder != "little":
+        data.byteswap()
+    data.tofile(fh)
+
+
+def compile_graph(university_id):
+    """
+    Write the university's graph file and swap it in; returns
+    {"nodes", "links", "cells", "bytes"}, None without a network
+    (the old file, if any, is removed then).
+    """
+    path = graph_path(university_id)
+
+    nodes = list(
+        WalkNode.objects
+        .filter(university_id=university_id)
+        .order_by("id")
+        .values_list("id", "latitude", "longitude")
+    )
+    if not nodes:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return None
+
+    node_ids = [pk for pk, _, _ in nodes]
+    lats = [lat for _, lat, _ in nodes]
+    lngs = [lng for _, _, lng in nodes]
+    index = {pk: i for i, pk in enumerate(node_ids)}
+
+    links = [[] for _ in nodes]
+    edges = WalkEdge.objects.filter(university_id=university_id).values_list("id", "source_id", "target_id", "length")
+    for edge_id, source, target, length in edges:
+        links[index[source]].append((index[target], length, edge_id))
+        links[index[target]].append((index[source], length, edge_id))
+
+    indptr, indices, weights, edge_ids = [0], [], [], []
+    for node_links in links:
+        for target, length, edge_id in sorted(node_links):
+            indices.append(target)
+            weights.append(length)
+            edge_ids.append(edge_id)
+        indptr.append(len(indices))
+
+    grid = NodeGrid.build(lats, lngs)
+
+    os.makedirs(settings.GRAPH_DIR, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=settings.GRAPH_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            # mkstemp makes it private, every worker user has to read it
+            os.fchmod(fh.fileno(), 0o644)
+            fh.write(HEADER.pack(
+                MAGIC, FORMAT_VERSION, len(nodes), len(indices),
+                grid.min_x, grid.min_y, grid.width, grid.height, grid.scale,
+            ))
+            _write(fh, node_ids, "I")
+            _write(fh, lats, "f")
+            _write(fh, lngs, "f")
+            _write(fh, indptr, "I")
+            _write(fh, indices, "I")
+            _write(fh, weights, "f")
+            _write(fh, edge_ids, "I")
+            _write(fh, grid.cell_ptr, "I")
+            _write(fh, grid.cell_nodes, "I")
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+    return {
+        "nodes": len(nodes),
+        "links": len(indices),
+        "cells": grid.width * grid.height,
+        "bytes": os.path.getsize(path),
+    }
+
+
+# ---------------------------
+# Reading
+# ---------------------------
+class CampusGraph:
+    """read-only view of a graph file, the arrays are memoryviews over the mapping"""
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise GraphFileError("graph files are little-endian")
+
+        with open(path, "rb") as fh:
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER.size:
+            raise GraphFileError(f"{path} is truncated")
+        magic, version, nodes, links, *bounds = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise GraphFileError(f"{path} is not a version {FORMAT_VERSION} graph file")
+
+        view = memoryview(self._map)
+        offset = HEADER.size
+
+        def take(count, typecode):
+            nonlocal offset
+            part = view[offset:offset + count * 4].cast(typecode)
+            offset += count * 4
+            return part
+
+        self.node_ids = take(nodes, "I")
+        self.lat = take(nodes, "f")
+        self.lng = take(nodes, "f")
+        self.indptr = take(nodes + 1, "I")
+        self.indices = take(links, "I")
+        self.weights = take(links, "f")
+        self.edge_ids = take(links, "I")
+        cells = bounds[2] * bounds[3]
+        if offset + (cells + 1 + nodes) * 4 != len(self._map):
+            raise GraphFileError(f"{path} has the wrong size")
+        self.grid = NodeGrid(self.lat, self.lng, bounds, take(cells + 1, "I"), take(nodes, "I"))
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def neighbours(self, node):
+        """(node, metres, WalkEdge pk) of each link of node"""
+        start, end = self.indptr[node], self.indptr[node + 1]
+        return zip(self.indices[start:end], self.weights[start:end], self.edge_ids[start:end])
+
+    def nearest_node(self, lat, lng, within):
+        """the node nearest to the point, None when none is within `within` metres"""
+        return self.grid.nearest(lat, lng, within)
+
+    def shortest_path(self, source, target):
+        """(metres, [(node, WalkEdge pk to the next one), ...]) Dijkstra, None when unreachable"""
+        best = {source: 0.0}
+        previous = {}  # node -> (node before it, edge)
+        queue = [(0.0, source)]
+        while queue:
+            metres, node = heapq.heappop(queue)
+            if node == target:
+                break
+            if metres > best[node]:
+                continue
+            for neighbour, length, edge_id in self.neighbours(node):
+                candidate = metres + length
+                if candidate < best.get(neighbour, math.inf):
+                    best[neighbour] = candidate
+                    previous[neighbour] = (node, edge_id)
+                    heapq.heappush(queue, (candidate, neighbour))
+        else:
+            return None
+
+        steps = []
+        while node != source:
+            node, edge_id = previous[node]
+            steps.append((node, edge_id))
+        steps.reverse()
+        return best[target], steps
+
+
+def load(university_id):
+    """the worker's mapping of the university's graph, None without one"""
+    path = graph_path(university_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    # a swapped in file is a new inode
+    identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    local = _graphs.get(university_id)
+    if local is not None and local[0] == identity:
+        return local[1]
+
+    graph = CampusGraph(path)
+    with _lock:
+        _graphs[university_id] = (identity, graph)
+    return graph
+
+
+def walking_route(university_id, lat, lng, end_lat, end_lng):
+    """
+    {"coordinates": [[lng, lat], ...], "distance", "seconds"} of the walk
+    from the point to the end (a building's entrance) over the campus
+    network. None without a graph, when either end is more than
+    GRAPH_SNAP_DISTANCE metres from a walkway or they aren't connected.
+    """
+    try:
+        campus = load(university_id)
+    except GraphFileError:
+        # e.g. written by an older version, compile_graphs replaces it
+        logger.warning("Unreadable graph file of university %s", university_id, exc_info=True)
+        return None
+    if campus is None or not len(campus):
+        return None
+
+    snap = settings.GRAPH_SNAP_DISTANCE
+    source = campus.nearest_node(lat, lng, snap)
+    target = campus.nearest_node(end_lat, end_lng, snap)
+    if source is None or target is None:
+        return None
+
+    found = campus.shortest_path(source, target)
+    if found is None:
+        return None
+    metres, steps = found
+
+    # the edge geometries are only in the database, one query for all of them
+    edges = {
+        edge_id: (source_id, geometry)
+        for edge_id, source_id, geometry in WalkEdge.objects
+        .filter(pk__in=[edge_id for _, edge_id in steps])
+        .values_list("id", "source_id", "geometry")
+    }
+    def position(node):
+        # float32 holds about 6 decimals of a campus coordinate
+        return [round(campus.lng[node], 6), round(campus.lat[node], 6)]
+
+    coordinates = [[lng, lat], position(source)]
+    following = [node for node, _ in steps[1:]] + [target]
+    for (node, edge_id), next_node in zip(steps, following):
+        source_id, geometry = edges[edge_id]
+        points = geometry if source_id == campus.node_ids[node] else geometry[::-1]
+        # an edge stored without its geometry is drawn straight
+        coordinates.extend(points[1:] or [position(next_node)])
+    coordinates.append([end_lng, end_lat])
+
+    return {
+        "coordinates": coordinates,
+        "distance": round(metres, 1),
+        "seconds": round(metres / WALKING_SPEED),
+    }
+
+
+# ---------------------------
+# Jobs
+# ---------------------------
+def _compile_in_thread(university_id):
+    try:
+        while True:
+            try:
+                compile_graph(university_id)
+            except Exception:
+                logger.exception("Graph compile failed for university %s", university_id)
+
+            # changed while compiling: once more, the file may miss it
+            with _jobs_lock:
+                if university_id not in _changed:
+                    _compiling.discard(university_id)
+                    return
+                _changed.discard(university_id)
+    finally:
+        connections.close_all()
+
+
+def schedule(university_id):
+    """
+    after a change: recompile in the background (inline under tests). One
+    thread per university, a burst of changes costs at most two compiles.
+    """
+    if not settings.BUFFERED_WRITES_ASYNC:
+        compile_graph(university_id)
+        return
+
+    with _jobs_lock:
+        if university_id in _compiling:
+            _changed.add(university_id)
+            return
+        _compiling.add(university_id)
+
+    threading.Thread(target=_compile_in_thread, args=(university_id,), daemon=True).start()
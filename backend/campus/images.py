@@ -0,0 +1,369 @@
+"""
+Resized derivatives of building images, and one icon sprite per university.
+
+Uploads are served as they were uploaded (often several MB straight from a
+phone camera), so after a photo or icon changes a job writes:
+
+- photos: a thumbnail and a medium variant, each as JPEG and WebP
+- icons: one IMAGE_ICON_SIZE square, as PNG and WebP
+
+Files are named after the hash of their bytes (derivatives/ab/abcd...webp),
+so they can be cached forever and identical outputs are stored once.
+Building.images records the variants and the upload they were made from;
+a variant is rebuilt when the upload no longer matches.
+
+The icons of a university are also packed into one sprite sheet, one cell
+per building category (University.icon_sprite), so the map loads a single
+image for all of its markers.
+
+Jobs run after commit in one background thread per process (inline under
+tests), which works through a queue so a burst of saves is derived once;
+derivatives_changed tells campus.signals to rebuild the offline bundle.
+build_image_derivatives backfills existing uploads.
+"""
+import hashlib
+import io
+import logging
+import math
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models import Q
+from django.dispatch import Signal
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Building, University
+from .versions import bump_map_version
+
+logger = logging.getLogger(__name__)
+
+SOURCE_FIELDS = ("photo", "icon")
+
+# sent with university_id after a job changed the images of that campus
+derivatives_changed = Signal()
+
+_queued = {}  # building id (None: sprite only) -> university ids, for the job thread
+_running = False
+_jobs_lock = threading.Lock()
+
+
+def photo_sizes():
+    return {
+        "thumb": settings.IMAGE_THUMB_SIZE,
+        "medium": settings.IMAGE_MEDIUM_SIZE,
+    }
+
+
+# ---------------------------
+# Encoding & storage
+# ---------------------------
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == "jpeg":
+        image.convert("RGB").save(buffer, "JPEG", quality=settings.IMAGE_QUALITY, optimize=True, progressive=True)
+    elif fmt == "webp":
+        image.save(buffer, "WEBP", quality=settings.IMAGE_QUALITY, method=6)
+    else:
+        image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def store(data, extension):
+    """save under the hash of the bytes (once), return the storage name"""
+    digest = hashlib.sha256(data).hexdigest()[:24]
+    name = f"derivatives/{digest[:2]}/{digest}.{extension}"
+
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+
+    return name
+
+
+def store_variant(image, formats):
+    variant = {"width": image.width, "height": image.height}
+    for fmt in formats:
+        variant[fmt] = store(encode(image, fmt), "jpg" if fmt == "jpeg" else fmt)
+    return variant
+
+
+def open_image(field, size):
+    """decode the upload, at a reduced scale when the format allows it"""
+    with field.open("rb") as fh:
+        image = Image.open(fh)
+        # JPEG decodes straight to >= size, a 12MP photo never sits in memory whole
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    return image
+
+
+# ---------------------------
+# Derivatives
+# ---------------------------
+def photo_variants(field):
+    sizes = photo_sizes()
+    image = open_image(field, max(sizes.values()))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    variants = {}
+    # largest first, each smaller one is resized from the previous
+    for label, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        variants[label] = store_variant(image, ("jpeg", "webp"))
+    return variants
+
+
+def icon_variants(field):
+    size = settings.IMAGE_ICON_SIZE
+    image = open_image(field, size).convert("RGBA")
+    image = ImageOps.contain(image, (size, size), Image.LANCZOS)
+
+    # centred on a transparent square, so every sprite cell has the same size
+    square = Image.new("RGBA", (size, size))
+    square.paste(image, ((size - image.width) // 2, (size - image.height) // 2))
+
+    return {"icon": store_variant(square, ("png", "webp"))}
+
+
+BUILDERS = {
+    "photo": photo_variants,
+    "icon": icon_variants,
+}
+
+
+def source_name(building, field):
+    return getattr(building, field).name or ""
+
+
+def same_upload(field, name):
+    """filter for rows whose file field still holds name (empty may be NULL)"""
+    if name:
+        return Q(**{field: name})
+    return Q(**{field: ""}) | Q(**{f"{field}__isnull": True})
+
+
+def stale_fields(building):
+    """photo / icon whose derivatives were not made from the current upload"""
+    images = building.images or {}
+    return [
+        field for field in SOURCE_FIELDS
+        if source_name(building, field) != images.get(field, {}).get("source", "")
+    ]
+
+
+def build_derivatives(building, force=False):
+    """the new Building.images, None when everything is current"""
+    fields = SOURCE_FIELDS if force else stale_fields(building)
+    if not fields:
+        return None
+
+    images = dict(building.images or {})
+    for field in fields:
+        name = source_name(building, field)
+        if not name:
+            images.pop(field, None)
+            continue
+
+        entry = {"source": name}
+        try:
+            entry.update(BUILDERS[field](getattr(building, field)))
+        except (OSError, ValueError, UnidentifiedImageError, Image.DecompressionBombError):
+            # remembered with no variants: the original is served, no retry loop
+            logger.warning("Could not derive %s of building %s", field, building.pk, exc_info=True)
+        images[field] = entry
+
+    return images
+
+
+def process_building(building_id, force=False):
+    """Refresh one building's derivatives; True when they changed."""
+    building = Building.objects.filter(pk=building_id).first()
+    if building is None:
+        return False
+
+    images = build_derivatives(building, force)
+    if images is None:
+        return False
+
+    # not written over a newer upload that came in meanwhile, its own job handles it
+    updated = Building.objects.filter(
+        same_upload("photo", source_name(building, "photo")),
+        same_upload("icon", source_name(building, "icon")),
+        pk=building_id,
+    ).update(images=images, updated_at=timezone.now())
+
+    if updated and building.university_id:
+        bump_map_version(building.university_id)
+    return bool(updated)
+
+
+# ---------------------------
+# Sprite sheet
+# ---------------------------
+def sprite_sources(university_id):
+    """{category: icon png} using the first building of each category with an icon"""
+    sources = {}
+    rows = (
+        Building.objects
+        .filter(university_id=university_id)
+        .exclude(category="")
+        .order_by("category", "id")
+        .values_list("category", "images")
+    )
+    for category, images in rows:
+        png = (images or {}).get("icon", {}).get("icon", {}).get("png")
+        if png and category not in sources:
+            sources[category] = png
+    return sources
+
+
+def build_sprite(sources):
+    cell = settings.IMAGE_ICON_SIZE
+    columns = math.ceil(math.sqrt(len(sources)))
+    rows = math.ceil(len(sources) / columns)
+
+    sheet = Image.new("RGBA", (columns * cell, rows * cell))
+    icons = {}
+    for index, (category, name) in enumerate(sorted(sources.items())):
+        x, y = index % columns, index // columns
+        with default_storage.open(name, "rb") as fh:
+            with Image.open(fh) as icon:
+                sheet.paste(icon.convert("RGBA"), (x * cell, y * cell))
+        icons[category] = [x, y]
+
+    return {
+        "cell": cell,
+        "width": sheet.width,
+        "height": sheet.height,
+        "png": store(encode(sheet, "png"), "png"),
+        "webp": store(encode(sheet, "webp"), "webp"),
+        "icons": icons,
+    }
+
+
+def refresh_sprite(university_id):
+    """Rebuild the university's sprite if its icons changed; True if it did."""
+    university = University.objects.filter(pk=university_id).first()
+    if university is None:
+        return False
+
+    sources = sprite_sources(university_id)
+    signature = hashlib.sha256(repr(sorted(sources.items())).encode()).hexdigest()[:16]
+
+    if (university.icon_sprite or {}).get("signature", "") == (signature if sources else ""):
+        return False
+
+    sprite = {}
+    if sources:
+        try:
+            sprite = build_sprite(sources)
+        except (OSError, ValueError):
+            logger.warning("Could not build the icon sprite of university %s", university_id, exc_info=True)
+            return False
+        sprite["signature"] = signature
+
+    University.objects.filter(pk=university_id).update(icon_sprite=sprite)
+    # the page embeds the sprite
+    bump_map_version(university_id)
+    return True
+
+
+# ---------------------------
+# URLs for clients
+# ---------------------------
+def absolute(url, request=None):
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def derivative_urls(images, request=None):
+    """Building.images with storage names turned into URLs"""
+    urls = {}
+    for field, entry in (images or {}).items():
+        variants = {}
+        for label, variant in entry.items():
+            if label == "source":
+                continue
+            variants[label] = {
+                key: value if key in ("width", "height") else absolute(default_storage.url(value), request)
+                for key, value in variant.items()
+            }
+        if variants:
+            urls[field] = variants
+    return urls
+
+
+def sprite_for_client(university):
+    sprite = university.icon_sprite or {}
+    if not sprite:
+        return {}
+    return {
+        "url": default_storage.url(sprite["png"]),
+        "webp": default_storage.url(sprite["webp"]),
+        "cell": sprite["cell"],
+        "width": sprite["width"],
+        "height": sprite["height"],
+        "icons": sprite["icons"],
+    }
+
+
+# ---------------------------
+# Jobs
+# ---------------------------
+def run_jobs(queued):
+    """
+    {building id (None: sprite only): university ids}: derive the images
+    of the buildings, then refresh each sprite once
+    """
+    changed = set()
+    for building_id, university_ids in queued.items():
+        if building_id and process_building(building_id):
+            changed.update(university_ids)
+
+    for university_id in set().union(*queued.values()):
+        if refresh_sprite(university_id) or university_id in changed:
+            derivatives_changed.send(sender=University, university_id=university_id)
+
+
+def _run_queued():
+    global _running
+    try:
+        while True:
+            with _jobs_lock:
+                if not _queued:
+                    _running = False
+                    return
+                queued = dict(_queued)
+                _queued.clear()
+
+            try:
+                run_jobs(queued)
+            except Exception:
+                logger.exception("Image derivatives failed for buildings %s", sorted(queued, key=str))
+    finally:
+        connections.close_all()
+
+
+def schedule(building_id, university_ids):
+    """
+    after an upload: derive in the background (inline under tests). One
+    thread per process works through the queue, a burst of saves of the
+    same building is derived once.
+    """
+    global _running
+    university_ids = {university_id for university_id in university_ids if university_id}
+    if not settings.BUFFERED_WRITES_ASYNC:
+        run_jobs({building_id: university_ids})
+        return
+
+    with _jobs_lock:
+        _queued.setdefault(building_id, set()).update(university_ids)
+        if _running:
+            return
+        _running = True
+
+    threading.Thread(target=_run_queued, name="image-derivatives", daemon=True).start()
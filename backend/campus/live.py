@@ -0,0 +1,82 @@
+"""
+Live counters for the admin dashboard.
+
+The index page polls /admin/live/?cursor= every LIVE_STATS_INTERVAL
+seconds and gets the visitor / route-request deltas since its cursor,
+which it adds to the numbers on screen. Deltas are pulled rather than
+pushed over SSE: a stream would pin a sync gunicorn worker per open admin
+tab. They come from the cache counters (campus.counters), never from the
+database, and a worker reads those at most once per PRODUCER_INTERVAL
+however many admins poll it: one producer, fanned out to every reader.
+
+A cursor is the day and the totals the client has seen. A client
+without one, or still on yesterday's, gets today's totals with reset.
+"""
+import threading
+import time
+
+from django.utils import timezone
+
+from .counters import KINDS, live_totals, university_ids
+
+PRODUCER_INTERVAL = 1.0
+
+# university id (None: all of them) -> (read at, day, totals)
+_latest = {}
+_lock = threading.Lock()
+
+
+def snapshot(university_id=None):
+    """today's totals of one university, or of all of them summed"""
+    if university_id is None:
+        ids = set(university_ids().values())
+    else:
+        ids = {university_id}
+
+    totals = live_totals(ids)
+    return {kind: sum(t[kind] for t in totals.values()) for kind in KINDS}
+
+
+def latest(university_id=None):
+    """(day, totals) read by this worker less than PRODUCER_INTERVAL ago"""
+    now = time.monotonic()
+    with _lock:
+        entry = _latest.get(university_id)
+        if entry is not None and now - entry[0] < PRODUCER_INTERVAL:
+            return entry[1:]
+
+    day, totals = timezone.now().date(), snapshot(university_id)
+    with _lock:
+        _latest[university_id] = (now, day, totals)
+    return day, totals
+
+
+def encode_cursor(day, totals):
+    return ":".join([day.isoformat(), *(str(totals[kind]) for kind in KINDS)])
+
+
+def decode_cursor(cursor):
+    """(day iso string, totals), None when it isn't a cursor"""
+    parts = (cursor or "").split(":")
+    if len(parts) != len(KINDS) + 1 or not all(part.isdigit() for part in parts[1:]):
+        return None
+    return parts[0], dict(zip(KINDS, map(int, parts[1:])))
+
+
+def deltas(university_id=None, cursor=None):
+    """{"cursor", "reset", "deltas"}: what was counted since the cursor"""
+    day, totals = latest(university_id)
+    seen = decode_cursor(cursor)
+
+    changes = None
+    if seen is not None and seen[0] == day.isoformat():
+        changes = {kind: totals[kind] - seen[1][kind] for kind in KINDS}
+        if any(value < 0 for value in changes.values()):
+            # counters lost (cache restart), start over
+            changes = None
+
+    return {
+        "cursor": encode_cursor(day, totals),
+        "reset": changes is None,
+        "deltas": totals if changes is None else changes,
+    }
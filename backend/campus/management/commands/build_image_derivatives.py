@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from campus.bundle import refresh_bundle
+from campus.images import process_building, refresh_sprite
+from campus.models import Building, University
+
+
+class Command(BaseCommand):
+    """
+    Create the resized / WebP variants of existing building photos and
+    icons, then the icon sprite of each university. Uploads made after
+    the derivative pipeline was added are handled on save; this is for
+    the backlog, or with --force after changing the IMAGE_* settings.
+    Safe to re-run: up to date buildings are skipped.
+    """
+
+    help = "Backfill building image derivatives and icon sprites"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--university", help="short_name, default: all universities")
+        parser.add_argument("--force", action="store_true", help="rebuild even if up to date")
+
+    def handle(self, *args, **options):
+        universities = University.objects.all()
+        if options["university"]:
+            universities = universities.filter(short_name__iexact=options["university"])
+            if not universities.exists():
+                raise CommandError(f"University {options['university']!r} not found")
+
+        started = time.monotonic()
+        buildings = (
+            Building.objects
+            .filter(university__in=universities)
+            .exclude(photo="", icon="")
+            .values_list("id", "university_id")
+        )
+
+        updated, processed = 0, set()
+        for building_id, university_id in buildings.iterator():
+            if process_building(building_id, force=options["force"]):
+                updated += 1
+                processed.add(university_id)
+
+        sprites = 0
+        for university_id in universities.values_list("id", flat=True):
+            if refresh_sprite(university_id):
+                sprites += 1
+            elif university_id not in processed:
+                continue
+            refresh_bundle(university_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{updated} buildings updated, {sprites} sprites rebuilt in {time.monotonic() - started:.1f}s"
+        ))
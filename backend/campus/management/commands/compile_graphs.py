@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from campus.graph import compile_graph
+from campus.models import University
+
+
+class Command(BaseCommand):
+    """
+    Compile the walking network of each university into its graph file
+    (see campus.graph). import_osm does this already; this is for a fresh
+    server, after restoring the database or after an upgrade that changes
+    the file format.
+    """
+
+    help = "Compile campus walking networks into memory-mapped graph files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--university", help="short_name, default: all universities")
+
+    def handle(self, *args, **options):
+        universities = University.objects.order_by("id")
+        if options["university"]:
+            universities = universities.filter(short_name__iexact=options["university"])
+            if not universities.exists():
+                raise CommandError(f"University {options['university']!r} not found")
+
+        for university in universities:
+            started = time.monotonic()
+            stats = compile_graph(university.pk)
+            if stats is None:
+                self.stdout.write(f"{university.short_name}: no walking network")
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f"{university.short_name}: {stats['nodes']} nodes, {stats['links'] // 2} edges, "
+                f"{stats['cells']} grid cells, {stats['bytes'] / 1024:.1f} KB "
+                f"({time.monotonic() - started:.2f}s)"
+            ))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from campus.graph import compile_graph
+from campus.models import University
+from campus.osm import OsmImportError, import_extract
+
+
+class Command(BaseCommand):
+    """
+    Import the walkways of a campus from an OpenStreetMap XML extract
+    (.osm, .osm.gz, .osm.bz2) into WalkNode / WalkEdge. The extract may
+    cover more than the campus, it is clipped to the university boundary
+    while streaming. Re-running with a newer extract only writes what
+    changed; --dry-run prints that diff without writing it. The graph
+    file the workers route on is compiled again afterwards.
+    """
+
+    help = "Build a campus walking network from an OpenStreetMap extract"
+
+    def add_arguments(self, parser):
+        parser.add_argument("university", help="short_name")
+        parser.add_argument("path", help="OSM XML extract")
+        parser.add_argument("--dry-run", action="store_true", help="show the changes, write nothing")
+
+    def handle(self, *args, **options):
+        try:
+            university = University.objects.get(short_name__iexact=options["university"])
+        except University.DoesNotExist:
+            raise CommandError(f"University {options['university']!r} not found")
+
+        try:
+            stats = import_extract(university, options["path"], dry_run=options["dry_run"])
+        except (OsmImportError, OSError) as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(
+            f"read {stats['nodes_read']} nodes and {stats['ways_read']} ways "
+            f"in {stats['parse_seconds']:.2f}s, {stats['ways_kept']} walkable ways on campus"
+        )
+        self.stdout.write(
+            f"graph: {stats['nodes']} nodes, {stats['edges']} edges "
+            f"(contracted in {stats['contract_seconds']:.2f}s)"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{'would write' if options['dry_run'] else 'wrote'} in {stats['write_seconds']:.2f}s: "
+            f"nodes +{stats['nodes_created']} ~{stats['nodes_updated']} -{stats['nodes_deleted']}, "
+            f"edges +{stats['edges_created']} ~{stats['edges_updated']} -{stats['edges_deleted']}"
+        ))
+
+        if not options["dry_run"]:
+            graph = compile_graph(university.pk)
+            if graph is not None:
+                self.stdout.write(f"compiled {graph['bytes'] / 1024:.1f} KB graph file")
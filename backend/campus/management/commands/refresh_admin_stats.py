@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from campus.stats import refresh_snapshots
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the cached admin dashboard snapshots.
+    Run it on a short schedule (cron / Render cron job), e.g. every minute.
+    """
+
+    help = "Rebuild the cached admin dashboard statistics"
+
+    def handle(self, *args, **options):
+        refresh_snapshots()
+        self.stdout.write(self.style.SUCCESS("Admin statistics refreshed"))
@@ -0,0 +1,78 @@
+import time
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from campus.models import University
+from campus.tiles import SOURCES, campus_tiles, fetch, padded_bounds, store_for
+
+
+class Command(BaseCommand):
+    """
+    Download every tile of a campus (bounds + padding, map zoom range)
+    into its MBTiles file. Seeded tiles are pinned: LRU eviction never
+    drops them, so the file can be copied to a server running with
+    TILE_OFFLINE=True. Tiles already in the file are skipped unless
+    --refresh is given.
+    """
+
+    help = "Pre-fetch the map tiles of a campus into the local tile cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("university", help="short_name")
+        parser.add_argument("--layer", choices=sorted(SOURCES), action="append",
+                            help="default: all layers")
+        parser.add_argument("--min-zoom", type=int, default=settings.TILE_MIN_ZOOM)
+        parser.add_argument("--max-zoom", type=int, default=settings.TILE_MAX_ZOOM)
+        parser.add_argument("--refresh", action="store_true", help="download tiles already cached again")
+        parser.add_argument("--delay", type=float, default=0.05,
+                            help="seconds between downloads, be nice to the tile servers")
+
+    def handle(self, *args, **options):
+        try:
+            university = University.objects.get(short_name__iexact=options["university"])
+        except University.DoesNotExist:
+            raise CommandError(f"University {options['university']!r} not found")
+
+        bounds = padded_bounds(university)
+        if bounds is None:
+            raise CommandError(f"{university.short_name} has no min/max lat/lng bounds")
+
+        tiles = list(campus_tiles(bounds, options["min_zoom"], options["max_zoom"]))
+
+        for layer in options["layer"] or sorted(SOURCES):
+            store = store_for(university.short_name, layer, readonly=False)
+            started = time.monotonic()
+            fetched = skipped = failed = 0
+
+            for zoom, x, y in tiles:
+                # already there (maybe from a visitor): just pin it
+                if not options["refresh"] and store.pin(zoom, x, y):
+                    skipped += 1
+                    continue
+                try:
+                    store.put(zoom, x, y, fetch(layer, zoom, x, y), pinned=True)
+                    fetched += 1
+                except requests.RequestException as exc:
+                    failed += 1
+                    self.stderr.write(f"{layer} {zoom}/{x}/{y}: {exc}")
+                time.sleep(options["delay"])
+
+            store.set_metadata(
+                name=f"{university.short_name} {layer}",
+                format="png" if layer == "dark" else "jpg",
+                bounds=",".join(str(v) for v in (bounds[1], bounds[0], bounds[3], bounds[2])),
+                minzoom=options["min_zoom"],
+                maxzoom=options["max_zoom"],
+            )
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{layer}: {fetched} fetched, {skipped} already cached, {failed} failed "
+                f"({store.size() / 1024 / 1024:.1f} MB, {time.monotonic() - started:.1f}s)"
+            ))
+            if store.size() > settings.TILE_CACHE_MAX_MB * 1024 * 1024:
+                self.stderr.write(
+                    f"{layer}: the campus is larger than TILE_CACHE_MAX_MB, "
+                    "visitor tiles will be evicted right away"
+                )
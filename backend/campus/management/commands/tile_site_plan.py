@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from campus.models import University
+from campus.siteplan import SitePlanError, build_tiles
+
+
+class Command(BaseCommand):
+    """
+    Cut a university's site plan into map tiles and print the
+    University.site_plan_tiles value as JSON. campus.siteplan runs this
+    in a child process after an upload, so the decoded plan stays out
+    of the web workers; it does not save the result itself.
+    """
+
+    help = "Cut a university's site plan into map tiles (used by campus.siteplan)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("university_id", type=int)
+
+    def handle(self, *args, **options):
+        university = University.objects.filter(pk=options["university_id"]).first()
+        if university is None or not university.site_plan:
+            raise CommandError(f"University {options['university_id']} has no site plan")
+
+        try:
+            tiles = build_tiles(university)
+        except SitePlanError as exc:
+            raise CommandError(str(exc)) from exc
+
+        self.stdout.write(json.dumps(tiles))
@@ -0,0 +1,288 @@
+"""
+Lightweight request metrics for the campus apps.
+
+Every gunicorn worker keeps its own counters and histograms in memory and
+dumps them to METRICS_DIR every few seconds (one JSON file per worker).
+The admin /metrics/ view merges all worker files and renders them in the
+Prometheus text format, so a scrape sees the totals of the whole server.
+Files of workers that are gone (by PID, METRICS_DIR is local to the host)
+are removed when a worker starts and on every scrape: a restarted worker
+starts its counters from zero, which Prometheus reads as a counter reset.
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "campus_http_requests_total": "Requests handled, by view and status.",
+    "campus_http_request_duration_seconds": "End to end view latency.",
+    "campus_db_queries_total": "Database queries executed while serving a view.",
+    "campus_db_query_seconds_total": "Time spent in the database while serving a view.",
+    "campus_cache_requests_total": "Cache lookups by cache name and result.",
+    "campus_ors_request_duration_seconds": "Latency of OpenRouteService calls.",
+    "campus_section_duration_seconds": "Time spent in named sections (serialization, middleware...).",
+    "campus_throttled_requests_total": "Requests refused by a token bucket.",
+    "campus_buffered_items_dropped_total": "Buffered rows lost because their batch failed to write.",
+}
+
+UNKNOWN = "unknown"
+
+WORKER_FILE = re.compile(r"metrics-(\d+)\.json(?:\.tmp)?")
+
+
+class MetricsRegistry:
+    """Thread safe in-process store for counters and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._last_dump = 0.0
+        self._pid = None
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                # one slot per bucket + the +Inf bucket, then sum
+                hist = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+                    break
+            else:
+                hist[len(LATENCY_BUCKETS)] += 1
+
+            hist[-1] += value
+
+    def snapshot(self):
+        """Return a JSON serializable copy of everything recorded so far."""
+        with self._lock:
+            return {
+                "counters": [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                "histograms": [
+                    [name, dict(labels), list(hist)]
+                    for (name, labels), hist in self._histograms.items()
+                ],
+            }
+
+    def dump(self, force=False):
+        """Write this worker's snapshot to METRICS_DIR (throttled)."""
+        now = time.monotonic()
+        if not force and now - self._last_dump < settings.METRICS_DUMP_INTERVAL:
+            return
+        self._last_dump = now
+
+        directory = settings.METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        # first dump of this worker: clear out the workers it replaced
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            prune(directory)
+
+        path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+
+        with open(tmp_path, "w") as fh:
+            json.dump(self.snapshot(), fh)
+
+        # atomic swap so a scrape never reads half a file
+        os.replace(tmp_path, path)
+
+
+registry = MetricsRegistry()
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # alive, owned by another user
+        return True
+    return True
+
+
+def prune(directory):
+    """Delete the files (and half written .tmp files) of dead workers."""
+    for filename in os.listdir(directory):
+        match = WORKER_FILE.fullmatch(filename)
+        if match is None or process_alive(int(match.group(1))):
+            continue
+        try:
+            os.remove(os.path.join(directory, filename))
+        except FileNotFoundError:
+            # another worker pruned it first
+            pass
+
+
+# ---------------------------
+# Recording helpers
+# ---------------------------
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe how long the wrapped block takes."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start, **labels)
+
+
+def cache_result(cache_name, hit, university=UNKNOWN):
+    registry.inc(
+        "campus_cache_requests_total",
+        cache=cache_name,
+        result="hit" if hit else "miss",
+        university=university,
+    )
+
+
+def known_universities():
+    """Lower-cased short names used as label values (cached)."""
+    names = cache.get("metrics_university_labels")
+
+    if names is None:
+        from .models import University
+
+        names = [
+            short_name.lower()
+            for short_name in University.objects.values_list("short_name", flat=True)
+        ]
+        cache.set("metrics_university_labels", names, 300)
+
+    return names
+
+
+def university_label(request):
+    """
+    Work out which university a request belongs to without extra queries.
+
+    Unknown values are collapsed to "unknown" so random URLs can't blow up
+    the number of label combinations.
+    """
+    short_name = request.GET.get("university")
+
+    match = getattr(request, "resolver_match", None)
+    if not short_name and match is not None:
+        short_name = match.kwargs.get("short_name")
+
+    if not short_name:
+        return UNKNOWN
+
+    short_name = short_name.lower()
+    return short_name if short_name in known_universities() else UNKNOWN
+
+
+# ---------------------------
+# Aggregation & exposition
+# ---------------------------
+def collect():
+    """Merge the dumps of every worker into one snapshot."""
+    registry.dump(force=True)
+
+    counters = {}
+    histograms = {}
+    directory = settings.METRICS_DIR
+    prune(directory)
+
+    for filename in os.listdir(directory):
+        if not (filename.startswith("metrics-") and filename.endswith(".json")):
+            continue
+
+        try:
+            with open(os.path.join(directory, filename)) as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            # worker is replacing its file right now, skip it this round
+            continue
+
+        for name, labels, value in data["counters"]:
+            key = MetricsRegistry._key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+
+        for name, labels, hist in data["histograms"]:
+            key = MetricsRegistry._key(name, labels)
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], hist)]
+            else:
+                histograms[key] = list(hist)
+
+    return counters, histograms
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in items) + "}"
+
+
+def render_prometheus():
+    """Render the merged metrics in the Prometheus text format."""
+    counters, histograms = collect()
+    lines = []
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), hist in sorted(histograms.items()):
+            if metric != name:
+                continue
+
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, hist):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+
+            cumulative += hist[len(LATENCY_BUCKETS)]
+            lines.append(f"{name}_bucket{_format_labels(labels, le='+Inf')} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist[-1]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    return "\n".join(lines) + "\n"
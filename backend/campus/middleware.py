@@ -1,12 +1,78 @@
-from django.db import IntegrityError
+import time
+
+from django.db import IntegrityError, connection
 from django.utils import timezone
 
+from . import counters, metrics
 from .models import (
     SiteVisit,
-    DailyStats,
     University)
 
 
+class MetricsMiddleware:
+    """
+    Records latency, status and database usage of every request.
+
+    Sits at the top of MIDDLEWARE so the time spent in the other
+    middleware (like SiteVisitMiddleware) is part of the measurement.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+
+        if (
+            request.path.startswith("/static/")
+            or request.path.startswith("/media/")
+        ):
+            return self.get_response(request)
+
+        db = {"queries": 0, "seconds": 0.0}
+
+        def count_queries(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db["queries"] += 1
+                db["seconds"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        university = metrics.university_label(request)
+
+        metrics.observe(
+            "campus_http_request_duration_seconds", elapsed,
+            view=view, university=university,
+        )
+        metrics.inc(
+            "campus_http_requests_total",
+            view=view, university=university, status=response.status_code,
+        )
+        metrics.inc(
+            "campus_db_queries_total", db["queries"],
+            view=view, university=university,
+        )
+        metrics.inc(
+            "campus_db_query_seconds_total", db["seconds"],
+            view=view, university=university,
+        )
+
+        try:
+            metrics.registry.dump()
+        except OSError:
+            # metrics must never break a request
+            pass
+
+        return response
+
+
 class SiteVisitMiddleware:
 
     def __init__(self, get_response):
@@ -22,6 +88,18 @@ class SiteVisitMiddleware:
         ):
             return self.get_response(request)
 
+        with metrics.timer(
+            "campus_section_duration_seconds",
+            section="site_visit_middleware",
+            university=metrics.UNKNOWN,
+        ):
+            self.record_visit(request)
+
+        return self.get_response(request)
+
+    def record_visit(self, request):
+        """Session bookkeeping: SiteVisit row and DailyStats counter."""
+
         # Ensure session exists
         if not request.session.session_key:
             request.session.create()
@@ -77,29 +155,22 @@ class SiteVisitMiddleware:
 
         # No university configured
         if not university:
-            return self.get_response(request)
+            return
 
         # -------------------------
         # Daily Statistics
         # -------------------------
 
+        # counted in memory, campus.counters flushes to DailyStats in batches
         today = timezone.now().date()
 
-        stats, _ = DailyStats.objects.get_or_create(
-            university=university,
-            date=today,
-        )
-
         last_counted = request.session.get(
             f"counted_date_{university.id}"
         )
 
         if last_counted != str(today):
-            stats.visitors += 1
-            stats.save()
+            counters.count("visitors", university.id)
 
             request.session[
                 f"counted_date_{university.id}"
             ] = str(today)
-
-        return self.get_response(request)
\ No newline at end of file
@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-19 19:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campus', '0011_remove_sitevisit_building_sitevisit_university'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuildingPopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('searches', models.PositiveIntegerField(default=0)),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('route_requests', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('building', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='popularity', to='campus.building')),
+                ('university', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='building_popularity', to='campus.university')),
+            ],
+            options={
+                'verbose_name_plural': 'Building popularity',
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalyticsEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('search', 'Search'), ('popup', 'Popup open'), ('route', 'Route request')], max_length=20)),
+                ('query', models.CharField(blank=True, max_length=100)),
+                ('origin_lat', models.FloatField(blank=True, null=True)),
+                ('origin_lng', models.FloatField(blank=True, null=True)),
+                ('destination_lat', models.FloatField(blank=True, null=True)),
+                ('destination_lng', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('building', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='analytics_events', to='campus.building')),
+                ('university', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analytics_events', to='campus.university')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['university', 'kind', 'created_at'], name='campus_anal_univers_b0aa7f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campus', '0012_buildingpopularity_analyticsevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailystats',
+            name='route_requests',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
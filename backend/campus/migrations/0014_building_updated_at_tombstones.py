@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-19 19:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campus', '0013_dailystats_route_requests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='building',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='BuildingTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('building_id', models.IntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('university', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='building_tombstones', to='campus.university')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['university', 'deleted_at'], name='campus_buil_univers_93457b_idx')],
+            },
+        ),
+    ]
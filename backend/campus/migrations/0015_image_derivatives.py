@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campus', '0014_building_updated_at_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='building',
+            name='images',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='university',
+            name='icon_sprite',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-19 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campus', '0015_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='university',
+            name='plan_max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='university',
+            name='plan_max_lng',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='university',
+            name='plan_min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='university',
+            name='plan_min_lng',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='university',
+            name='site_plan',
+            field=models.ImageField(blank=True, null=True, upload_to='universities/site_plans/'),
+        ),
+        migrations.AddField(
+            model_name='university',
+            name='site_plan_tiles',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campus', '0016_university_site_plan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='university',
+            name='boundary',
+            field=models.JSONField(blank=True, help_text='GeoJSON Polygon or MultiPolygon, [longitude, latitude] positions', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campus', '0017_university_boundary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='building',
+            name='entrances',
+            field=models.JSONField(blank=True, default=list, help_text='[[longitude, latitude], ...]'),
+        ),
+        migrations.AddField(
+            model_name='building',
+            name='footprint',
+            field=models.JSONField(blank=True, help_text='GeoJSON Polygon or MultiPolygon, [longitude, latitude] positions', null=True),
+        ),
+        migrations.AddField(
+            model_name='building',
+            name='footprint_levels',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-19 20:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campus', '0018_building_footprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalkNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('osm_id', models.BigIntegerField()),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('university', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='walk_nodes', to='campus.university')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalkEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('via_osm_id', models.BigIntegerField()),
+                ('highway', models.CharField(max_length=30)),
+                ('length', models.FloatField()),
+                ('geometry', models.JSONField(default=list)),
+                ('university', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='walk_edges', to='campus.university')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='campus.walknode')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='campus.walknode')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='walknode',
+            constraint=models.UniqueConstraint(fields=('university', 'osm_id'), name='unique_walk_node'),
+        ),
+        migrations.AddConstraint(
+            model_name='walkedge',
+            constraint=models.UniqueConstraint(fields=('source', 'target', 'via_osm_id'), name='unique_walk_edge'),
+        ),
+    ]
@@ -1,6 +1,11 @@
 # Creating models for our campus
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
+
+from .footprints import validate_entrances
+from .geojson import validate_boundary
 
 
 
@@ -25,6 +30,25 @@ class University(models.Model):
 
     # Right (east) → copy longitude → this is your max_lng
     max_lng = models.FloatField(blank=True, null=True)
+
+    # the real campus outline, the rectangle above is used without one (campus.geofence)
+    boundary = models.JSONField(
+        blank=True,
+        null=True,
+        help_text="GeoJSON Polygon or MultiPolygon, [longitude, latitude] positions",
+    )
+
+    # building icons packed into one image, one cell per category (campus.images)
+    icon_sprite = models.JSONField(default=dict, blank=True, editable=False)
+
+    # architect's site plan, cut into map tiles (campus.siteplan)
+    site_plan = models.ImageField(upload_to="universities/site_plans/", blank=True, null=True)
+    # where the plan's edges are, the campus bounds above when left blank
+    plan_min_lat = models.FloatField(blank=True, null=True)
+    plan_max_lat = models.FloatField(blank=True, null=True)
+    plan_min_lng = models.FloatField(blank=True, null=True)
+    plan_max_lng = models.FloatField(blank=True, null=True)
+    site_plan_tiles = models.JSONField(default=dict, blank=True, editable=False)
    
     class Meta:
         verbose_name = "University"
@@ -32,6 +56,12 @@ class University(models.Model):
 
     def __str__(self):
         return self.name
+
+    def clean(self):
+        try:
+            validate_boundary(self.boundary)
+        except ValidationError as exc:
+            raise ValidationError({"boundary": exc.messages})
     
     
 class Building(models.Model):
@@ -53,10 +83,127 @@ class Building(models.Model):
     null=True,
     blank=True) # remove blank after adding university to all existing buildings for migration error
 
+    # resized / WebP variants of photo and icon (campus.images)
+    images = models.JSONField(default=dict, blank=True, editable=False)
+
+    # outline and doors, routes end at the nearest door (campus.footprints)
+    footprint = models.JSONField(
+        blank=True,
+        null=True,
+        help_text="GeoJSON Polygon or MultiPolygon, [longitude, latitude] positions",
+    )
+    entrances = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="[[longitude, latitude], ...]",
+    )
+    # footprint simplified for each map zoom, refreshed on save
+    footprint_levels = models.JSONField(default=dict, blank=True, editable=False)
+
+    # drives the ?since= delta sync of the buildings API
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
     def __str__(self):
         return self.name
+
+    def clean(self):
+        errors = {}
+        for field, validate in (("footprint", validate_boundary), ("entrances", validate_entrances)):
+            try:
+                validate(getattr(self, field))
+            except ValidationError as exc:
+                errors[field] = exc.messages
+        if errors:
+            raise ValidationError(errors)
+
+
+class BuildingTombstone(models.Model):
+    """
+    A deleted building (or one moved to another university), so delta
+    sync clients learn to drop it. Pruned after BUILDINGS_TOMBSTONE_DAYS;
+    clients older than that get a full snapshot instead.
+    """
+
+    building_id = models.IntegerField()
+
+    university = models.ForeignKey(
+        University,
+        on_delete=models.CASCADE,
+        related_name="building_tombstones",
+        null=True,
+        blank=True
+    )
+
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["university", "deleted_at"]),
+        ]
+
+    def __str__(self):
+        return f"building {self.building_id} deleted {self.deleted_at:%Y-%m-%d %H:%M}"
     
 
+class WalkNode(models.Model):
+    """
+    A junction or dead end of the walking network, imported from
+    OpenStreetMap (campus.osm). Nodes in the middle of a path are kept
+    in the geometry of its WalkEdge.
+    """
+
+    university = models.ForeignKey(
+        University,
+        on_delete=models.CASCADE,
+        related_name="walk_nodes"
+    )
+
+    osm_id = models.BigIntegerField()
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["university", "osm_id"], name="unique_walk_node"),
+        ]
+
+    def __str__(self):
+        return f"node {self.osm_id}"
+
+
+class WalkEdge(models.Model):
+    """
+    A walkable path between two WalkNodes, both ways. source has the lower
+    OSM id; via is the OSM node right after source, which tells apart two
+    paths joining the same nodes.
+    """
+
+    university = models.ForeignKey(
+        University,
+        on_delete=models.CASCADE,
+        related_name="walk_edges"
+    )
+
+    source = models.ForeignKey(WalkNode, on_delete=models.CASCADE, related_name="+")
+    target = models.ForeignKey(WalkNode, on_delete=models.CASCADE, related_name="+")
+    via_osm_id = models.BigIntegerField()
+
+    # OSM highway=* (footway, steps, service...)
+    highway = models.CharField(max_length=30)
+    # metres along the geometry
+    length = models.FloatField()
+    # [[lng, lat], ...] from source to target
+    geometry = models.JSONField(default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["source", "target", "via_osm_id"], name="unique_walk_edge"),
+        ]
+
+    def __str__(self):
+        return f"{self.highway} {self.source_id} - {self.target_id}"
+
+
 class SiteVisit(models.Model):
 
     session_key = models.CharField(
@@ -96,6 +243,8 @@ class DailyStats(models.Model):
 
     visitors = models.PositiveIntegerField(default=0)
 
+    route_requests = models.PositiveIntegerField(default=0)
+
     class Meta:
         unique_together = ("university", "date")
 
@@ -110,4 +259,79 @@ class CampusAdminUser(models.Model):
     university = models.ForeignKey("University", on_delete=models.CASCADE)
 
     def __str__(self):
-        return f"{self.user.username} ({self.university.short_name})"
\ No newline at end of file
+        return f"{self.user.username} ({self.university.short_name})"
+
+class AnalyticsEvent(models.Model):
+    """
+    what visitors look for on the map
+    written in batches by campus.analytics.event_buffer
+    """
+
+    KIND_CHOICES = (
+        ("search", "Search"),
+        ("popup", "Popup open"),
+        ("route", "Route request"),
+    )
+
+    university = models.ForeignKey(
+        University,
+        on_delete=models.CASCADE,
+        related_name="analytics_events"
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+
+    building = models.ForeignKey(
+        Building,
+        on_delete=models.SET_NULL,
+        related_name="analytics_events",
+        null=True,
+        blank=True
+    )
+
+    query = models.CharField(max_length=100, blank=True)
+
+    # route origin / destination
+    origin_lat = models.FloatField(blank=True, null=True)
+    origin_lng = models.FloatField(blank=True, null=True)
+    destination_lat = models.FloatField(blank=True, null=True)
+    destination_lng = models.FloatField(blank=True, null=True)
+
+    # set when the event is received, not when the batch is written
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["university", "kind", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} - {self.university.short_name}"
+
+
+class BuildingPopularity(models.Model):
+    """running totals derived from AnalyticsEvent batches"""
+
+    building = models.OneToOneField(
+        Building,
+        on_delete=models.CASCADE,
+        related_name="popularity"
+    )
+
+    university = models.ForeignKey(
+        University,
+        on_delete=models.CASCADE,
+        related_name="building_popularity"
+    )
+
+    searches = models.PositiveIntegerField(default=0)
+    views = models.PositiveIntegerField(default=0)
+    route_requests = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Building popularity"
+
+    def __str__(self):
+        return self.building.name
@@ -0,0 +1,309 @@
+"""
+The campus walking network, imported from an OpenStreetMap extract.
+
+OSM XML is read with ElementTree.iterparse and every element is cleared
+once handled, so memory follows the size of the campus, not the file (a
+country extract works as well as a campus export). .osm.gz / .osm.bz2
+are decompressed on the fly. Nodes come before ways in OSM files, so a
+single pass is enough:
+
+- nodes: coordinates kept only for those inside the campus boundary
+  (University.boundary, else the min/max rectangle, see campus.geofence)
+- ways: kept when pedestrians may use them (walkable), cut where they
+  leave the campus
+
+The ways are then turned into a graph where nodes in the middle of a
+path (two neighbours, same highway type on both sides) are contracted
+into the geometry of the edge, and written as WalkNode / WalkEdge rows.
+Writing is a diff against what is stored: a re-import of the same
+extract changes nothing, an updated extract only touches what moved.
+"""
+import bz2
+import gzip
+import math
+import time
+import xml.etree.ElementTree as ElementTree
+from collections import defaultdict
+
+from django.db import transaction
+
+from .bundle import schedule_refresh
+from .geofence import prepare
+from .models import WalkEdge, WalkNode
+from .versions import bump_map_version
+
+BATCH_SIZE = 1000
+
+EARTH_RADIUS = 6_371_008.8
+
+# highway=* values walked on unless tagged otherwise
+WALKABLE = {
+    "footway", "pedestrian", "path", "steps", "corridor", "living_street",
+    "residential", "service", "unclassified", "track", "tertiary",
+    "tertiary_link", "secondary", "secondary_link", "primary", "primary_link",
+    "road", "bridleway", "cycleway",
+}
+# only with an explicit foot=yes / designated / sidewalk
+NEEDS_FOOT = {"cycleway", "bridleway", "primary", "primary_link"}
+
+FOOT_ALLOWED = {"yes", "designated", "permissive"}
+FOOT_DENIED = {"no", "private"}
+
+
+class OsmImportError(Exception):
+    """The extract can't be imported (format, no campus boundary)."""
+
+
+# ---------------------------
+# Parsing
+# ---------------------------
+def open_extract(path):
+    if path.endswith(".pbf"):
+        raise OsmImportError(
+            "PBF extracts are not supported, convert them to XML first: "
+            "osmium cat extract.osm.pbf -o extract.osm"
+        )
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def walkable(tags):
+    """can pedestrians use a way with these tags"""
+    highway = tags.get("highway")
+    foot = tags.get("foot", "")
+    if highway is None or highway not in WALKABLE and foot not in FOOT_ALLOWED:
+        return False
+    if foot in FOOT_DENIED or tags.get("area") == "yes":
+        return False
+    if tags.get("access") in FOOT_DENIED and foot not in FOOT_ALLOWED:
+        return False
+    if highway in NEEDS_FOOT:
+        return foot in FOOT_ALLOWED or tags.get("sidewalk", "no") not in ("no", "none")
+    return True
+
+
+def parse(fh, prepared, stats):
+    """
+    (coordinates {osm id: (lat, lng)} of campus nodes, [(highway, [refs])]
+    of walkable way pieces inside the campus)
+    """
+    coordinates = {}
+    ways = []
+
+    context = ElementTree.iterparse(fh, events=("start", "end"))
+    _, root = next(context)
+
+    for event, element in context:
+        if event != "end":
+            continue
+
+        if element.tag == "node":
+            stats["nodes_read"] += 1
+            lat, lng = float(element.get("lat")), float(element.get("lon"))
+            if prepared.contains(lat, lng):
+                coordinates[int(element.get("id"))] = (lat, lng)
+
+        elif element.tag == "way":
+            stats["ways_read"] += 1
+            tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+            if walkable(tags):
+                refs = [int(nd.get("ref")) for nd in element.iter("nd")]
+                pieces = split_outside(refs, coordinates)
+                stats["ways_kept"] += bool(pieces)
+                ways.extend((tags["highway"], piece) for piece in pieces)
+
+        elif element.tag != "relation":
+            continue
+
+        # drop what was read so far, the tree never grows
+        root.clear()
+
+    return coordinates, ways
+
+
+def split_outside(refs, coordinates):
+    """the runs of at least two consecutive nodes inside the campus"""
+    pieces, current = [], []
+    for ref in refs:
+        if ref in coordinates:
+            current.append(ref)
+            continue
+        if len(current) > 1:
+            pieces.append(current)
+        current = []
+    if len(current) > 1:
+        pieces.append(current)
+    return pieces
+
+
+# ---------------------------
+# Graph
+# ---------------------------
+def distance(a, b):
+    """haversine metres between two (lat, lng)"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(h))
+
+
+def build_graph(coordinates, ways):
+    """
+    Contract the ways into ({osm id: (lat, lng)} of the kept nodes,
+    {(source, target, via): (highway, length, [[lng, lat], ...])}).
+    """
+    neighbours = defaultdict(dict)  # osm id -> {neighbour: highway}
+    for highway, refs in ways:
+        for a, b in zip(refs, refs[1:]):
+            if a != b:
+                neighbours[a].setdefault(b, highway)
+                neighbours[b].setdefault(a, highway)
+
+    def contracted(node):
+        links = neighbours[node]
+        return len(links) == 2 and len(set(links.values())) == 1
+
+    kept = {node for node in neighbours if not contracted(node)}
+    edges = {}
+    walked = set()
+
+    def walk(start, first):
+        path = [start, first]
+        while path[-1] not in kept and path[-1] != start:
+            previous, current = path[-2], path[-1]
+            path.append(next(n for n in neighbours[current] if n != previous))
+        for a, b in zip(path, path[1:]):
+            walked.add((a, b))
+            walked.add((b, a))
+        return path
+
+    def add(path):
+        if path[0] == path[-1]:
+            # a loop back to the same junction (a cul-de-sac ring road) still
+            # leads to the buildings along it: keep it as two edges meeting
+            # at its middle node
+            middle = len(path) // 2
+            add(path[:middle + 1])
+            add(path[middle:])
+            return
+        if path[0] > path[-1]:
+            path.reverse()
+        points = [coordinates[ref] for ref in path]
+        key = (path[0], path[-1], path[1])
+        edges[key] = (
+            neighbours[path[0]][path[1]],
+            round(sum(distance(a, b) for a, b in zip(points, points[1:])), 2),
+            [[lng, lat] for lat, lng in points],
+        )
+
+    # a ring without junctions (a path around a pond, on its own) is never
+    # reached from a kept node, and leads nowhere anyway
+    for node in kept:
+        for neighbour in neighbours[node]:
+            if (node, neighbour) not in walked:
+                add(walk(node, neighbour))
+
+    used = {ref for source, target, _ in edges for ref in (source, target)}
+    return {ref: coordinates[ref] for ref in used}, edges
+
+
+# ---------------------------
+# Writing
+# ---------------------------
+def write_graph(university, nodes, edges, stats):
+    """Bring WalkNode / WalkEdge in line with the graph, as a diff."""
+    existing_nodes = {
+        node.osm_id: node
+        for node in WalkNode.objects.filter(university=university)
+    }
+    osm_ids = {node.pk: osm_id for osm_id, node in existing_nodes.items()}
+    existing_edges = {
+        (osm_ids[edge.source_id], osm_ids[edge.target_id], edge.via_osm_id): edge
+        for edge in WalkEdge.objects.filter(university=university)
+    }
+
+    # removed edges first, those of removed nodes would otherwise go uncounted
+    stale = [edge.pk for key, edge in existing_edges.items() if key not in edges]
+    WalkEdge.objects.filter(pk__in=stale).delete()
+    stats["edges_deleted"] = len(stale)
+
+    stale = [node.pk for osm_id, node in existing_nodes.items() if osm_id not in nodes]
+    moved = []
+    for osm_id, (lat, lng) in nodes.items():
+        node = existing_nodes.get(osm_id)
+        if node is not None and (node.latitude, node.longitude) != (lat, lng):
+            node.latitude, node.longitude = lat, lng
+            moved.append(node)
+    created = [
+        WalkNode(university=university, osm_id=osm_id, latitude=lat, longitude=lng)
+        for osm_id, (lat, lng) in nodes.items()
+        if osm_id not in existing_nodes
+    ]
+
+    WalkNode.objects.filter(pk__in=stale).delete()
+    WalkNode.objects.bulk_update(moved, ["latitude", "longitude"], batch_size=BATCH_SIZE)
+    WalkNode.objects.bulk_create(created, batch_size=BATCH_SIZE)
+    stats.update(nodes_created=len(created), nodes_updated=len(moved), nodes_deleted=len(stale))
+
+    node_ids = dict(
+        WalkNode.objects.filter(university=university).values_list("osm_id", "pk")
+    )
+
+    changed, created = [], []
+    for key, (highway, length, geometry) in edges.items():
+        edge = existing_edges.get(key)
+        if edge is None:
+            created.append(WalkEdge(
+                university=university,
+                source_id=node_ids[key[0]],
+                target_id=node_ids[key[1]],
+                via_osm_id=key[2],
+                highway=highway,
+                length=length,
+                geometry=geometry,
+            ))
+        elif (edge.highway, edge.length, edge.geometry) != (highway, length, geometry):
+            edge.highway, edge.length, edge.geometry = highway, length, geometry
+            changed.append(edge)
+
+    WalkEdge.objects.bulk_update(changed, ["highway", "length", "geometry"], batch_size=BATCH_SIZE)
+    WalkEdge.objects.bulk_create(created, batch_size=BATCH_SIZE)
+    stats.update(edges_created=len(created), edges_updated=len(changed))
+
+
+def import_extract(university, path, dry_run=False):
+    """Import the walkways of an extract into the university's network; returns stats."""
+    prepared = prepare(university)
+    if prepared is None:
+        raise OsmImportError(f"{university.short_name} has no boundary or min/max lat/lng bounds")
+
+    stats = defaultdict(int)
+
+    started = time.perf_counter()
+    try:
+        with open_extract(path) as fh:
+            coordinates, ways = parse(fh, prepared, stats)
+    except ElementTree.ParseError as exc:
+        raise OsmImportError(f"not an OSM XML file: {exc}") from exc
+    stats["parse_seconds"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    nodes, edges = build_graph(coordinates, ways)
+    stats.update(nodes=len(nodes), edges=len(edges), contract_seconds=time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with transaction.atomic():
+        write_graph(university, nodes, edges, stats)
+        if dry_run:
+            transaction.set_rollback(True)
+    stats["write_seconds"] = time.perf_counter() - started
+
+    changes = ("nodes_created", "nodes_updated", "nodes_deleted", "edges_created", "edges_updated", "edges_deleted")
+    if not dry_run and any(stats[key] for key in changes):
+        # the offline bundle carries the walkways
+        bump_map_version(university.pk)
+        schedule_refresh(university.pk)
+
+    return stats
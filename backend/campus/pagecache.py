@@ -0,0 +1,133 @@
+"""
+Full-page cache for campus_map.
+
+The page only depends on the University row and the template (buildings
+are fetched by the browser from the API), so the rendered HTML is cached
+per (university, data version, template hash) together with a gzip copy
+compressed once at render time. Saving or deleting a University or one of
+its buildings bumps that university's version (see campus.signals), and a
+deploy that changes the template changes the hash.
+
+Nothing per visitor ends up in the cache: the page is rendered without a
+request, so a {% csrf_token %} added to the template later would render
+empty instead of baking one visitor's token into everybody's page. The
+visit session cookie is set on each fresh response by the middleware.
+The page itself needs no CSRF token: /api/events/ has no session
+authentication and the route API is a GET.
+"""
+import gzip
+import hashlib
+import json
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.template.loader import get_template
+from django.utils.cache import patch_vary_headers
+
+from .geofence import outline
+from .images import sprite_for_client
+from .models import University
+from .siteplan import plan_layer
+from .tiles import tile_url_templates
+from .versions import map_version
+
+TEMPLATE_NAME = "campus_map.html"
+
+# safety net for caches that are not shared between workers
+PAGE_TTL = 60 * 60 * 24
+
+
+@lru_cache(maxsize=1)
+def template_hash():
+    """hash of the template source, read once per worker"""
+    with open(get_template(TEMPLATE_NAME).origin.name, "rb") as fh:
+        return hashlib.sha1(fh.read()).hexdigest()[:12]
+
+
+def campus_boundary(university):
+    """[[lat, lng], ...] outline: the boundary polygon, else the min/max rectangle"""
+    return outline(university)
+
+
+def map_context(university):
+    # Pass JSON to template
+    return {
+        "university": university,
+        "campus_boundary_json": json.dumps(campus_boundary(university)),
+        "icon_sprite_json": json.dumps(sprite_for_client(university)),
+        "tile_urls_json": json.dumps(tile_url_templates(university)),
+        "site_plan_json": json.dumps(plan_layer(university)),
+    }
+
+
+def render_page(university):
+    """(etag, html bytes, gzip bytes) for one university"""
+    body = get_template(TEMPLATE_NAME).render(map_context(university)).encode()
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+    # mtime=0 so every worker produces the same bytes
+    return etag, body, gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def get_page(university_id):
+    """
+    Cached (etag, html, gzip) of an active university's page, rendered on
+    a miss. Returns (page, hit); page is None when the university is gone.
+    """
+    key = f"campus_map:{university_id}:{map_version(university_id)}:{template_hash()}"
+    page = cache.get(key)
+
+    if page is not None:
+        return page, True
+
+    university = University.objects.filter(id=university_id, active=True).first()
+    if university is None:
+        return None, False
+
+    page = render_page(university)
+    cache.set(key, page, PAGE_TTL)
+    return page, False
+
+
+def accepts_gzip(request):
+    """does Accept-Encoding allow gzip: listed (or *) with a q above 0"""
+    weights = {}
+    for coding in request.headers.get("Accept-Encoding", "").split(","):
+        name, *params = [part.strip() for part in coding.split(";")]
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name.lower()] = weight
+
+    for name in ("gzip", "x-gzip", "*"):
+        if name in weights:
+            return weights[name] > 0
+    return False
+
+
+def page_response(request, page):
+    """
+    304 when the browser's copy is current, otherwise the gzip or plain
+    bytes depending on Accept-Encoding.
+    """
+    etag, body, gzipped = page
+
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponseNotModified()
+    elif accepts_gzip(request):
+        response = HttpResponse(gzipped, content_type="text/html; charset=utf-8")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = HttpResponse(body, content_type="text/html; charset=utf-8")
+
+    response["ETag"] = etag
+    # always revalidate, the ETag makes that a cheap 304
+    response["Cache-Control"] = "no-cache"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
@@ -0,0 +1,24 @@
+from rest_framework.permissions import BasePermission
+
+
+class IsCampusStaff(BasePermission):
+    """superusers and campus admins"""
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(
+            user and user.is_authenticated
+            and (user.is_superuser or hasattr(user, "campus_admin"))
+        )
+
+
+def staff_university_id(request):
+    """
+    The university a staff request is about: a campus admin's own one,
+    for superusers ?university=<id> or None for all of them.
+    """
+    if not request.user.is_superuser:
+        return request.user.campus_admin.university_id
+
+    university = request.query_params.get("university", "")
+    return int(university) if university.isdigit() else None
@@ -1,9 +1,66 @@
 from rest_framework import serializers
-from.models import Building
+from.models import AnalyticsEvent, Building
+from .footprints import footprint_at
+from .images import derivative_urls
 
 #create a serializer for converting buildings to json
 
 class BuildingSerializer(serializers.ModelSerializer):
+    """
+    photo / icon point at the resized derivatives once they exist (the
+    originals can be several MB); images lists every variant and format.
+    With a zoom in the context, footprint is the variant for that zoom.
+    """
+
+    # field -> the variant that replaces the original
+    PREFERRED = {
+        "photo": ("medium", "jpeg"),
+        "icon": ("icon", "png"),
+    }
+
     class Meta:
         model = Building
-        fields = "__all__"
\ No newline at end of file
+        exclude = ("images", "footprint_levels")
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        images = derivative_urls(instance.images, self.context.get("request"))
+
+        for field, (variant, fmt) in self.PREFERRED.items():
+            url = images.get(field, {}).get(variant, {}).get(fmt)
+            if url:
+                data[field] = url
+
+        data["images"] = images
+
+        zoom = self.context.get("zoom")
+        if zoom is not None:
+            data["footprint"] = footprint_at(instance.footprint_levels, zoom)
+        return data
+
+
+class LatLngField(serializers.ListField):
+    """[lat, lng] pair"""
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            child=serializers.FloatField(),
+            min_length=2,
+            max_length=2,
+            **kwargs
+        )
+
+
+class AnalyticsEventSerializer(serializers.Serializer):
+    """one event sent by the map, validated without touching the db"""
+
+    kind = serializers.ChoiceField(choices=AnalyticsEvent.KIND_CHOICES)
+    building = serializers.IntegerField(required=False, allow_null=True)
+    query = serializers.CharField(required=False, allow_blank=True, max_length=100)
+    origin = LatLngField(required=False)
+    destination = LatLngField(required=False)
+
+
+class AnalyticsBatchSerializer(serializers.Serializer):
+    university = serializers.CharField(max_length=20)
+    events = AnalyticsEventSerializer(many=True, max_length=50, allow_empty=False)
@@ -0,0 +1,107 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from . import footprints, geofence, images, siteplan
+from .models import Building, BuildingTombstone, University
+from .bundle import schedule_refresh
+from .versions import bump_map_version
+from .sync import prune_tombstones
+
+
+@receiver(post_save, sender=University)
+@receiver(post_delete, sender=University)
+def invalidate_university(sender, instance, **kwargs):
+    """new name / logo / bounds, or it was (de)activated"""
+    bump_map_version(instance.pk)
+    cache.delete("active_university_ids")
+    geofence.invalidate()
+    # again once the change is visible to the other workers
+    transaction.on_commit(geofence.invalidate)
+    transaction.on_commit(lambda: schedule_refresh(instance.pk))
+
+
+@receiver(post_save, sender=University)
+def tile_site_plan(sender, instance, **kwargs):
+    """new plan or new bounds: cut the tiles again"""
+    if siteplan.is_stale(instance):
+        university_id = instance.pk
+        transaction.on_commit(lambda: siteplan.schedule(university_id))
+
+
+@receiver(post_save, sender=Building)
+@receiver(post_delete, sender=Building)
+def invalidate_building(sender, instance, **kwargs):
+    if instance.university_id:
+        university_id = instance.university_id
+        bump_map_version(university_id)
+        # rebuild the offline bundle now rather than on the next poll
+        transaction.on_commit(lambda: schedule_refresh(university_id))
+
+
+@receiver(pre_save, sender=Building)
+def simplify_footprint(sender, instance, **kwargs):
+    """a few milliseconds for a surveyed outline, done with the save"""
+    instance.footprint_levels = footprints.footprint_levels(instance.footprint)
+
+
+@receiver(post_init, sender=Building)
+def remember_university(sender, instance, **kwargs):
+    instance._synced_university_id = instance.__dict__.get("university_id")
+    instance._synced_category = instance.__dict__.get("category")
+
+
+@receiver(post_save, sender=Building)
+def derive_images(sender, instance, created, **kwargs):
+    """new upload: resize it; new category: its icon moves to another sprite cell"""
+    # connected before tombstone_moved_building, which resets _synced_university_id
+    has_icon = bool((instance.images or {}).get("icon"))
+    old_university = getattr(instance, "_synced_university_id", None)
+    moved = has_icon and old_university != instance.university_id
+    recategorized = has_icon and getattr(instance, "_synced_category", None) != instance.category
+    instance._synced_category = instance.category
+
+    if images.stale_fields(instance) or moved or recategorized:
+        building_id = instance.pk
+        university_ids = {old_university, instance.university_id}
+        transaction.on_commit(lambda: images.schedule(building_id, university_ids))
+
+
+@receiver(images.derivatives_changed)
+def refresh_bundle_images(sender, university_id, **kwargs):
+    """the bundle embeds the icons and links the photo variants"""
+    schedule_refresh(university_id)
+
+
+@receiver(post_save, sender=Building)
+def tombstone_moved_building(sender, instance, created, **kwargs):
+    """moving a building to another campus deletes it from the old one"""
+    old = getattr(instance, "_synced_university_id", None)
+    if not created and old and old != instance.university_id:
+        BuildingTombstone.objects.create(building_id=instance.pk, university_id=old)
+        bump_map_version(old)
+    instance._synced_university_id = instance.university_id
+
+
+@receiver(post_delete, sender=Building)
+def tombstone_deleted_building(sender, instance, origin=None, **kwargs):
+    # the whole university is going away, nobody syncs it anymore
+    if isinstance(origin, University) or getattr(origin, "model", None) is University:
+        return
+
+    BuildingTombstone.objects.create(
+        building_id=instance.pk,
+        university_id=instance.university_id,
+    )
+    prune_tombstones()
+
+
+@receiver(post_delete, sender=Building)
+def drop_sprite_icon(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, University) or getattr(origin, "model", None) is University:
+        return
+
+    if (instance.images or {}).get("icon") and instance.category:
+        university_id = instance.university_id
+        transaction.on_commit(lambda: images.schedule(None, [university_id]))
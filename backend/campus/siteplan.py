@@ -0,0 +1,332 @@
+"""
+XYZ tiles cut from an uploaded campus site plan.
+
+An architect's site plan is usually more accurate than the satellite
+imagery. University.site_plan is georeferenced by its bounds (plan_*
+fields, the campus bounds when left blank, north up) and cut into 256px
+PNG tiles for the map's zoom range after the upload commits, by a
+background thread like the other derivative jobs.
+
+Memory stays bounded by the plan, not the pyramid: the plan is decoded
+once at the scale the highest zoom needs (JPEG decodes straight to it,
+other formats decode whole); that zoom is cut one row of tiles at a time,
+and every lower zoom is built from the four tiles above each of its
+tiles, read back from storage. Empty tiles are not written.
+
+Only JPEG can be decoded in part, so the thread doesn't cut the plan
+itself: it runs manage.py tile_site_plan in a child process and stores
+the summary it prints. The decoded plan never enters the web worker,
+and its memory goes back to the system when the child exits. The child
+is bounded by SITE_PLAN_MAX_PIXELS: an RGB / RGBA plan takes 3-4 bytes
+per pixel, a palette, greyscale or CMYK one up to 8 while it is
+converted to RGBA. That is about 130 MB at the 16 megapixel default,
+plus a few rows of tiles.
+
+Tiles live under site_plans/tiles/<university>/<hash>/ where the hash
+covers the plan bytes and bounds, so a URL's content never changes and
+/api/plan-tiles/ serves them as immutable. Leaflet only requests them
+inside the plan bounds and scales up above the highest zoom cut.
+"""
+import hashlib
+import io
+import json
+import logging
+import math
+import subprocess
+import sys
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from PIL import Image, UnidentifiedImageError
+
+from .images import same_upload
+from .models import University
+from .versions import bump_map_version
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+
+# seconds the child process gets to cut a plan
+CUT_TIMEOUT = 10 * 60
+
+
+class SitePlanError(Exception):
+    """The upload can't be tiled (not an image, too large, no bounds)."""
+
+
+# ---------------------------
+# Georeferencing
+# ---------------------------
+def plan_bounds(university):
+    """(south, west, north, east) of the plan, the campus bounds by default"""
+    bounds = (
+        university.plan_min_lat if university.plan_min_lat is not None else university.min_lat,
+        university.plan_min_lng if university.plan_min_lng is not None else university.min_lng,
+        university.plan_max_lat if university.plan_max_lat is not None else university.max_lat,
+        university.plan_max_lng if university.plan_max_lng is not None else university.max_lng,
+    )
+    return None if any(value is None for value in bounds) else bounds
+
+
+def world_pixel(lat, lng, zoom):
+    """Web Mercator pixel coordinates (floats) at zoom"""
+    size = TILE_SIZE * 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = (lng + 180.0) / 360.0 * size
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * size
+    return x, y
+
+
+def pixel_box(bounds, zoom):
+    """(left, top, right, bottom) of the plan in world pixels at zoom"""
+    south, west, north, east = bounds
+    left, top = world_pixel(north, west, zoom)
+    right, bottom = world_pixel(south, east, zoom)
+    return left, top, right, bottom
+
+
+def native_zoom(bounds, width):
+    """lowest zoom at which the plan is shown at (at least) its own resolution"""
+    for zoom in range(settings.TILE_MIN_ZOOM, settings.TILE_MAX_ZOOM + 1):
+        left, _, right, _ = pixel_box(bounds, zoom)
+        if right - left >= width:
+            return zoom
+    return settings.TILE_MAX_ZOOM
+
+
+# ---------------------------
+# Tiling
+# ---------------------------
+def tile_name(prefix, zoom, x, y):
+    return f"{prefix}/{zoom}/{x}/{y}.png"
+
+
+def save_tile(prefix, zoom, x, y, tile):
+    # fully transparent tiles aren't worth a request
+    if tile.getbbox() is None:
+        return False
+
+    buffer = io.BytesIO()
+    tile.save(buffer, "PNG", optimize=True)
+    name = tile_name(prefix, zoom, x, y)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(buffer.getvalue()))
+    return True
+
+
+def open_plan(field, bounds):
+    """the decoded plan, no larger than the highest zoom needs, and that zoom"""
+    with field.open("rb") as fh:
+        image = Image.open(fh)
+        width, height = image.size
+        if width * height > settings.SITE_PLAN_MAX_PIXELS:
+            raise SitePlanError(f"{width}x{height} is more than SITE_PLAN_MAX_PIXELS")
+
+        zoom = native_zoom(bounds, width)
+        left, top, right, bottom = pixel_box(bounds, zoom)
+        image.draft("RGB", (math.ceil(right - left), math.ceil(bottom - top)))
+        image.load()
+        # pasted onto RGBA strips as is, only other modes need a (second) copy
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+
+    return image, zoom
+
+
+def cut_top_zoom(image, bounds, zoom, prefix):
+    """Cut the highest zoom one row of tiles at a time; returns the tile count."""
+    left, top, right, bottom = pixel_box(bounds, zoom)
+    scale_y = image.height / (bottom - top)
+
+    first_x, last_x = int(left // TILE_SIZE), int((right - 1e-9) // TILE_SIZE)
+    first_y, last_y = int(top // TILE_SIZE), int((bottom - 1e-9) // TILE_SIZE)
+    strip_left = first_x * TILE_SIZE
+    out_width = max(round(right) - round(left), 1)
+
+    count = 0
+    for ty in range(first_y, last_y + 1):
+        # the part of the plan inside this row of tiles
+        row_top, row_bottom = ty * TILE_SIZE, (ty + 1) * TILE_SIZE
+        a, b = max(top, row_top), min(bottom, row_bottom)
+        out_height = max(round(b) - round(a), 1)
+
+        part = image.resize(
+            (out_width, out_height),
+            Image.LANCZOS,
+            box=(0, (a - top) * scale_y, image.width, (b - top) * scale_y),
+        )
+        strip = Image.new("RGBA", ((last_x - first_x + 1) * TILE_SIZE, TILE_SIZE))
+        strip.paste(part, (round(left) - strip_left, round(a) - row_top))
+
+        for tx in range(first_x, last_x + 1):
+            offset = (tx - first_x) * TILE_SIZE
+            tile = strip.crop((offset, 0, offset + TILE_SIZE, TILE_SIZE))
+            count += save_tile(prefix, zoom, tx, ty, tile)
+
+    return count
+
+
+def build_lower_zoom(bounds, zoom, prefix):
+    """Each tile of `zoom` from the four tiles of zoom + 1 under it."""
+    left, top, right, bottom = pixel_box(bounds, zoom)
+
+    count = 0
+    for ty in range(int(top // TILE_SIZE), int((bottom - 1e-9) // TILE_SIZE) + 1):
+        for tx in range(int(left // TILE_SIZE), int((right - 1e-9) // TILE_SIZE) + 1):
+            canvas = Image.new("RGBA", (TILE_SIZE * 2, TILE_SIZE * 2))
+            for dx in (0, 1):
+                for dy in (0, 1):
+                    name = tile_name(prefix, zoom + 1, tx * 2 + dx, ty * 2 + dy)
+                    if default_storage.exists(name):
+                        with default_storage.open(name, "rb") as fh:
+                            with Image.open(fh) as child:
+                                canvas.paste(child, (dx * TILE_SIZE, dy * TILE_SIZE))
+
+            tile = canvas.resize((TILE_SIZE, TILE_SIZE), Image.LANCZOS)
+            count += save_tile(prefix, zoom, tx, ty, tile)
+
+    return count
+
+
+def plan_hash(field, bounds):
+    digest = hashlib.sha256(repr(bounds).encode())
+    with field.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def build_tiles(university):
+    """Cut the whole pyramid; returns the University.site_plan_tiles value."""
+    bounds = plan_bounds(university)
+    if bounds is None:
+        raise SitePlanError("the university has no bounds to place the plan")
+
+    version = plan_hash(university.site_plan, bounds)
+    prefix = f"site_plans/tiles/{university.pk}/{version}"
+
+    try:
+        image, max_zoom = open_plan(university.site_plan, bounds)
+    except (OSError, ValueError, UnidentifiedImageError, Image.DecompressionBombError) as exc:
+        raise SitePlanError(str(exc)) from exc
+
+    tiles = cut_top_zoom(image, bounds, max_zoom, prefix)
+    del image
+    for zoom in range(max_zoom - 1, settings.TILE_MIN_ZOOM - 1, -1):
+        tiles += build_lower_zoom(bounds, zoom, prefix)
+
+    return {
+        "source": university.site_plan.name,
+        "bounds": list(bounds),
+        "version": version,
+        "max_zoom": max_zoom,
+        "tiles": tiles,
+    }
+
+
+def build_tiles_in_child(university):
+    """build_tiles in a manage.py tile_site_plan process, same result"""
+    command = [sys.executable, str(settings.BASE_DIR / "manage.py"), "tile_site_plan", str(university.pk)]
+    try:
+        child = subprocess.run(command, capture_output=True, text=True, timeout=CUT_TIMEOUT)
+    except subprocess.TimeoutExpired as exc:
+        raise SitePlanError(f"not cut within {CUT_TIMEOUT}s") from exc
+
+    if child.returncode:
+        lines = child.stderr.strip().splitlines()
+        raise SitePlanError(
+            lines[-1].removeprefix("CommandError: ") if lines else f"tiling exited with status {child.returncode}"
+        )
+    return json.loads(child.stdout)
+
+
+def delete_tiles(university_id, version):
+    """Remove an old pyramid, best effort (not every storage can list)."""
+    def walk(path):
+        directories, files = default_storage.listdir(path)
+        for name in files:
+            default_storage.delete(f"{path}/{name}")
+        for name in directories:
+            walk(f"{path}/{name}")
+
+    try:
+        walk(f"site_plans/tiles/{university_id}/{version}")
+    except (OSError, NotImplementedError):
+        logger.info("Old site plan tiles of university %s left in storage", university_id)
+
+
+def is_stale(university):
+    tiles = university.site_plan_tiles or {}
+    source = university.site_plan.name or ""
+    if source != tiles.get("source", ""):
+        return True
+    bounds = plan_bounds(university)
+    return bool(source) and list(bounds or ()) != tiles.get("bounds", [])
+
+
+def process_university(university_id, in_child=False):
+    """
+    Re-tile the plan if it or its bounds changed; True when it did.
+    in_child: cut it in a child process (build_tiles_in_child).
+    """
+    university = University.objects.filter(pk=university_id).first()
+    if university is None or not is_stale(university):
+        return False
+
+    old = university.site_plan_tiles or {}
+    tiles = {}
+    if university.site_plan:
+        try:
+            tiles = build_tiles_in_child(university) if in_child else build_tiles(university)
+        except SitePlanError as exc:
+            logger.warning("Site plan of university %s not tiled: %s", university_id, exc)
+            # remembered, so the same upload isn't retried on every save
+            tiles = {"source": university.site_plan.name, "bounds": list(plan_bounds(university) or ()), "error": str(exc)}
+
+    # not over a newer upload that came in meanwhile
+    updated = University.objects.filter(
+        same_upload("site_plan", university.site_plan.name),
+        pk=university_id,
+    ).update(site_plan_tiles=tiles)
+
+    if updated:
+        bump_map_version(university_id)
+        if old.get("version") and old.get("version") != tiles.get("version"):
+            delete_tiles(university_id, old["version"])
+    return bool(updated)
+
+
+def _process_in_thread(university_id):
+    try:
+        process_university(university_id, in_child=True)
+    except Exception:
+        logger.exception("Site plan tiling failed for university %s", university_id)
+    finally:
+        connections.close_all()
+
+
+def schedule(university_id):
+    """after an upload: tile in a child process (inline under tests)"""
+    if settings.BUFFERED_WRITES_ASYNC:
+        threading.Thread(target=_process_in_thread, args=(university_id,), daemon=True).start()
+    else:
+        process_university(university_id)
+
+
+def plan_layer(university):
+    """Leaflet settings for the plan layer, {} without one"""
+    tiles = university.site_plan_tiles or {}
+    if not tiles.get("version"):
+        return {}
+
+    south, west, north, east = tiles["bounds"]
+    return {
+        "url": f"/api/plan-tiles/{university.short_name.lower()}/{tiles['version']}/{{z}}/{{x}}/{{y}}.png",
+        "bounds": [[south, west], [north, east]],
+        "max_native_zoom": tiles["max_zoom"],
+    }
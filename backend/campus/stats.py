@@ -0,0 +1,115 @@
+"""
+Admin dashboard statistics.
+
+The numbers on the admin index are read from a cached snapshot per
+university ("all" for superusers) instead of running aggregates on every
+page load. Snapshots are rebuilt when they expire, by the
+refresh_admin_stats command, and after analytics/counter flushes.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .analytics import popular_buildings
+from .models import DailyStats, University
+
+SERIES_DAYS = 30
+
+
+def snapshot_key(university_id=None):
+    return f"admin_stats:{university_id or 'all'}"
+
+
+def build_snapshot(university=None):
+    """Run the aggregates once and return a plain dict."""
+    today = timezone.now().date()
+    week_ago = today - timedelta(days=6)
+    month_ago = today - timedelta(days=SERIES_DAYS - 1)
+
+    stats = DailyStats.objects.all()
+    if university is not None:
+        stats = stats.filter(university=university)
+
+    totals = stats.aggregate(
+        total=Sum("visitors"),
+        today=Sum("visitors", filter=Q(date=today)),
+        routes_today=Sum("route_requests", filter=Q(date=today)),
+        last_7_days=Sum("visitors", filter=Q(date__gte=week_ago)),
+        last_30_days=Sum("visitors", filter=Q(date__gte=month_ago)),
+    )
+
+    per_day = dict(
+        stats.filter(date__gte=month_ago)
+        .values("date")
+        .annotate(visitors=Sum("visitors"))
+        .values_list("date", "visitors")
+    )
+
+    # every day of the window, zero when nobody came
+    series = [
+        {
+            "date": (month_ago + timedelta(days=i)).isoformat(),
+            "visitors": per_day.get(month_ago + timedelta(days=i), 0),
+        }
+        for i in range(SERIES_DAYS)
+    ]
+
+    top = popular_buildings(university, limit=5)
+
+    return {
+        "total_visitors": totals["total"] or 0,
+        "visitors_today": totals["today"] or 0,
+        "route_requests_today": totals["routes_today"] or 0,
+        "visitors_7_days": totals["last_7_days"] or 0,
+        "visitors_30_days": totals["last_30_days"] or 0,
+        "visitor_series": series,
+        "visitor_peak": max(day["visitors"] for day in series) or 1,
+        "top_buildings": [
+            {
+                "name": row.building.name,
+                "views": row.views,
+                "route_requests": row.route_requests,
+            }
+            for row in top
+        ],
+        "generated_at": timezone.now().isoformat(),
+    }
+
+
+def get_snapshot(university=None):
+    """Cached snapshot; only the first request after expiry pays for it."""
+    key = snapshot_key(university.id if university else None)
+    snapshot = cache.get(key)
+
+    if snapshot is None:
+        snapshot = refresh_snapshot(university)
+
+    return snapshot
+
+
+def refresh_snapshot(university=None):
+    snapshot = build_snapshot(university)
+    cache.set(
+        snapshot_key(university.id if university else None),
+        snapshot,
+        settings.ADMIN_STATS_TTL,
+    )
+    return snapshot
+
+
+def refresh_snapshots(university_ids=None):
+    """
+    Rebuild the snapshots of the given universities (all when None)
+    plus the superuser "all" snapshot.
+    """
+    universities = University.objects.all()
+    if university_ids is not None:
+        universities = universities.filter(id__in=university_ids)
+
+    for university in universities:
+        refresh_snapshot(university)
+
+    refresh_snapshot(None)
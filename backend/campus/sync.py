@@ -0,0 +1,69 @@
+"""
+Delta sync for the buildings API.
+
+A version is a point in time in epoch milliseconds. ?since=<version>
+returns the buildings saved after it (Building.updated_at) and the ids
+deleted after it (BuildingTombstone), plus the version to send next time.
+That version lies BUILDINGS_SYNC_OVERLAP seconds in the past, so a save
+whose transaction committed a little after its timestamp is still picked
+up; the overlap only means a few records may be sent twice, which clients
+apply idempotently.
+
+A full snapshot is returned instead when the client is older than the
+tombstone retention (its deletes may be gone) or when more than
+BUILDINGS_DELTA_MAX buildings changed (the delta would not be smaller).
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import BuildingTombstone
+
+
+def to_version(moment):
+    return int(moment.timestamp() * 1000)
+
+
+def from_version(version):
+    return datetime.fromtimestamp(version / 1000, tz=dt_timezone.utc)
+
+
+def prune_tombstones():
+    horizon = timezone.now() - timedelta(days=settings.BUILDINGS_TOMBSTONE_DAYS)
+    BuildingTombstone.objects.filter(deleted_at__lt=horizon).delete()
+
+
+def building_changes(buildings, university_id, since):
+    """
+    buildings: the queryset the API would list.
+    university_id: None for the list of every university.
+    Returns {"full": True, "version", "buildings": qs} or
+    {"full": False, "version", "changed": qs, "deleted": [ids]}.
+    """
+    now = timezone.now()
+    version = to_version(now) - settings.BUILDINGS_SYNC_OVERLAP * 1000
+    horizon = now - timedelta(days=settings.BUILDINGS_TOMBSTONE_DAYS)
+
+    if since <= 0 or from_version(since) < horizon:
+        return {"full": True, "version": version, "buildings": buildings}
+
+    moment = from_version(since)
+    changed = list(buildings.filter(updated_at__gt=moment)[:settings.BUILDINGS_DELTA_MAX + 1])
+
+    if len(changed) > settings.BUILDINGS_DELTA_MAX:
+        return {"full": True, "version": version, "buildings": buildings}
+
+    tombstones = BuildingTombstone.objects.filter(deleted_at__gt=moment)
+    if university_id is not None:
+        tombstones = tombstones.filter(university_id=university_id)
+
+    # moved away and back again: it's a change, not a delete
+    deleted = set(tombstones.values_list("building_id", flat=True)) - {b.id for b in changed}
+
+    return {
+        "full": False,
+        "version": version,
+        "changed": changed,
+        "deleted": sorted(deleted),
+    }
@@ -0,0 +1,1879 @@
+import gzip
+import io
+import json
+import math
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.http import Http404
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+import requests
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import bundle, footprints, geofence, graph, images, live, metrics, osm, pagecache, siteplan, stats, throttling, tiles
+from .analytics import event_buffer, popular_buildings
+from .apps import require_shared_cache
+from .buffers import BufferedWriter
+from .counters import count, counter_buffer
+from .models import (
+    AnalyticsEvent,
+    Building,
+    BuildingTombstone,
+    CampusAdminUser,
+    DailyStats,
+    University,
+    WalkEdge,
+    WalkNode,
+)
+from .stats import refresh_snapshots
+from .sync import to_version
+from .views import campus_map
+
+User = get_user_model()
+
+"""tests for the campus app, run them with 'python manage.py test campus'."""
+
+
+class CampusTestCase(TestCase):
+    """clears caches and in-memory buffers so tests don't leak into each other"""
+
+    def setUp(self):
+        cache.clear()
+        event_buffer.clear()
+        counter_buffer.clear()
+
+    def tearDown(self):
+        event_buffer.clear()
+        counter_buffer.clear()
+
+
+@override_settings(METRICS_DIR=tempfile.mkdtemp())
+class MetricsTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        # the registry lives for the whole process, start from zero
+        patcher = mock.patch.object(metrics, "registry", metrics.MetricsRegistry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+        )
+
+        Building.objects.create(
+            name="Library",
+            latitude=5.95,
+            longitude=10.15,
+            university=self.university,
+        )
+
+        self.admin = User.objects.create_superuser(
+            username="admin",
+            email="admin@example.com",
+            password="adminpassword123",
+        )
+
+    def test_requests_are_recorded_per_view_and_university(self):
+        """
+        Building list requests show up with their view and university labels.
+        """
+
+        self.client.get("/api/buildings/?university=uba")
+
+        self.client.force_login(self.admin)
+        response = self.client.get("/admin/metrics/")
+
+        self.assertEqual(response.status_code, 200)
+
+        body = response.content.decode()
+
+        self.assertIn(
+            'campus_http_requests_total{status="200",university="uba",view="building-list"} 1',
+            body,
+        )
+        self.assertIn("campus_db_queries_total", body)
+        self.assertIn('section="building_serialization"', body)
+
+    def test_files_of_dead_workers_are_pruned(self):
+        """
+        A worker that exited no longer counts, and its file is removed.
+        """
+
+        worker = subprocess.Popen([sys.executable, "-c", ""])
+        worker.wait()
+
+        path = os.path.join(settings.METRICS_DIR, f"metrics-{worker.pid}.json")
+        with open(path, "w") as fh:
+            json.dump({"counters": [["campus_throttled_requests_total", {}, 7]], "histograms": []}, fh)
+
+        body = metrics.render_prometheus()
+
+        self.assertNotIn("campus_throttled_requests_total", body)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(settings.METRICS_DIR, f"metrics-{os.getpid()}.json")))
+
+    def test_unknown_university_label_is_collapsed(self):
+        """
+        Random short names must not create new label values.
+        """
+
+        self.client.get("/api/buildings/?university=not-a-campus")
+
+        self.client.force_login(self.admin)
+        body = self.client.get("/admin/metrics/").content.decode()
+
+        self.assertNotIn("not-a-campus", body)
+
+    def test_metrics_require_superuser(self):
+        """
+        Anonymous users are sent to the admin login.
+        """
+
+        response = self.client.get("/admin/metrics/")
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.MetricsRegistry()
+
+        registry.observe("latency", 0.001, view="a")
+        registry.observe("latency", 0.2, view="a")
+
+        hist = registry.snapshot()["histograms"][0][2]
+
+        self.assertEqual(hist[0], 1)
+        self.assertEqual(sum(hist[:-1]), 2)
+
+
+class ListWriter(BufferedWriter):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.written = []
+        self.done = threading.Event()
+
+    def write(self, items):
+        self.written.extend(items)
+        self.done.set()
+
+
+class BufferedWriterTestCase(TestCase):
+
+    def test_write_is_abstract(self):
+        with self.assertRaises(TypeError):
+            BufferedWriter()
+
+    @override_settings(BUFFERED_WRITES_ASYNC=True)
+    def test_quiet_buffer_is_flushed(self):
+        """a lone item is written after flush_interval without another add()"""
+        buffer = ListWriter(flush_size=100, flush_interval=0.05)
+        buffer.add("a")
+
+        self.assertTrue(buffer.done.wait(5))
+        self.assertEqual(buffer.written, ["a"])
+        self.assertEqual(len(buffer), 0)
+
+    @override_settings(BUFFERED_WRITES_ASYNC=True)
+    def test_full_buffer_wakes_the_flusher(self):
+        buffer = ListWriter(flush_size=2, flush_interval=60)
+        buffer.add("a", "b")
+
+        self.assertTrue(buffer.done.wait(5))
+        self.assertEqual(buffer.written, ["a", "b"])
+
+
+@override_settings(BUFFERED_WRITES_ASYNC=False)
+class AnalyticsEventTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+        )
+
+        self.library = Building.objects.create(
+            name="Library",
+            latitude=5.95,
+            longitude=10.15,
+            university=self.university,
+        )
+
+    def post_events(self, events):
+        return self.client.post(
+            "/api/events/",
+            {"university": "uba", "events": events},
+            content_type="application/json",
+        )
+
+    def test_events_are_queued_not_written(self):
+        """
+        The API answers 202 and leaves the insert to the buffer.
+        """
+
+        response = self.post_events([
+            {"kind": "search", "query": "lib", "building": self.library.id},
+        ])
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(AnalyticsEvent.objects.count(), 0)
+
+        self.assertEqual(event_buffer.flush(), 1)
+        self.assertEqual(AnalyticsEvent.objects.count(), 1)
+
+    def test_flush_updates_popularity(self):
+        """
+        Popularity totals are derived from each flushed batch.
+        """
+
+        self.post_events([
+            {"kind": "popup", "building": self.library.id},
+            {"kind": "popup", "building": self.library.id},
+            {
+                "kind": "route",
+                "building": self.library.id,
+                "origin": [5.94, 10.14],
+                "destination": [5.95, 10.15],
+            },
+        ])
+        event_buffer.flush()
+
+        top = popular_buildings(self.university)
+
+        self.assertEqual(top[0].building, self.library)
+        self.assertEqual(top[0].views, 2)
+        self.assertEqual(top[0].route_requests, 1)
+
+    def test_invalid_event_is_rejected(self):
+        response = self.post_events([{"kind": "teleport"}])
+
+        self.assertEqual(response.status_code, 400)
+
+
+class AdminStatsTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+        )
+
+        DailyStats.objects.create(
+            university=self.university,
+            date=timezone.now().date(),
+            visitors=7,
+        )
+
+        self.admin = User.objects.create_superuser(
+            username="admin",
+            email="admin@example.com",
+            password="adminpassword123",
+        )
+
+    def test_index_is_served_from_snapshot(self):
+        """
+        Once the snapshot is cached the admin index runs no aggregates.
+        """
+
+        self.client.force_login(self.admin)
+        response = self.client.get("/admin/")
+
+        self.assertEqual(response.context["visitors_today"], 7)
+        self.assertEqual(response.context["visitors_30_days"], 7)
+
+        # new visitors only show up after the next refresh
+        DailyStats.objects.filter(university=self.university).update(visitors=9)
+        response = self.client.get("/admin/")
+        self.assertEqual(response.context["visitors_today"], 7)
+
+        refresh_snapshots()
+        response = self.client.get("/admin/")
+        self.assertEqual(response.context["visitors_today"], 9)
+
+    def test_series_covers_thirty_days(self):
+        snapshot = stats.build_snapshot(self.university)
+
+        self.assertEqual(len(snapshot["visitor_series"]), stats.SERIES_DAYS)
+        self.assertEqual(snapshot["visitor_series"][-1]["visitors"], 7)
+
+
+class ExportTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.uba = University.objects.create(
+            name="University of Bamenda", short_name="UBa", country="Cameroon"
+        )
+        self.ub = University.objects.create(
+            name="University of Buea", short_name="UB", country="Cameroon"
+        )
+
+        DailyStats.objects.create(university=self.uba, date=timezone.now().date(), visitors=3)
+        DailyStats.objects.create(university=self.ub, date=timezone.now().date(), visitors=5)
+
+        self.campus_admin = User.objects.create_user(
+            username="uba-admin",
+            password="adminpassword123",
+            is_staff=True,
+        )
+        self.campus_admin.user_permissions.add(
+            Permission.objects.get(codename="view_dailystats")
+        )
+        CampusAdminUser.objects.create(user=self.campus_admin, university=self.uba)
+
+    def test_export_is_streamed_and_scoped(self):
+        """
+        Campus admins only get the rows of their own university.
+        """
+
+        self.client.force_login(self.campus_admin)
+        response = self.client.get("/admin/campus/dailystats/export/?format=csv")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(lines[0], "university__short_name,date,visitors,route_requests")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("UBa,"))
+
+    def test_ndjson_export(self):
+        self.client.force_login(self.campus_admin)
+        response = self.client.get("/admin/campus/dailystats/export/?format=ndjson")
+
+        rows = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(json.loads(rows[0])["visitors"], 3)
+
+    def test_api_export_is_scoped(self):
+        token = RefreshToken.for_user(self.campus_admin).access_token
+
+        response = self.client.get(
+            "/api/exports/daily-stats/", {"format": "ndjson", "university": self.ub.pk},
+            HTTP_AUTHORIZATION=f"Bearer {token}",
+        )
+
+        self.assertTrue(response.streaming)
+        rows = [json.loads(row) for row in b"".join(response.streaming_content).decode().splitlines()]
+        # ?university= is for superusers, a campus admin always gets their own
+        self.assertEqual([row["university__short_name"] for row in rows], ["UBa"])
+
+        self.assertEqual(self.client.get("/api/exports/site-visits/").status_code, 401)
+
+
+@override_settings(BUFFERED_WRITES_ASYNC=False, LIVE_STATS_INTERVAL=3600)
+class LiveCountersTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+        )
+
+    def test_visitor_is_counted_once_per_day(self):
+        """
+        Visits are counted in memory and reach DailyStats on flush.
+        """
+
+        self.client.get("/uba/")
+        self.client.get("/uba/")
+
+        self.assertFalse(DailyStats.objects.filter(visitors__gt=0).exists())
+
+        counter_buffer.flush()
+
+        stats_row = DailyStats.objects.get(university=self.university)
+        self.assertEqual(stats_row.visitors, 1)
+
+    def test_live_deltas(self):
+        """
+        The dashboard polls the deltas since its cursor from the cache counters.
+        """
+
+        admin = User.objects.create_superuser("root", "root@example.com", "pw")
+        self.client.force_login(admin)
+        live._latest.clear()
+
+        count("visitors", self.university.id)
+        count("route_requests", self.university.id)
+        count("route_requests", self.university.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/live/")
+
+        data = response.json()
+        self.assertTrue(data["reset"])
+        self.assertEqual(data["deltas"], {"visitors": 1, "route_requests": 2})
+        self.assertIn("no-store", response["Cache-Control"])
+        self.assertFalse([q for q in queries if "campus_dailystats" in q["sql"]])
+
+        count("route_requests", self.university.id)
+        # read once per PRODUCER_INTERVAL, whoever asks
+        self.assertEqual(self.client.get("/admin/live/", {"cursor": data["cursor"]}).json()["deltas"],
+                         {"visitors": 0, "route_requests": 0})
+
+        live._latest.clear()
+        data = self.client.get("/admin/live/", {"cursor": data["cursor"]}).json()
+        self.assertFalse(data["reset"])
+        self.assertEqual(data["deltas"], {"visitors": 0, "route_requests": 1})
+
+        # yesterday's cursor starts over
+        self.assertTrue(live.deltas(cursor="2000-01-01:1:2")["reset"])
+
+
+@override_settings(TOKEN_BUCKETS={"route": {"client": (2, 1)}})
+class ThrottleTestCase(CampusTestCase):
+
+    def test_route_is_throttled_with_retry_after(self):
+        """
+        Once the burst is used up the route API answers 429 before
+        calling OpenRouteService.
+        """
+
+        cached_route = {"coordinates": [], "distance": 10, "duration": "10 sec"}
+        cache.set("route_5.9,10.1_5.95,10.15", cached_route, 600)
+
+        url = "/api/route/?start=5.9,10.1&end=5.95,10.15"
+
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "60")
+
+    def test_forwarded_for_does_not_give_a_new_bucket(self):
+        cache.set("route_5.9,10.1_5.95,10.15", {"coordinates": []}, 600)
+        url = "/api/route/?start=5.9,10.1&end=5.95,10.15"
+
+        statuses = [
+            self.client.get(url, HTTP_X_FORWARDED_FOR=f"10.0.0.{i}").status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    @override_settings(TOKEN_BUCKETS={"route": {"client": (5, 1), "university": (1, 1), "global": (1, 1)}})
+    def test_refused_requests_cost_no_other_token(self):
+        University.objects.create(name="University of Bamenda", short_name="UBa", country="Cameroon")
+        cache.set("route_5.9,10.1_5.95,10.15", {"coordinates": []}, 600)
+        url = "/api/route/?start=5.9,10.1&end=5.95,10.15"
+
+        self.assertEqual(self.client.get(url + "&university=uba").status_code, 200)
+        # the global bucket is charged without a university too
+        self.assertEqual(self.client.get(url).status_code, 429)
+        self.assertEqual(self.client.get(url + "&university=uba").status_code, 429)
+
+        # only the first request took a client token
+        tat = cache.get("throttle:route:ip:127.0.0.1")
+        self.assertLessEqual(tat - time.time() * 1000, 60000)
+
+    def test_busy_bucket_keeps_its_ttl_fresh(self):
+        throttling.consume("bucket", 5, 60)
+        with mock.patch.object(cache, "touch", wraps=cache.touch) as touch:
+            throttling.consume("bucket", 5, 60)
+
+        touch.assert_called_once_with("bucket", 7)
+
+    def test_bucket_refills(self):
+        self.assertEqual(throttling.consume("bucket", 1, 60), 0)
+        self.assertGreater(throttling.consume("bucket", 1, 60), 0)
+
+        # pretend a second went by
+        cache.decr("bucket", 1000)
+        self.assertEqual(throttling.consume("bucket", 1, 60), 0)
+
+
+class PageCacheTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.factory = RequestFactory()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+            min_lat=5.94,
+            max_lat=5.96,
+            min_lng=10.14,
+            max_lng=10.16,
+        )
+
+    def get(self, short_name="uba", **headers):
+        return campus_map(self.factory.get(f"/{short_name}/", headers=headers), short_name)
+
+    def test_warm_page_needs_no_query(self):
+        first = self.get()
+
+        with self.assertNumQueries(0):
+            second = self.get()
+
+        self.assertIn('desc="miss"', first["Server-Timing"])
+        self.assertIn('desc="hit"', second["Server-Timing"])
+        self.assertEqual(first.content, second.content)
+        self.assertContains(second, "University of Bamenda")
+
+    def test_gzip_variant_and_etag(self):
+        plain = self.get()
+        zipped = self.get(accept_encoding="gzip, deflate")
+
+        self.assertEqual(zipped["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(zipped.content), plain.content)
+        self.assertIn("Accept-Encoding", zipped["Vary"])
+
+        not_modified = self.get(if_none_match=plain["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_refused_gzip_is_not_sent(self):
+        for header in ("gzip;q=0", "gzip; q=0.0, deflate", "*;q=0", "identity"):
+            self.assertNotIn("Content-Encoding", self.get(accept_encoding=header), header)
+
+        for header in ("GZIP;q=0.5", "*", "br, gzip;q=1"):
+            self.assertEqual(self.get(accept_encoding=header)["Content-Encoding"], "gzip", header)
+
+    def test_several_workers_need_a_shared_cache(self):
+        with override_settings(WEB_CONCURRENCY=2):
+            with self.assertRaisesMessage(ImproperlyConfigured, "REDIS_URL"):
+                require_shared_cache()
+
+            with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache"}}):
+                require_shared_cache()
+
+        require_shared_cache()
+
+    def test_nothing_per_visitor_is_cached(self):
+        response = self.get()
+
+        self.assertNotIn("Set-Cookie", response)
+        self.assertNotIn(b"csrfmiddlewaretoken", response.content)
+
+    def test_university_and_building_changes_invalidate(self):
+        first = self.get()
+
+        self.university.name = "The University of Bamenda"
+        self.university.save()
+
+        renamed = self.get()
+        self.assertIn('desc="miss"', renamed["Server-Timing"])
+        self.assertContains(renamed, "The University of Bamenda")
+
+        self.get()
+        Building.objects.create(
+            name="Library",
+            latitude=5.95,
+            longitude=10.15,
+            university=self.university,
+        )
+        self.assertIn('desc="miss"', self.get()["Server-Timing"])
+        self.assertNotEqual(first["ETag"], renamed["ETag"])
+
+    def test_inactive_university_is_not_served(self):
+        self.get()
+
+        self.university.active = False
+        self.university.save()
+
+        with self.assertRaises(Http404):
+            self.get()
+
+    def test_page_is_rendered_without_a_request(self):
+        """the template must not depend on who is asking"""
+
+        etag, body, gzipped = pagecache.render_page(self.university)
+
+        self.assertIn(b"campusBoundary", body)
+        self.assertEqual(gzip.decompress(gzipped), body)
+
+    def test_campus_check_is_javascript(self):
+        """checkCampus runs on the first location fix, it must be in a script"""
+
+        body = self.get().content.decode()
+        scripts = "".join(re.findall(r"<script>(.*?)</script>", body, re.S))
+        styles = "".join(re.findall(r"<style>(.*?)</style>", body, re.S))
+
+        self.assertIn("function checkCampus(", scripts)
+        self.assertNotIn("checkCampus", styles)
+
+
+class OfflineBundleTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+            min_lat=5.94,
+            max_lat=5.96,
+            min_lng=10.14,
+            max_lng=10.16,
+        )
+
+        Building.objects.create(
+            name="Library",
+            latitude=5.95,
+            longitude=10.15,
+            university=self.university,
+        )
+
+    def test_manifest_points_at_an_immutable_bundle(self):
+        manifest = self.client.get("/api/bundle/uba/manifest.json")
+
+        self.assertEqual(manifest.status_code, 200)
+        self.assertEqual(manifest["Cache-Control"], "no-cache")
+
+        data = manifest.json()
+        response = self.client.get(data["url"], HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("immutable", response["Cache-Control"])
+
+        content = json.loads(gzip.decompress(response.content))
+        self.assertEqual(content["buildings"][0]["name"], "Library")
+        self.assertEqual(len(content["boundary"]), 4)
+        self.assertEqual(data["size"], len(response.content))
+
+        # polling again with the version as ETag is a 304
+        again = self.client.get(
+            "/api/bundle/uba/manifest.json",
+            HTTP_IF_NONE_MATCH=manifest["ETag"]
+        )
+        self.assertEqual(again.status_code, 304)
+
+    def test_version_changes_only_with_content(self):
+        first = bundle.get_manifest(self.university.id)
+
+        # saved but nothing changed: new data version, same content hash
+        with self.captureOnCommitCallbacks(execute=True):
+            self.university.save()
+        self.assertEqual(bundle.get_manifest(self.university.id)["version"], first["version"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Building.objects.create(
+                name="Amphi 750",
+                latitude=5.951,
+                longitude=10.151,
+                university=self.university,
+            )
+
+        second = bundle.get_manifest(self.university.id)
+        self.assertNotEqual(second["version"], first["version"])
+
+        # the old version can still be downloaded
+        old = self.client.get(f"/api/bundle/uba/{first['version']}.json")
+        self.assertEqual(len(json.loads(old.content)["buildings"]), 1)
+
+    def test_walkways_are_bundled(self):
+        a, b = (
+            WalkNode.objects.create(university=self.university, osm_id=osm_id, latitude=lat, longitude=10.15)
+            for osm_id, lat in [(1, 5.95), (2, 5.951)]
+        )
+        WalkEdge.objects.create(university=self.university, source=a, target=b, via_osm_id=2,
+                                highway="footway", length=111.2, geometry=[[10.15, 5.95], [10.15, 5.951]])
+
+        manifest = bundle.get_manifest(self.university.id)
+        content = json.loads(gzip.decompress(bundle.get_bundle(self.university.id, manifest["version"])))
+
+        self.assertEqual(content["walkways"]["nodes"], [[a.pk, 5.95, 10.15], [b.pk, 5.951, 10.15]])
+        self.assertEqual(
+            content["walkways"]["edges"],
+            [[a.pk, b.pk, 111.2, [[10.15, 5.95], [10.15, 5.951]]]],
+        )
+
+    def test_unknown_version_or_university(self):
+        self.assertEqual(self.client.get("/api/bundle/uba/deadbeef.json").status_code, 404)
+        self.assertEqual(self.client.get("/api/bundle/nope/manifest.json").status_code, 404)
+
+    def test_evicted_current_bundle_is_rebuilt(self):
+        manifest = bundle.get_manifest(self.university.id)
+        cache.delete(bundle.data_key(self.university.id, manifest["version"]))
+
+        response = self.client.get(f"/api/bundle/uba/{manifest['version']}.json")
+
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(BUFFERED_WRITES_ASYNC=True)
+    def test_burst_of_edits_is_rebuilt_once(self):
+        with mock.patch.object(bundle.threading, "Thread") as thread, \
+                mock.patch.object(bundle, "refresh_bundle") as refresh_bundle:
+            for _ in range(3):
+                bundle.schedule_refresh(self.university.id)
+
+            # one thread, which finds the university pending once
+            self.assertEqual(thread.call_count, 1)
+            bundle._run_pending()
+
+        refresh_bundle.assert_called_once_with(self.university.id)
+        self.assertEqual(bundle._pending, set())
+        self.assertFalse(bundle._running)
+
+
+@override_settings(BUILDINGS_DELTA_MAX=10)
+class BuildingSyncTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.url = "/api/buildings/"
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+        )
+
+        self.library = self.building("Library")
+        self.amphi = self.building("Amphi 750")
+
+        # both synced an hour ago
+        an_hour_ago = timezone.now() - timezone.timedelta(hours=1)
+        Building.objects.update(updated_at=an_hour_ago)
+        self.since = to_version(an_hour_ago + timezone.timedelta(minutes=1))
+
+    def building(self, name, university=None):
+        return Building.objects.create(
+            name=name,
+            latitude=5.95,
+            longitude=10.15,
+            university=university or self.university,
+        )
+
+    def sync(self, since):
+        return self.client.get(self.url, {"university": "uba", "since": since}).json()
+
+    def test_since_zero_is_a_full_snapshot(self):
+        data = self.sync(0)
+
+        self.assertTrue(data["full"])
+        self.assertEqual(len(data["buildings"]), 2)
+        self.assertLess(data["version"], to_version(timezone.now()))
+
+    def test_delta_has_only_changes_and_deletions(self):
+        self.library.description = "Open till 10pm"
+        self.library.save()
+        gym = self.building("Gym")
+        self.amphi_id = self.amphi.id
+        self.amphi.delete()
+
+        data = self.sync(self.since)
+
+        self.assertFalse(data["full"])
+        self.assertEqual(
+            sorted(b["id"] for b in data["changed"]),
+            [self.library.id, gym.id]
+        )
+        self.assertEqual(data["changed"][0]["description"], "Open till 10pm")
+        self.assertEqual(data["deleted"], [self.amphi_id])
+
+    def test_nothing_changed_is_tiny(self):
+        response = self.client.get(self.url, {"university": "uba", "since": self.since})
+
+        self.assertEqual(response.json()["changed"], [])
+        self.assertLess(len(response.content), 100)
+
+    def test_falls_back_to_full_snapshot(self):
+        # older than the tombstone retention
+        too_old = to_version(timezone.now() - timezone.timedelta(days=365))
+        self.assertTrue(self.sync(too_old)["full"])
+
+        # more changes than a delta is worth
+        with override_settings(BUILDINGS_DELTA_MAX=1):
+            self.building("Gym")
+            self.building("Chapel")
+            data = self.sync(self.since)
+
+        self.assertTrue(data["full"])
+        self.assertEqual(len(data["buildings"]), 4)
+
+    def test_moved_building_is_deleted_from_the_old_campus(self):
+        other = University.objects.create(name="University of Buea", short_name="UB", country="Cameroon")
+
+        self.library.university = other
+        self.library.save()
+
+        self.assertEqual(self.sync(self.since)["deleted"], [self.library.id])
+
+    def test_deleting_a_university_leaves_no_tombstones(self):
+        self.university.delete()
+
+        self.assertFalse(BuildingTombstone.objects.exists())
+
+    def test_unknown_university_is_not_found(self):
+        other = University.objects.create(name="University of Buea", short_name="UB", country="Cameroon")
+        self.building("Library", other).delete()
+
+        response = self.client.get(self.url, {"university": "nowhere", "since": self.since})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_since(self):
+        response = self.client.get(self.url, {"since": "yesterday"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_plain_list_is_unchanged(self):
+        response = self.client.get(self.url, {"university": "uba"})
+
+        self.assertEqual(len(response.json()), 2)
+
+
+def image_upload(name, size, fmt="JPEG", color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_THUMB_SIZE=32, IMAGE_MEDIUM_SIZE=100, IMAGE_ICON_SIZE=16)
+class ImageDerivativesTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+        )
+
+    def building(self, name, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            building = Building.objects.create(
+                name=name,
+                latitude=5.95,
+                longitude=10.15,
+                university=self.university,
+                **fields
+            )
+        building.refresh_from_db()
+        return building
+
+    def test_photo_variants_replace_the_original(self):
+        building = self.building("Library", photo=image_upload("library.jpg", (400, 300)))
+
+        thumb = building.images["photo"]["thumb"]
+        self.assertEqual((thumb["width"], thumb["height"]), (32, 24))
+        self.assertEqual(building.images["photo"]["medium"]["width"], 100)
+        self.assertTrue(default_storage.exists(thumb["webp"]))
+
+        data = self.client.get("/api/buildings/", {"university": "uba"}).json()[0]
+
+        self.assertIn("/media/derivatives/", data["photo"])
+        self.assertTrue(data["photo"].endswith(".jpg"))
+        self.assertTrue(data["images"]["photo"]["thumb"]["webp"].endswith(".webp"))
+
+    def test_names_are_content_hashes(self):
+        first = self.building("Library", photo=image_upload("a.jpg", (400, 300)))
+        second = self.building("Amphi", photo=image_upload("b.jpg", (400, 300)))
+
+        # same pixels, stored once
+        self.assertEqual(
+            first.images["photo"]["thumb"]["jpeg"],
+            second.images["photo"]["thumb"]["jpeg"]
+        )
+
+    def test_unchanged_upload_is_not_reprocessed(self):
+        building = self.building("Library", photo=image_upload("library.jpg", (400, 300)))
+
+        self.assertEqual(images.stale_fields(building), [])
+
+        with mock.patch.object(images, "schedule") as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                building.description = "Open till 10pm"
+                building.save()
+
+        schedule.assert_not_called()
+
+    def test_broken_upload_falls_back_to_the_original(self):
+        building = self.building("Library", photo=SimpleUploadedFile("broken.jpg", b"not an image"))
+
+        self.assertEqual(building.images["photo"], {"source": building.photo.name})
+
+        data = self.client.get("/api/buildings/", {"university": "uba"}).json()[0]
+        self.assertIn("broken", data["photo"])
+
+    def test_category_icons_share_one_sprite(self):
+        self.building("Library", category="library", icon=image_upload("l.png", (40, 20), "PNG"))
+        self.building("Lab", category="lab", icon=image_upload("b.png", (20, 20), "PNG", (0, 0, 200)))
+        self.building("Amphi 750", category="lab", icon=image_upload("c.png", (20, 20), "PNG"))
+
+        self.university.refresh_from_db()
+        sprite = self.university.icon_sprite
+
+        self.assertEqual(sorted(sprite["icons"]), ["lab", "library"])
+        self.assertEqual((sprite["width"], sprite["height"]), (32, 16))
+
+        with default_storage.open(sprite["png"]) as fh:
+            sheet = Image.open(fh).convert("RGB")
+            # "lab" is the first cell, from the first lab building
+            self.assertEqual(sheet.getpixel((8, 8)), (0, 0, 200))
+
+        page = self.client.get("/uba/").content.decode()
+        self.assertIn(default_storage.url(sprite["webp"]), page)
+
+    @override_settings(BUFFERED_WRITES_ASYNC=True)
+    def test_burst_of_saves_is_derived_once(self):
+        with mock.patch.object(images.threading, "Thread") as thread, \
+                mock.patch.object(images, "run_jobs") as run_jobs:
+            images.schedule(1, [self.university.pk])
+            images.schedule(1, [self.university.pk, None])
+            images.schedule(None, [self.university.pk])
+
+            # one thread, which finds the queue merged
+            self.assertEqual(thread.call_count, 1)
+            images._run_queued()
+
+        run_jobs.assert_called_once_with({1: {self.university.pk}, None: {self.university.pk}})
+        self.assertEqual(images._queued, {})
+        self.assertFalse(images._running)
+
+    def test_new_icon_rebuilds_the_bundle(self):
+        first = bundle.get_manifest(self.university.id)["version"]
+        self.building("Library", category="library", icon=image_upload("l.png", (40, 20), "PNG"))
+
+        # built by the job, not by the next poll
+        manifest = cache.get(bundle.manifest_key(self.university.id))
+        content = json.loads(gzip.decompress(bundle.get_bundle(self.university.id, manifest["version"])))
+
+        self.assertNotEqual(manifest["version"], first)
+        self.assertIn("/media/derivatives/", content["buildings"][0]["icon"])
+
+    def test_backfill_command(self):
+        building = self.building("Library")
+        name = default_storage.save("buildings/photos/old.jpg", image_upload("old.jpg", (400, 300)))
+        Building.objects.filter(pk=building.pk).update(photo=name)
+
+        call_command("build_image_derivatives", stdout=io.StringIO())
+
+        building.refresh_from_db()
+        self.assertEqual(building.images["photo"]["source"], name)
+        self.assertEqual(building.images["photo"]["medium"]["height"], 75)
+
+
+TILE_CACHE_DIR = tempfile.mkdtemp()
+PNG_TILE = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+
+
+@override_settings(TILE_CACHE_DIR=TILE_CACHE_DIR, TILE_OFFLINE=False, TILE_BBOX_PADDING=0)
+class TileProxyTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+            min_lat=5.94,
+            max_lat=5.96,
+            min_lng=10.14,
+            max_lng=10.16,
+        )
+
+        bounds = tiles.padded_bounds(self.university)
+        self.z = 17
+        self.x, self.y = tiles.lat_lng_to_tile(5.95, 10.15, self.z)
+        self.url = f"/api/tiles/uba/dark/{self.z}/{self.x}/{self.y}"
+        self.campus = list(tiles.campus_tiles(bounds, 16, 17))
+
+        patcher = mock.patch.object(tiles, "fetch", return_value=PNG_TILE)
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        super().tearDown()
+        # a fresh file per test
+        for name in os.listdir(TILE_CACHE_DIR):
+            os.remove(os.path.join(TILE_CACHE_DIR, name))
+        tiles._stores.clear()
+
+    def test_miss_then_hit(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+
+        # the miss sends the browser upstream while the cache fetches it
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(first["Location"], tiles.upstream_url("dark", self.z, self.x, self.y))
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, PNG_TILE)
+        self.assertEqual(second["Content-Type"], "image/png")
+        self.assertIn("max-age", second["Cache-Control"])
+        self.fetch.assert_called_once_with("dark", self.z, self.x, self.y)
+
+    def test_only_campus_tiles_are_proxied(self):
+        outside = self.client.get(f"/api/tiles/uba/dark/{self.z}/{self.x + 50}/{self.y}")
+        wrong_zoom = self.client.get(f"/api/tiles/uba/dark/10/{self.x >> 7}/{self.y >> 7}")
+        wrong_layer = self.client.get(f"/api/tiles/uba/osm/{self.z}/{self.x}/{self.y}")
+        unknown = self.client.get(f"/api/tiles/nope/dark/{self.z}/{self.x}/{self.y}")
+
+        for response in (outside, wrong_zoom, wrong_layer, unknown):
+            self.assertEqual(response.status_code, 404)
+        self.fetch.assert_not_called()
+
+    def test_upstream_down(self):
+        self.fetch.side_effect = requests.ConnectionError
+
+        with self.assertLogs("campus.tiles", "WARNING"):
+            self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.assertIsNone(tiles.store_for("uba", "dark").get(self.z, self.x, self.y))
+
+    def test_stale_tile_is_served_when_upstream_is_down(self):
+        self.client.get(self.url)
+        store = tiles.store_for("uba", "dark")
+        store.db.execute("UPDATE tile_usage SET fetched_at = 0")
+
+        self.fetch.side_effect = requests.ConnectionError
+        with self.assertLogs("campus.tiles", "WARNING"):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_unreadable_cache_is_a_miss(self):
+        locked = sqlite3.OperationalError("database is locked")
+
+        with mock.patch.object(tiles.TileStore, "get", side_effect=locked), \
+                self.assertLogs("campus.tiles", "WARNING"):
+            self.assertEqual(self.client.get(self.url).status_code, 302)
+
+            with override_settings(TILE_OFFLINE=True):
+                self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_least_recently_used_tiles_are_evicted(self):
+        store = tiles.store_for("uba", "dark")
+        for i, (z, x, y) in enumerate(self.campus[:4]):
+            store.put(z, x, y, PNG_TILE, pinned=(i == 0))
+            store.db.execute(
+                "UPDATE tile_usage SET accessed_at = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (i, z, x, tiles.tms_row(z, y)),
+            )
+
+        # 4 tiles, room for 3: evicts down to 90% of that, i.e. 2 tiles
+        self.assertEqual(store.evict(3 * len(PNG_TILE)), 2)
+
+        left = [tile for tile in self.campus[:4] if store.get(*tile)]
+        # the pinned one stays even though it's the oldest
+        self.assertEqual(left, [self.campus[0], self.campus[3]])
+
+    def test_seed_then_serve_offline(self):
+        with mock.patch("campus.management.commands.seed_tiles.fetch", return_value=PNG_TILE) as fetch:
+            call_command(
+                "seed_tiles", "uba", "--layer", "dark",
+                "--min-zoom", "16", "--max-zoom", "17", "--delay", "0",
+                stdout=io.StringIO(),
+            )
+        self.assertEqual(fetch.call_count, len(self.campus))
+
+        tiles._stores.clear()
+        files = sorted(os.listdir(TILE_CACHE_DIR))
+
+        with override_settings(TILE_OFFLINE=True):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            # not seeded
+            missing = self.client.get(f"/api/tiles/uba/dark/18/{self.x * 2}/{self.y * 2}")
+            self.assertEqual(missing.status_code, 404)
+
+        # opened read-only: no WAL / shm files next to the seeded one
+        self.assertEqual(sorted(os.listdir(TILE_CACHE_DIR)), files)
+        self.fetch.assert_not_called()
+
+    @override_settings(TILE_OFFLINE=True)
+    def test_offline_without_a_file(self):
+        with self.assertLogs("campus.tiles", "WARNING"):
+            self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        # read-only stores never create their file
+        self.assertEqual(os.listdir(TILE_CACHE_DIR), [])
+
+    def test_page_uses_the_proxy(self):
+        page = self.client.get("/uba/").content.decode()
+
+        self.assertIn("/api/tiles/uba/dark/{z}/{x}/{y}", page)
+        # never proxied, the imagery may not be cached
+        self.assertNotIn("/api/tiles/uba/satellite/", page)
+        self.assertIn("mt1.google.com", page)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), TILE_MIN_ZOOM=16, TILE_MAX_ZOOM=18)
+class SitePlanTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+            min_lat=5.950,
+            max_lat=5.952,
+            min_lng=10.150,
+            max_lng=10.152,
+        )
+
+    def upload_plan(self, size=(300, 300), **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.university.site_plan = image_upload("plan.png", size, "PNG", (10, 120, 10))
+            for name, value in fields.items():
+                setattr(self.university, name, value)
+            self.university.save()
+        self.university.refresh_from_db()
+        return self.university.site_plan_tiles
+
+    def tiles_of(self, version, zoom):
+        path = f"site_plans/tiles/{self.university.id}/{version}/{zoom}"
+        return [
+            (int(x), int(name[:-4]))
+            for x in default_storage.listdir(path)[0]
+            for name in default_storage.listdir(f"{path}/{x}")[1]
+        ]
+
+    def test_plan_is_cut_into_a_pyramid(self):
+        result = self.upload_plan()
+
+        # 0.002 degrees is ~373px at zoom 18, the first zoom the 300px plan fits
+        self.assertEqual(result["max_zoom"], 18)
+        for zoom in (16, 17, 18):
+            self.assertTrue(self.tiles_of(result["version"], zoom))
+
+        x, y = self.tiles_of(result["version"], 17)[0]
+        response = self.client.get(f"/api/plan-tiles/uba/{result['version']}/17/{x}/{y}.png")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        with Image.open(io.BytesIO(b"".join(response.streaming_content))) as tile:
+            self.assertEqual(tile.size, (256, 256))
+
+        page = self.client.get("/uba/").content.decode()
+        self.assertIn(result["version"], page)
+
+    def test_outside_the_plan_is_404(self):
+        result = self.upload_plan()
+
+        response = self.client.get(f"/api/plan-tiles/uba/{result['version']}/17/1/1.png")
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_new_bounds_replace_the_tiles(self):
+        first = self.upload_plan()["version"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.university.plan_max_lat = 5.953
+            self.university.save()
+        self.university.refresh_from_db()
+
+        second = self.university.site_plan_tiles["version"]
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.tiles_of(first, 18), [])
+
+    def test_rgb_plans_are_not_copied(self):
+        self.university.site_plan = image_upload("plan.png", (300, 300), "PNG", (10, 120, 10))
+        bounds = siteplan.plan_bounds(self.university)
+
+        with mock.patch.object(Image.Image, "convert") as convert:
+            image, _ = siteplan.open_plan(self.university.site_plan, bounds)
+
+        self.assertEqual(image.mode, "RGB")
+        convert.assert_not_called()
+
+    def test_unusable_plans_are_reported_not_retried(self):
+        with override_settings(SITE_PLAN_MAX_PIXELS=1000):
+            result = self.upload_plan()
+
+        self.assertIn("SITE_PLAN_MAX_PIXELS", result["error"])
+        self.assertFalse(siteplan.is_stale(self.university))
+        self.assertEqual(siteplan.plan_layer(self.university), {})
+
+    def test_command_prints_the_tiles(self):
+        result = self.upload_plan()
+        out = io.StringIO()
+
+        call_command("tile_site_plan", str(self.university.id), stdout=out)
+
+        self.assertEqual(json.loads(out.getvalue()), result)
+
+    def test_plan_is_cut_in_a_child_process(self):
+        # saved outside captureOnCommitCallbacks: not tiled yet
+        self.university.site_plan = image_upload("plan.png", (300, 300), "PNG", (10, 120, 10))
+        self.university.save()
+        printed = {"source": self.university.site_plan.name, "bounds": [5.95, 10.15, 5.952, 10.152]}
+
+        with mock.patch.object(siteplan.subprocess, "run") as run:
+            run.return_value = subprocess.CompletedProcess([], 0, json.dumps(printed), "")
+            self.assertTrue(siteplan.process_university(self.university.id, in_child=True))
+
+            command = run.call_args.args[0]
+            self.assertEqual(command[-2:], ["tile_site_plan", str(self.university.id)])
+            self.university.refresh_from_db()
+            self.assertEqual(self.university.site_plan_tiles, printed)
+
+            # a failed child is reported like a failed cut
+            run.return_value = subprocess.CompletedProcess([], 1, "", "CommandError: not an image\n")
+            University.objects.filter(pk=self.university.id).update(site_plan_tiles={})
+            siteplan.process_university(self.university.id, in_child=True)
+
+        self.university.refresh_from_db()
+        self.assertEqual(self.university.site_plan_tiles["error"], "not an image")
+
+
+@override_settings(TILE_MIN_ZOOM=16, TILE_MAX_ZOOM=20, CLUSTER_RADIUS=60)
+class ClusterTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+        )
+
+        # three buildings ~10 m apart, one ~500 m away
+        for i, (lat, lng) in enumerate([
+            (5.95000, 10.15000),
+            (5.95009, 10.15000),
+            (5.95000, 10.15009),
+            (5.95450, 10.15000),
+        ]):
+            Building.objects.create(name=f"B{i}", latitude=lat, longitude=lng, university=self.university)
+
+        self.bbox = "10.14,5.94,10.16,5.96"
+
+    def get(self, zoom, bbox=None):
+        return self.client.get("/api/clusters/", {
+            "university": "uba",
+            "zoom": zoom,
+            "bbox": bbox or self.bbox,
+        })
+
+    def test_close_buildings_cluster_at_low_zoom(self):
+        features = self.get(16).json()["features"]
+
+        groups = sorted(f["count"] for f in features)
+        self.assertEqual(groups, [1, 3])
+
+        # ~10 m is still within the radius at 19, they split at 20
+        group = next(f for f in features if f["count"] == 3)
+        self.assertEqual(group["expansion_zoom"], 20)
+        self.assertAlmostEqual(group["lat"], 5.95003, places=5)
+
+    def test_highest_zoom_has_every_building(self):
+        features = self.get(20).json()["features"]
+
+        self.assertEqual(len(features), 4)
+        self.assertTrue(all("id" in f for f in features))
+
+    def test_only_the_bbox_is_returned(self):
+        features = self.get(20, "10.149,5.949,10.151,5.951").json()["features"]
+
+        self.assertEqual(len(features), 3)
+
+    def test_zoom_is_clamped_and_input_checked(self):
+        self.assertEqual(self.get(3).json()["zoom"], 16)
+        self.assertEqual(self.get("x").status_code, 400)
+        self.assertEqual(self.get("inf").status_code, 400)
+        self.assertEqual(self.get("nan").status_code, 400)
+        self.assertEqual(self.get(17, "1,2,3").status_code, 400)
+        self.assertEqual(self.get(17, "nan,nan,nan,nan").status_code, 400)
+        self.assertEqual(self.get(17, "-inf,-inf,inf,inf").status_code, 400)
+        self.assertEqual(self.get(17, "10.16,5.94,10.14,5.96").status_code, 400)
+
+    def building_queries(self, zoom):
+        with CaptureQueriesContext(connection) as queries:
+            features = self.get(zoom).json()["features"]
+        return features, [q for q in queries if "campus_building" in q["sql"]]
+
+    def test_building_changes_invalidate_the_index(self):
+        self.get(20)
+
+        Building.objects.create(name="New", latitude=5.951, longitude=10.151, university=self.university)
+
+        features, queries = self.building_queries(20)
+        self.assertEqual(len(features), 5)
+        self.assertEqual(len(queries), 1)
+
+        # same version again: served from the worker's copy
+        self.assertEqual(self.building_queries(18)[1], [])
+
+
+class GeofenceTestCase(CampusTestCase):
+
+    # an L: the north east quarter of the square is not campus
+    L_SHAPE = {
+        "type": "Polygon",
+        "coordinates": [[
+            [10.0, 5.0], [10.2, 5.0], [10.2, 5.1], [10.1, 5.1], [10.1, 5.2], [10.0, 5.2], [10.0, 5.0],
+        ]],
+    }
+
+    def setUp(self):
+        super().setUp()
+
+        self.uba = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+            boundary=self.L_SHAPE,
+        )
+        # no polygon: its rectangle is used
+        self.ub = University.objects.create(
+            name="University of Buea",
+            short_name="UB",
+            country="Cameroon",
+            min_lat=4.0, max_lat=4.1, min_lng=9.0, max_lng=9.1,
+        )
+
+    def locate(self, lat, lng, **params):
+        return self.client.get("/api/campus/locate/", {"lat": lat, "lng": lng, **params})
+
+    def test_polygon_contains(self):
+        prepared = geofence.prepare(self.uba)
+
+        self.assertTrue(prepared.contains(5.05, 10.15))
+        self.assertTrue(prepared.contains(5.15, 10.05))
+        # inside the bounding box, outside the L
+        self.assertFalse(prepared.contains(5.15, 10.15))
+        self.assertFalse(prepared.contains(5.25, 10.05))
+
+    def test_holes_and_multipolygons(self):
+        square = [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]
+        hole = [[1, 1], [3, 1], [3, 3], [1, 3], [1, 1]]
+        prepared = geofence.PreparedPolygon(geofence.polygons({
+            "type": "MultiPolygon",
+            "coordinates": [[square, hole], [[[10, 10], [11, 10], [11, 11], [10, 10]]]],
+        }))
+
+        self.assertTrue(prepared.contains(0.5, 0.5))
+        self.assertFalse(prepared.contains(2, 2))
+        self.assertTrue(prepared.contains(10.2, 10.5))
+        self.assertFalse(prepared.contains(5, 5))
+
+    def test_only_the_edges_of_a_band_are_tested(self):
+        ring = [
+            [math.cos(i * 2 * math.pi / 4000), math.sin(i * 2 * math.pi / 4000)]
+            for i in range(4000)
+        ]
+        prepared = geofence.PreparedPolygon(geofence.polygons({"type": "Polygon", "coordinates": [ring]}))
+
+        # the flat top and bottom of the circle make the fullest bands
+        self.assertLess(max(len(band) for band in prepared.bands), 4000 // 20)
+        self.assertTrue(prepared.contains(0, 0))
+        self.assertFalse(prepared.contains(0.99, 0.99))
+
+    def test_locate_endpoint(self):
+        data = self.locate(5.05, 10.15).json()
+        self.assertTrue(data["inside"])
+        self.assertEqual(data["university"]["short_name"], "UBa")
+        self.assertEqual(data["university"]["url"], "/uba/")
+
+        data = self.locate(4.05, 9.05).json()
+        self.assertEqual(data["university"]["short_name"], "UB")
+
+        data = self.locate(5.15, 10.15).json()
+        self.assertEqual(data, {"inside": False, "university": None})
+
+    def test_inside_one_university(self):
+        self.assertTrue(self.locate(5.05, 10.15, university="uba").json()["inside"])
+
+        data = self.locate(4.05, 9.05, university="uba").json()
+        self.assertFalse(data["inside"])
+        self.assertEqual(data["university"]["short_name"], "UB")
+
+    def test_bad_input(self):
+        self.assertEqual(self.client.get("/api/campus/locate/", {"lat": "x"}).status_code, 400)
+        self.assertEqual(self.locate(5.05, 10.15, university="nope").status_code, 404)
+
+    def test_saving_a_boundary_is_picked_up(self):
+        self.assertFalse(self.locate(5.15, 10.15).json()["inside"])
+
+        self.uba.boundary = {
+            "type": "Polygon",
+            "coordinates": [[[10.0, 5.0], [10.2, 5.0], [10.2, 5.2], [10.0, 5.2], [10.0, 5.0]]],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            self.uba.save()
+
+        self.assertTrue(self.locate(5.15, 10.15).json()["inside"])
+
+        self.uba.active = False
+        self.uba.save()
+        self.assertIsNone(self.locate(5.05, 10.15).json()["university"])
+
+    def test_boundary_is_validated(self):
+        self.uba.full_clean()
+
+        for boundary in (
+            {"type": "Point", "coordinates": [10, 5]},
+            {"type": "Polygon", "coordinates": [[[10, 5], [10.1, 5]]]},
+            {"type": "Polygon", "coordinates": [[[5, 200], [5.1, 200], [5, 201]]]},
+            {"type": "Polygon", "coordinates": "nope"},
+        ):
+            self.uba.boundary = boundary
+            with self.assertRaises(ValidationError) as ctx:
+                self.uba.full_clean()
+            self.assertIn("boundary", ctx.exception.message_dict)
+
+    def test_page_outline_follows_the_polygon(self):
+        self.assertEqual(len(pagecache.campus_boundary(self.uba)), 6)
+        self.assertEqual(pagecache.campus_boundary(self.ub), [[4.0, 9.0], [4.0, 9.1], [4.1, 9.1], [4.1, 9.0]])
+
+
+class FootprintTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+        )
+
+        # a round building, ~40 m across, surveyed with 200 vertices
+        ring = [
+            [10.15 + 0.0002 * math.cos(i * math.pi / 100), 5.95 + 0.0002 * math.sin(i * math.pi / 100)]
+            for i in range(200)
+        ]
+        self.building = Building.objects.create(
+            name="Library",
+            latitude=5.95,
+            longitude=10.15,
+            university=self.university,
+            footprint={"type": "Polygon", "coordinates": [ring + ring[:1]]},
+            entrances=[[10.1502, 5.95], [10.1498, 5.95]],
+        )
+
+    def vertices(self, geometry):
+        return len(geometry["coordinates"][0])
+
+    def test_levels_get_simpler_at_lower_zoom(self):
+        levels = self.building.footprint_levels
+
+        self.assertIn("16", levels)
+        low, high = footprints.footprint_at(levels, 16), footprints.footprint_at(levels, 20)
+        self.assertLess(self.vertices(low), self.vertices(high))
+        self.assertLessEqual(self.vertices(high), 201)
+        # closed rings
+        self.assertEqual(low["coordinates"][0][0], low["coordinates"][0][-1])
+
+    def test_only_changing_levels_are_stored(self):
+        square = [[10.0, 5.0], [10.001, 5.0], [10.001, 5.001], [10.0, 5.001], [10.0, 5.0]]
+        levels = footprints.footprint_levels({"type": "Polygon", "coordinates": [square]})
+
+        self.assertEqual(list(levels), ["16"])
+        self.assertEqual(footprints.footprint_at(levels, 19), levels["16"])
+        self.assertIsNone(footprints.footprint_at(levels, 3))
+
+    def test_buildings_api_sends_the_zoom_variant(self):
+        url = "/api/buildings/?university=uba"
+
+        full = self.client.get(url).json()[0]
+        self.assertEqual(self.vertices(full["footprint"]), 201)
+        self.assertNotIn("footprint_levels", full)
+
+        low = self.client.get(url + "&zoom=16").json()[0]
+        self.assertLess(self.vertices(low["footprint"]), 201)
+        self.assertEqual(self.client.get(url + "&zoom=x").status_code, 400)
+        self.assertEqual(self.client.get(url + "&zoom=inf").status_code, 400)
+        self.assertEqual(self.client.get(url + "&zoom=nan").status_code, 400)
+        # past the map's zoom range: the closest zoom it has
+        self.assertEqual(self.client.get(url + "&zoom=1e9").json(), self.client.get(url + "&zoom=20").json())
+
+    def test_clusters_carry_the_footprint(self):
+        features = self.client.get("/api/clusters/", {
+            "university": "uba", "zoom": 16, "bbox": "10.14,5.94,10.16,5.96",
+        }).json()["features"]
+
+        self.assertEqual(features[0]["footprint"], footprints.footprint_at(self.building.footprint_levels, 16))
+
+    def test_route_ends_at_the_nearest_entrance(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"routes": [{
+            "geometry": "_p~iF~ps|U_ulLnnqC_mqNvxq`@",
+            "summary": {"distance": 120, "duration": 90},
+        }]}
+
+        with mock.patch.object(requests, "post", return_value=response) as post:
+            data = self.client.get("/api/route/", {
+                "start": "5.95,10.16",
+                "end": "5.95,10.15",
+                "building": self.building.pk,
+            }).json()
+
+        self.assertEqual(post.call_args.kwargs["json"]["coordinates"][1], [10.1502, 5.95])
+        self.assertEqual(data["entrance"], [5.95, 10.1502])
+
+    def test_footprint_and_entrances_are_validated(self):
+        self.building.full_clean()
+
+        self.building.footprint = {"type": "LineString", "coordinates": [[10, 5], [11, 5]]}
+        self.building.entrances = [[10.15]]
+        with self.assertRaises(ValidationError) as ctx:
+            self.building.full_clean()
+        self.assertEqual(set(ctx.exception.message_dict), {"footprint", "entrances"})
+
+
+@override_settings(GRAPH_DIR=tempfile.mkdtemp())
+class OsmImportTestCase(CampusTestCase):
+
+    NODES = {
+        1: (5.001, 10.001), 2: (5.002, 10.001), 3: (5.003, 10.001),
+        4: (5.003, 10.002), 5: (5.003, 10.003), 6: (5.004, 10.001),
+        7: (6.0, 10.003), 8: (5.005, 10.005), 9: (5.006, 10.005),
+    }
+    WAYS = {
+        # a footway with a junction at 3, 2 and 4 are contracted
+        100: ([1, 2, 3, 4, 5], {"highway": "footway"}),
+        101: ([3, 6], {"highway": "steps"}),
+        # leaves the campus after 5
+        102: ([5, 7], {"highway": "footway"}),
+        103: ([1, 6], {"highway": "motorway"}),
+        104: ([8, 9], {"highway": "footway", "foot": "no"}),
+    }
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+            min_lat=5.0, max_lat=5.01, min_lng=10.0, max_lng=10.01,
+        )
+        self.directory = tempfile.mkdtemp()
+
+    def extract(self, nodes=None, ways=None, name="campus.osm"):
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">']
+        for osm_id, (lat, lng) in (nodes or self.NODES).items():
+            lines.append(f'<node id="{osm_id}" lat="{lat}" lon="{lng}"><tag k="x" v="y"/></node>')
+        for osm_id, (refs, tags) in (ways or self.WAYS).items():
+            lines.append(f'<way id="{osm_id}">')
+            lines += [f'<nd ref="{ref}"/>' for ref in refs]
+            lines += [f'<tag k="{k}" v="{v}"/>' for k, v in tags.items()]
+            lines.append("</way>")
+        lines.append("</osm>")
+
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wt") as fh:
+            fh.write("\n".join(lines))
+        return path
+
+    def edges(self):
+        return {
+            (edge.source.osm_id, edge.target.osm_id, edge.via_osm_id): edge
+            for edge in WalkEdge.objects.select_related("source", "target")
+        }
+
+    def test_import_contracts_and_clips(self):
+        stats = osm.import_extract(self.university, self.extract())
+
+        self.assertEqual(
+            set(WalkNode.objects.values_list("osm_id", flat=True)),
+            {1, 3, 5, 6},
+        )
+        edges = self.edges()
+        self.assertEqual(set(edges), {(1, 3, 2), (3, 5, 4), (3, 6, 6)})
+        self.assertEqual(edges[(3, 6, 6)].highway, "steps")
+        self.assertEqual(len(edges[(1, 3, 2)].geometry), 3)
+        self.assertAlmostEqual(edges[(1, 3, 2)].length, 222.6, places=0)
+        # 102 has a single node on campus
+        self.assertEqual(stats["ways_kept"], 2)
+
+    def test_reimport_is_a_diff(self):
+        osm.import_extract(self.university, self.extract())
+        before = {edge.pk for edge in self.edges().values()}
+
+        stats = osm.import_extract(self.university, self.extract())
+        self.assertEqual(
+            [stats[k] for k in ("nodes_created", "nodes_updated", "nodes_deleted",
+                                "edges_created", "edges_updated", "edges_deleted")],
+            [0] * 6,
+        )
+        self.assertEqual({edge.pk for edge in self.edges().values()}, before)
+
+        # 4 moved, the steps were removed: 3 is now in the middle of a path
+        nodes = {**self.NODES, 4: (5.0035, 10.002)}
+        ways = {k: v for k, v in self.WAYS.items() if k != 101}
+        stats = osm.import_extract(self.university, self.extract(nodes, ways))
+
+        self.assertEqual(set(self.edges()), {(1, 5, 2)})
+        self.assertEqual((stats["nodes_deleted"], stats["edges_deleted"], stats["edges_created"]), (2, 3, 1))
+
+    def test_loop_on_one_junction_is_kept(self):
+        nodes = {**self.NODES, 10: (5.004, 10.003), 11: (5.004, 10.004), 12: (5.003, 10.004)}
+        # a ring road leaving the footway at 5 and coming back to it
+        ways = {**self.WAYS, 105: ([5, 10, 11, 12, 5], {"highway": "service"})}
+        osm.import_extract(self.university, self.extract(nodes, ways))
+
+        edges = self.edges()
+        self.assertEqual(set(edges), {(1, 3, 2), (3, 5, 4), (3, 6, 6), (5, 11, 10), (5, 11, 12)})
+        self.assertEqual(edges[(5, 11, 12)].geometry, [[10.003, 5.003], [10.004, 5.003], [10.004, 5.004]])
+        self.assertTrue(WalkNode.objects.filter(osm_id=11).exists())
+
+    def test_import_rebuilds_the_bundle(self):
+        first = bundle.get_manifest(self.university.id)["version"]
+        osm.import_extract(self.university, self.extract())
+
+        second = bundle.get_manifest(self.university.id)["version"]
+        self.assertNotEqual(second, first)
+
+        # nothing changed, nothing to rebuild
+        osm.import_extract(self.university, self.extract())
+        self.assertEqual(bundle.get_manifest(self.university.id)["version"], second)
+
+    def test_compressed_extract_and_dry_run(self):
+        stats = osm.import_extract(self.university, self.extract(name="campus.osm.gz"), dry_run=True)
+
+        self.assertEqual(stats["edges_created"], 3)
+        self.assertFalse(WalkEdge.objects.exists())
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command("import_osm", "uba", self.extract(), stdout=out)
+
+        self.assertIn("edges +3 ~0 -0", out.getvalue())
+        self.assertEqual(WalkEdge.objects.count(), 3)
+
+        with self.assertRaisesMessage(CommandError, "osmium"):
+            call_command("import_osm", "uba", "campus.osm.pbf")
+
+
+@override_settings(GRAPH_DIR=tempfile.mkdtemp())
+class GraphFileTestCase(CampusTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.university = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon",
+        )
+        self.nodes = [
+            WalkNode.objects.create(university=self.university, osm_id=osm_id, latitude=lat, longitude=lng)
+            for osm_id, lat, lng in [(1, 5.001, 10.001), (2, 5.002, 10.001), (3, 5.002, 10.002)]
+        ]
+        a, b, c = self.nodes
+        self.edges = [
+            WalkEdge.objects.create(university=self.university, source=a, target=b, via_osm_id=2,
+                                    highway="footway", length=111.2),
+            WalkEdge.objects.create(university=self.university, source=b, target=c, via_osm_id=3,
+                                    highway="steps", length=110.8),
+        ]
+        # the marker is next to c, the door next to b
+        self.building = Building.objects.create(
+            name="Library", latitude=5.0021, longitude=10.0021, university=self.university,
+            entrances=[[10.0011, 5.0019]],
+        )
+
+    def tearDown(self):
+        super().tearDown()
+        graph._graphs.clear()
+
+    def test_compile_and_map(self):
+        stats = graph.compile_graph(self.university.pk)
+        self.assertEqual((stats["nodes"], stats["links"]), (3, 4))
+        self.assertEqual(stats["bytes"], graph.HEADER.size + 4 * (3 * 3 + 4 + 3 * 4 + stats["cells"] + 1 + 3))
+
+        campus = graph.load(self.university.pk)
+        self.assertEqual(len(campus), 3)
+        self.assertEqual(list(campus.node_ids), [node.pk for node in self.nodes])
+        self.assertAlmostEqual(campus.lat[2], 5.002, places=5)
+
+        links = list(campus.neighbours(1))
+        self.assertEqual([target for target, _, _ in links], [0, 2])
+        self.assertAlmostEqual(links[1][1], 110.8, places=3)
+        self.assertEqual(links[1][2], self.edges[1].pk)
+
+        self.assertEqual(campus.nearest_node(5.0009, 10.001, 150), 0)
+        self.assertEqual(campus.nearest_node(5.0021, 10.0021, 150), 2)
+        self.assertIsNone(campus.nearest_node(5.1, 10.1, 150))
+
+    def test_nearest_node_matches_a_scan(self):
+        nodes = [(i, 5.0 + (i * 37 % 101) / 20000, 10.0 + (i * 53 % 97) / 20000) for i in range(200)]
+        grid = graph.NodeGrid.build([lat for _, lat, _ in nodes], [lng for _, _, lng in nodes])
+
+        for lat, lng in [(5.001, 10.001), (5.0049, 10.0003), (4.9995, 10.006), (5.0023, 9.9991)]:
+            expected = min(
+                range(len(nodes)),
+                key=lambda i: math.hypot((grid.lngs[i] - lng) * grid.scale, grid.lats[i] - lat),
+            )
+            self.assertEqual(grid.nearest(lat, lng, 1000), expected)
+
+    def test_new_file_is_swapped_in(self):
+        graph.compile_graph(self.university.pk)
+        old = graph.load(self.university.pk)
+        self.assertIs(graph.load(self.university.pk), old)
+
+        self.edges[1].delete()
+        graph.compile_graph(self.university.pk)
+        new = graph.load(self.university.pk)
+
+        self.assertIsNot(new, old)
+        self.assertEqual(len(new.indices), 2)
+        # a request still holding the old mapping can finish with it
+        self.assertEqual(len(old.indices), 4)
+
+    def test_route_ends_at_the_entrance_it_names(self):
+        # the first door is next to c, the one nearest the start next to b
+        self.building.entrances = [[10.0021, 5.0021], [10.0011, 5.0019]]
+        self.building.save()
+        graph.compile_graph(self.university.pk)
+
+        data = self.client.get("/api/route/", {
+            "start": "5.0009,10.001",
+            "end": "5.0021,10.0021",
+            "building": self.building.pk,
+        }).json()
+
+        self.assertEqual(data["entrance"], [5.0019, 10.0011])
+        self.assertEqual(data["coordinates"][-2:], [[10.001, 5.002], [10.0011, 5.0019]])
+        self.assertAlmostEqual(data["distance"], 111.2, places=1)
+
+    def test_building_route_is_cached_apart(self):
+        graph.compile_graph(self.university.pk)
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"routes": [{
+            "geometry": "_p~iF~ps|U_ulLnnqC_mqNvxq`@",
+            "summary": {"distance": 5000, "duration": 3600},
+        }]}
+
+        with mock.patch.object(requests, "post", return_value=response) as post:
+            plain = self.client.get("/api/route/", {"start": "5.0009,10.001", "end": "5.0019,10.0011"}).json()
+            walk = self.client.get("/api/route/", {
+                "start": "5.0009,10.001", "end": "5.0019,10.0011", "building": self.building.pk,
+            }).json()
+
+        post.assert_called_once()
+        self.assertEqual(plain["distance"], 5000)
+        self.assertAlmostEqual(walk["distance"], 111.2, places=1)
+
+    def test_route_walks_the_campus_network(self):
+        graph.compile_graph(self.university.pk)
+
+        with mock.patch.object(requests, "post") as post:
+            data = self.client.get("/api/route/", {
+                "start": "5.0009,10.001",
+                "end": "5.0021,10.0021",
+                "building": self.building.pk,
+            }).json()
+
+        post.assert_not_called()
+        # start, node a, straight to b (the edge has no geometry), the door
+        self.assertEqual(
+            data["coordinates"],
+            [[10.001, 5.0009], [10.001, 5.001], [10.001, 5.002], [10.0011, 5.0019]],
+        )
+        self.assertAlmostEqual(data["distance"], 111.2, places=1)
+        self.assertEqual(data["duration"], "1 min 20 sec")
+
+    def test_route_from_off_campus_asks_ors(self):
+        graph.compile_graph(self.university.pk)
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"routes": [{
+            "geometry": "_p~iF~ps|U_ulLnnqC_mqNvxq`@",
+            "summary": {"distance": 5000, "duration": 3600},
+        }]}
+
+        with mock.patch.object(requests, "post", return_value=response) as post:
+            self.client.get("/api/route/", {
+                "start": "5.1,10.1",
+                "end": "5.0021,10.0021",
+                "building": self.building.pk,
+            })
+
+        post.assert_called_once()
+
+    def test_shortest_path(self):
+        c = self.nodes[2]
+        WalkEdge.objects.create(university=self.university, source=self.nodes[0], target=c, via_osm_id=3,
+                                highway="footway", length=500)
+        graph.compile_graph(self.university.pk)
+        campus = graph.load(self.university.pk)
+
+        metres, steps = campus.shortest_path(0, 2)
+        self.assertAlmostEqual(metres, 222.0, places=3)
+        self.assertEqual([node for node, _ in steps], [0, 1])
+        self.assertEqual([edge for _, edge in steps], [edge.pk for edge in self.edges])
+
+    @override_settings(BUFFERED_WRITES_ASYNC=True)
+    def test_recompiles_are_coalesced(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_compile(university_id):
+            calls.append(university_id)
+            started.set()
+            release.wait(5)
+
+        with mock.patch.object(graph, "compile_graph", side_effect=slow_compile):
+            graph.schedule(self.university.pk)
+            started.wait(5)
+            # a burst of changes while the first compile runs
+            for _ in range(5):
+                graph.schedule(self.university.pk)
+            release.set()
+
+            deadline = time.monotonic() + 5
+            while self.university.pk in graph._compiling and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        # the running one, then one more for everything after it
+        self.assertEqual(calls, [self.university.pk] * 2)
+
+    def test_without_a_network(self):
+        graph.compile_graph(self.university.pk)
+        WalkNode.objects.all().delete()
+
+        self.assertIsNone(graph.compile_graph(self.university.pk))
+        self.assertIsNone(graph.load(self.university.pk))
+
+    def test_not_a_graph_file(self):
+        os.makedirs(os.path.dirname(graph.graph_path(self.university.pk)), exist_ok=True)
+        with open(graph.graph_path(self.university.pk), "wb") as fh:
+            fh.write(b"nope" * 10)
+
+        with self.assertRaises(graph.GraphFileError):
+            graph.load(self.university.pk)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command("compile_graphs", stdout=out)
+
+        self.assertIn("UBa: 3 nodes, 2 edges", out.getvalue())
@@ -0,0 +1,169 @@
+"""
+Token bucket throttling shared by all workers.
+
+Buckets live in the default cache and are updated with cache.incr, which is
+atomic on Redis/Memcached, so the limit holds across gunicorn workers.
+The bucket is stored as a GCRA "theoretical arrival time" (TAT): every
+request pushes the TAT one interval further, and a request is refused when
+the TAT runs more than `capacity` intervals ahead of now.
+
+Each throttled endpoint has buckets (see TOKEN_BUCKETS in settings) per
+client (user or IP), per university and optionally one global bucket that
+also catches requests naming no university; requests are refused with
+429 + Retry-After before the view does any work.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+
+
+def bucket_params(capacity, per_minute):
+    """(ms to refill one token, burst in ms, key ttl in seconds)"""
+    interval = int(60000 / per_minute)
+    burst = capacity * interval
+    return interval, burst, math.ceil((burst + interval) / 1000) + 1
+
+
+def waiting(tat, now, capacity, per_minute):
+    """seconds until the bucket with this TAT has a token, 0 when it has one"""
+    interval, burst, _ = bucket_params(capacity, per_minute)
+    if tat is None or tat + interval - now <= burst:
+        return 0
+    return (tat + interval - now - burst) / 1000
+
+
+def consume(key, capacity, per_minute):
+    """
+    Take one token from the bucket. Returns 0 when allowed, otherwise the
+    number of seconds until a token is available.
+    """
+    now = int(time.time() * 1000)
+    interval, burst, ttl = bucket_params(capacity, per_minute)
+
+    try:
+        tat = cache.incr(key, interval)
+    except ValueError:
+        cache.add(key, now, ttl)
+        tat = cache.incr(key, interval)
+
+    if tat < now + interval:
+        # bucket was idle long enough to be full again
+        tat = now + interval
+        cache.set(key, tat, ttl)
+    else:
+        # incr keeps the expiry of the first write, a busy bucket must not vanish
+        cache.touch(key, ttl)
+
+    if tat - now > burst:
+        # refused, hand the token back
+        refund(key, capacity, per_minute)
+        return (tat - now - burst) / 1000
+
+    return 0
+
+
+def refund(key, capacity, per_minute):
+    interval, _, ttl = bucket_params(capacity, per_minute)
+    try:
+        cache.decr(key, interval)
+        cache.touch(key, ttl)
+    except ValueError:
+        # expired meanwhile: already full
+        pass
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    DRF throttle over the buckets of `scope`: per client, per university
+    and, when configured, one "global" bucket every request is charged to.
+    """
+
+    scope = None
+
+    def get_client(self, request):
+        if request.user and request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        # REMOTE_ADDR unless NUM_PROXIES trusted proxies add X-Forwarded-For
+        return f"ip:{self.get_ident(request)}"
+
+    def get_university(self, request):
+        label = metrics.university_label(request)
+        return None if label == metrics.UNKNOWN else label
+
+    def bucket_keys(self, request):
+        """{bucket name: cache key} of the buckets this request is charged to"""
+        buckets = settings.TOKEN_BUCKETS.get(self.scope, {})
+        idents = {"client": self.get_client(request), "global": "global"}
+
+        university = self.get_university(request)
+        if university is not None:
+            idents["university"] = f"university:{university}"
+
+        return {
+            name: f"throttle:{self.scope}:{ident}"
+            for name, ident in idents.items()
+            if name in buckets
+        }
+
+    def refuse(self, name, wait):
+        self.retry_after = wait
+        metrics.inc(
+            "campus_throttled_requests_total",
+            scope=self.scope,
+            bucket=name,
+        )
+        return False
+
+    def allow_request(self, request, view):
+        buckets = settings.TOKEN_BUCKETS.get(self.scope, {})
+        keys = self.bucket_keys(request)
+        self.retry_after = 0
+
+        # check every bucket first, a refusal must not cost the others a token
+        now = int(time.time() * 1000)
+        tats = cache.get_many(list(keys.values()))
+        for name, key in keys.items():
+            wait = waiting(tats.get(key), now, *buckets[name])
+            if wait:
+                return self.refuse(name, wait)
+
+        # another worker may have taken the last token meanwhile
+        taken = []
+        for name, key in keys.items():
+            wait = consume(key, *buckets[name])
+            if wait:
+                for other in taken:
+                    refund(keys[other], *buckets[other])
+                return self.refuse(name, wait)
+            taken.append(name)
+
+        return True
+
+    def wait(self):
+        return math.ceil(self.retry_after)
+
+
+class RouteThrottle(TokenBucketThrottle):
+    scope = "route"
+
+
+class RegisterThrottle(TokenBucketThrottle):
+    scope = "register"
+
+    def get_university(self, request):
+        university = str(request.data.get("university", ""))
+        return university if university.isdigit() else None
+
+
+class FeedbackThrottle(TokenBucketThrottle):
+    scope = "feedback"
+
+    def get_university(self, request):
+        if request.auth is not None and "university_id" in request.auth:
+            return str(request.auth["university_id"])
+        return None
@@ -0,0 +1,405 @@
+"""
+Map tile proxy with one MBTiles file per (university, layer).
+
+The map used to load its dark tiles straight from Carto, every visitor
+again. /api/tiles/<university>/<layer>/<z>/<x>/<y> serves them from
+TILE_CACHE_DIR/<short_name>-<layer>.mbtiles. Only tiles of the campus (its
+bounding box plus TILE_BBOX_PADDING metres) in the map's zoom range are
+proxied, so this is not an open proxy for the whole world.
+
+Only layers whose terms allow storing tiles are in SOURCES. The Google
+satellite imagery may not be cached, the browser keeps loading it
+directly (DIRECT_SOURCES).
+
+A miss never waits on the tile server: the browser is redirected to the
+upstream tile and the tile is fetched into the file in the background,
+by at most TILE_FETCH_WORKERS threads, one fetch per tile at a time.
+
+Files are plain MBTiles (tiles table, TMS row order) plus a tile_usage
+table for the cache bookkeeping:
+
+- least recently used tiles are evicted once a file grows past
+  TILE_CACHE_MAX_MB; tiles fetched by seed_tiles are pinned and stay
+- last access times are only rewritten once per TILE_TOUCH_INTERVAL, so
+  a hit is a read, not a write
+- tiles older than TILE_MAX_AGE_DAYS are fetched again when possible,
+  the old copy is served if upstream is down
+
+With TILE_OFFLINE=True nothing is fetched: a file seeded elsewhere and
+copied into TILE_CACHE_DIR is opened read-only and served as is, misses
+are 404s. A file that can't be read (missing, locked) counts as a miss.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import University
+from .versions import map_version
+
+logger = logging.getLogger(__name__)
+
+# proxied and cached
+SOURCES = {
+    "dark": "https://basemaps.cartocdn.com/dark_all/{z}/{x}/{y}.png",
+}
+# loaded by the browser itself, their terms forbid caching the tiles
+DIRECT_SOURCES = {
+    "satellite": "https://mt1.google.com/vt/lyrs=s&hl=en&x={x}&y={y}&z={z}",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+CREATE TABLE IF NOT EXISTS tile_usage (
+    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+    size INTEGER, fetched_at INTEGER, accessed_at INTEGER, pinned INTEGER DEFAULT 0,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+CREATE INDEX IF NOT EXISTS tile_usage_lru ON tile_usage (pinned, accessed_at);
+"""
+
+
+class TileNotFound(Exception):
+    """Outside the campus / zoom range, or a miss while offline."""
+
+
+# ---------------------------
+# Tile math
+# ---------------------------
+def lat_lng_to_tile(lat, lng, zoom):
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def padded_bounds(university):
+    """(min_lat, min_lng, max_lat, max_lng) with the padding, None without bounds"""
+    values = (university.min_lat, university.min_lng, university.max_lat, university.max_lng)
+    if any(value is None for value in values):
+        return None
+
+    min_lat, min_lng, max_lat, max_lng = values
+    pad_lat = settings.TILE_BBOX_PADDING / 111_320
+    pad_lng = pad_lat / max(math.cos(math.radians((min_lat + max_lat) / 2)), 0.01)
+    return min_lat - pad_lat, min_lng - pad_lng, max_lat + pad_lat, max_lng + pad_lng
+
+
+def tile_range(bounds, zoom):
+    """(min_x, min_y, max_x, max_y) of the tiles covering bounds"""
+    min_lat, min_lng, max_lat, max_lng = bounds
+    min_x, min_y = lat_lng_to_tile(max_lat, min_lng, zoom)  # north west
+    max_x, max_y = lat_lng_to_tile(min_lat, max_lng, zoom)  # south east
+    return min_x, min_y, max_x, max_y
+
+
+def campus_tiles(bounds, min_zoom=None, max_zoom=None):
+    """every (z, x, y) of the campus, lowest zoom first"""
+    for zoom in range(min_zoom or settings.TILE_MIN_ZOOM, (max_zoom or settings.TILE_MAX_ZOOM) + 1):
+        min_x, min_y, max_x, max_y = tile_range(bounds, zoom)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                yield zoom, x, y
+
+
+def campus_bounds(university_id):
+    """padded bounds of an active university, cached per map version"""
+    key = f"tile_bounds:{university_id}:{map_version(university_id)}"
+    bounds = cache.get(key)
+
+    if bounds is None:
+        university = University.objects.filter(id=university_id, active=True).first()
+        bounds = (padded_bounds(university) if university else None) or ()
+        cache.set(key, bounds, 60 * 60 * 24)
+
+    return bounds or None
+
+
+def in_campus(bounds, zoom, x, y):
+    if not settings.TILE_MIN_ZOOM <= zoom <= settings.TILE_MAX_ZOOM:
+        return False
+    min_x, min_y, max_x, max_y = tile_range(bounds, zoom)
+    return min_x <= x <= max_x and min_y <= y <= max_y
+
+
+# ---------------------------
+# MBTiles store
+# ---------------------------
+class TileStore:
+    """
+    One MBTiles file; a connection per thread, WAL so readers never wait.
+    A readonly store never creates, migrates or writes to its file.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+
+    @property
+    def db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.readonly:
+                uri = f"file:{os.path.abspath(self.path)}?mode=ro"
+                conn = sqlite3.connect(uri, uri=True, timeout=1, isolation_level=None)
+            else:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, zoom, x, y):
+        """(data, fetched_at) or None"""
+        row = self.db.execute(
+            """
+            SELECT t.tile_data, u.fetched_at, u.accessed_at
+            FROM tiles t LEFT JOIN tile_usage u
+              ON u.zoom_level = t.zoom_level AND u.tile_column = t.tile_column AND u.tile_row = t.tile_row
+            WHERE t.zoom_level = ? AND t.tile_column = ? AND t.tile_row = ?
+            """,
+            (zoom, x, tms_row(zoom, y)),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        data, fetched_at, accessed_at = row
+        now = int(time.time())
+        if (
+            not self.readonly
+            and accessed_at is not None
+            and now - accessed_at > settings.TILE_TOUCH_INTERVAL
+        ):
+            self.db.execute(
+                "UPDATE tile_usage SET accessed_at = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (now, zoom, x, tms_row(zoom, y)),
+            )
+        # a seeded file from elsewhere may not have tile_usage rows
+        return data, now if fetched_at is None else fetched_at
+
+    def put(self, zoom, x, y, data, pinned=False):
+        now = int(time.time())
+        key = (zoom, x, tms_row(zoom, y))
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", key + (data,))
+            db.execute(
+                """
+                INSERT INTO tile_usage VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (zoom_level, tile_column, tile_row) DO UPDATE SET
+                    size = excluded.size, fetched_at = excluded.fetched_at,
+                    accessed_at = excluded.accessed_at, pinned = max(pinned, excluded.pinned)
+                """,
+                key + (len(data), now, now, int(pinned)),
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def pin(self, zoom, x, y):
+        """Keep a cached tile out of eviction; False if it isn't cached."""
+        now = int(time.time())
+        key = (zoom, x, tms_row(zoom, y))
+        if self.db.execute(
+            "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", key
+        ).fetchone() is None:
+            return False
+
+        self.db.execute(
+            """
+            INSERT INTO tile_usage
+            SELECT zoom_level, tile_column, tile_row, length(tile_data), ?, ?, 1 FROM tiles
+            WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?
+            ON CONFLICT (zoom_level, tile_column, tile_row) DO UPDATE SET pinned = 1
+            """,
+            (now, now) + key,
+        )
+        return True
+
+    def size(self):
+        return self.db.execute("SELECT coalesce(sum(size), 0) FROM tile_usage").fetchone()[0]
+
+    def evict(self, max_bytes):
+        """Drop least recently used unpinned tiles until under 90% of max_bytes."""
+        excess = self.size() - max_bytes
+        if excess <= 0:
+            return 0
+
+        target = excess + max_bytes // 10
+        freed = evicted = 0
+        rows = self.db.execute(
+            "SELECT zoom_level, tile_column, tile_row, size FROM tile_usage "
+            "WHERE pinned = 0 ORDER BY accessed_at LIMIT 1000"
+        ).fetchall()
+
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for zoom, column, row, size in rows:
+                if freed >= target:
+                    break
+                db.execute("DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (zoom, column, row))
+                db.execute("DELETE FROM tile_usage WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (zoom, column, row))
+                freed += size
+                evicted += 1
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        return evicted
+
+    def set_metadata(self, **values):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+            [(name, str(value)) for name, value in values.items()],
+        )
+
+
+def tms_row(zoom, y):
+    # MBTiles counts rows from the south
+    return (2 ** zoom - 1) - y
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_for(short_name, layer, readonly=None):
+    """the layer's store, read-only by default when TILE_OFFLINE is set"""
+    if readonly is None:
+        readonly = settings.TILE_OFFLINE
+    path = os.path.join(settings.TILE_CACHE_DIR, f"{short_name.lower()}-{layer}.mbtiles")
+    with _stores_lock:
+        if (path, readonly) not in _stores:
+            _stores[path, readonly] = TileStore(path, readonly)
+        return _stores[path, readonly]
+
+
+# ---------------------------
+# Proxy
+# ---------------------------
+_pending = set()  # (path, z, x, y) being fetched
+_pending_lock = threading.Lock()
+_executor = None
+
+
+def upstream_url(layer, zoom, x, y):
+    return SOURCES[layer].format(z=zoom, x=x, y=y)
+
+
+def fetch(layer, zoom, x, y):
+    response = requests.get(
+        upstream_url(layer, zoom, x, y),
+        headers={"User-Agent": settings.TILE_USER_AGENT},
+        timeout=settings.TILE_FETCH_TIMEOUT,
+    )
+    response.raise_for_status()
+    return response.content
+
+
+def fetch_into(store, layer, zoom, x, y):
+    """download one tile into the store; failures are logged, the next visit retries"""
+    try:
+        store.put(zoom, x, y, fetch(layer, zoom, x, y))
+        store.evict(settings.TILE_CACHE_MAX_MB * 1024 * 1024)
+    except (requests.RequestException, sqlite3.Error):
+        logger.warning("Tile fetch failed for %s %s/%s/%s", layer, zoom, x, y, exc_info=True)
+    finally:
+        with _pending_lock:
+            _pending.discard((store.path, zoom, x, y))
+
+
+def schedule_fetch(store, layer, zoom, x, y):
+    """fetch a tile in the background (inline under tests), once at a time"""
+    global _executor
+
+    with _pending_lock:
+        if (store.path, zoom, x, y) in _pending:
+            return
+        _pending.add((store.path, zoom, x, y))
+
+        if settings.BUFFERED_WRITES_ASYNC and _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TILE_FETCH_WORKERS, thread_name_prefix="tiles"
+            )
+
+    if settings.BUFFERED_WRITES_ASYNC:
+        _executor.submit(fetch_into, store, layer, zoom, x, y)
+    else:
+        fetch_into(store, layer, zoom, x, y)
+
+
+def get_tile(university_id, short_name, layer, zoom, x, y):
+    """
+    The cached data of one campus tile, None on a miss: the tile is then
+    fetched in the background and the caller sends the browser to
+    upstream_url. Raises TileNotFound outside the campus or on an
+    offline miss.
+    """
+    bounds = campus_bounds(university_id)
+    if layer not in SOURCES or bounds is None or not in_campus(bounds, zoom, x, y):
+        raise TileNotFound
+
+    store = store_for(short_name, layer)
+    try:
+        cached = store.get(zoom, x, y)
+    except sqlite3.Error:
+        # locked, missing or damaged file: serve it like a miss
+        logger.warning("Tile cache unreadable: %s", store.path, exc_info=True)
+        cached = None
+
+    if settings.TILE_OFFLINE:
+        if cached is None:
+            raise TileNotFound
+        return cached[0]
+
+    if cached is None:
+        schedule_fetch(store, layer, zoom, x, y)
+        return None
+
+    data, fetched_at = cached
+    if time.time() - fetched_at >= settings.TILE_MAX_AGE_DAYS * 86400:
+        # stale: served now, replaced in the background (kept if that fails)
+        schedule_fetch(store, layer, zoom, x, y)
+    return data
+
+
+def content_type(data):
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def tile_url_templates(university):
+    """Leaflet URL templates for the map: the proxy once the campus has bounds"""
+    if padded_bounds(university) is None:
+        return {**DIRECT_SOURCES, **SOURCES}
+
+    return {
+        **DIRECT_SOURCES,
+        **{
+            layer: f"/api/tiles/{university.short_name.lower()}/{layer}/{{z}}/{{x}}/{{y}}"
+            for layer in SOURCES
+        },
+    }
@@ -1,5 +1,18 @@
 from django.urls import path
-from .views import BuildingList, get_route, campus_map
+from .views import (
+    BuildingList,
+    DailyStatsExport,
+    SiteVisitExport,
+    building_clusters,
+    bundle_data,
+    bundle_manifest,
+    campus_locate,
+    campus_map,
+    get_route,
+    map_tile,
+    plan_tile,
+    track_events,
+)
 
 
 urlpatterns = [
@@ -9,5 +22,20 @@ urlpatterns = [
     
     #api's
     path('api/buildings/', BuildingList.as_view(), name='building-list'),
+    path('api/clusters/', building_clusters, name='building-clusters'),
+    path('api/campus/locate/', campus_locate, name='campus-locate'),
     path('api/route/', get_route, name='get-route'),
+    path('api/events/', track_events, name='track-events'),
+
+    # streamed exports for campus staff
+    path('api/exports/daily-stats/', DailyStatsExport.as_view(), name='export-daily-stats'),
+    path('api/exports/site-visits/', SiteVisitExport.as_view(), name='export-site-visits'),
+
+    # offline bundle for the PWA
+    path('api/bundle/<str:short_name>/manifest.json', bundle_manifest, name='bundle-manifest'),
+    path('api/bundle/<str:short_name>/<str:version>.json', bundle_data, name='bundle-data'),
+
+    # campus map tiles, cached locally
+    path('api/tiles/<str:short_name>/<str:layer>/<int:z>/<int:x>/<int:y>', map_tile, name='map-tile'),
+    path('api/plan-tiles/<str:short_name>/<slug:version>/<int:z>/<int:x>/<int:y>.png', plan_tile, name='plan-tile'),
 ]
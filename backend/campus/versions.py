@@ -0,0 +1,30 @@
+"""
+Data version of each university's map.
+
+Saving or deleting a University or one of its buildings, a new image
+derivative, site plan or walkway import bumps the version (see
+campus.signals); the page cache, the offline bundle, the clusters and the
+tile URLs are keyed on it. The counter lives in the shared cache.
+"""
+from django.core.cache import cache
+
+
+def version_key(university_id):
+    return f"campus_map_version:{university_id}"
+
+
+def map_version(university_id):
+    version = cache.get(version_key(university_id))
+
+    if version is None:
+        cache.add(version_key(university_id), 1, None)
+        version = cache.get(version_key(university_id), 1)
+
+    return version
+
+
+def bump_map_version(university_id):
+    try:
+        cache.incr(version_key(university_id))
+    except ValueError:
+        cache.add(version_key(university_id), 1, None)
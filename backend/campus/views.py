@@ -1,14 +1,26 @@
-from django.shortcuts import render, get_object_or_404
-from rest_framework import generics
-from rest_framework.decorators import api_view
+import gzip
+import math
+import time
+
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, JsonResponse
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from rest_framework import generics, status
+from rest_framework.decorators import api_view, authentication_classes, throttle_classes
 from rest_framework.response import Response
 from django.core.cache import cache
-from .models import Building, University
-from .serializers import BuildingSerializer
+from django.utils import timezone
+from . import bundle, clusters, counters, footprints, geofence, graph, metrics, pagecache, siteplan, sync, tiles
+from .analytics import event_buffer
+from .exports import ExportView
+from .models import Building, DailyStats, SiteVisit
+from .serializers import AnalyticsBatchSerializer, BuildingSerializer
+from .throttling import RouteThrottle
 from unimap_project import settings
 from openrouteservice import convert
 import requests
-import json
 
 ORS_URL = "https://api.openrouteservice.org/v2/directions/foot-walking"
 
@@ -19,11 +31,18 @@ class BuildingList(generics.ListAPIView):
 
     Query Params:
     - university: short_name of the university (case-insensitive)
+    - since: version from a previous sync (see campus.sync), returns
+      {"full": false, "version", "changed": [...], "deleted": [ids]}
+      or {"full": true, "version", "buildings": [...]} when a delta
+      is not possible; since=0 asks for a full snapshot
+    - zoom: map zoom, footprints are simplified for it (campus.footprints),
+      clamped to the map's zoom range
 
     If no university is provided, all buildings are returned.
     """
 
     serializer_class = BuildingSerializer
+    zoom = None
 
     def get_queryset(self):
         # Start with all buildings
@@ -39,57 +58,283 @@ class BuildingList(generics.ListAPIView):
 
         return qs
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["zoom"] = self.zoom
+        return context
+
+    def list(self, request, *args, **kwargs):
+        if request.GET.get("zoom") is not None:
+            try:
+                zoom = int(float(request.GET["zoom"]))
+            except (ValueError, OverflowError):
+                return Response({"error": "zoom must be a number"}, status=400)
+            self.zoom = min(max(zoom, settings.TILE_MIN_ZOOM), settings.TILE_MAX_ZOOM)
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        since = request.GET.get("since")
+        if since is not None:
+            return self.sync(request, queryset, since)
+
+        # time the serialization on its own (includes the lazy query)
+        with metrics.timer(
+            "campus_section_duration_seconds",
+            section="building_serialization",
+            university=metrics.university_label(request),
+        ):
+            data = self.get_serializer(queryset, many=True).data
+
+        return Response(data)
+
+    def sync(self, request, queryset, since):
+        if not since.isdigit():
+            return Response({"error": "since must be a version number"}, status=400)
+
+        university = (request.GET.get("university") or "").lower()
+        university_id = counters.university_ids().get(university)
+        if university and university_id is None:
+            # unfiltered tombstones would hand out every university's deletions
+            raise Http404("No active university with that name.")
+
+        changes = sync.building_changes(queryset, university_id, int(since))
+
+        if changes["full"]:
+            buildings = self.get_serializer(changes.pop("buildings"), many=True).data
+            return Response(dict(changes, buildings=buildings))
+
+        changed = self.get_serializer(changes.pop("changed"), many=True).data
+        return Response(dict(changes, changed=changed))
+
 # Campus map view
 def campus_map(request, short_name=None):
     """
     Render campus map.
     If short_name is provided → load that university.
     If not → load first active university.
+    The page comes from the full-page cache (campus.pagecache).
     """
 
-    # Get university
+    start = time.perf_counter()
+    label = metrics.university_label(request)
+
+    # short_name (lower case) -> id of active universities, cached
+    university_ids = counters.university_ids()
+
     if short_name:
-        university = get_object_or_404(
-            University,
-            short_name__iexact=short_name, # Use case-insensitive lookup so URLs work regardless of case
-            active=True
-        )
+        university_id = university_ids.get(short_name.lower())
+        if university_id is None:
+            raise Http404("No active university with that name.")
     else:
-        university = University.objects.filter(active=True).first()
+        # first active university, same as .filter(active=True).first()
+        university_id = min(university_ids.values(), default=None)
+
+    page, hit = None, False
+    if university_id is not None:
+        with metrics.timer(
+            "campus_section_duration_seconds",
+            section="campus_map_render",
+            university=label,
+        ):
+            page, hit = pagecache.get_page(university_id)
+        metrics.cache_result("campus_map", hit, label)
 
     # If no university exists
-    if not university:
+    if page is None:
+        if short_name:
+            raise Http404("No active university with that name.")
         return render(request, "campus_map.html", {
             "error": "No active university found."
         })
 
-    # Build rectangular boundary (only if values exist)
-    campus_boundary = []
+    response = pagecache.page_response(request, page)
+
+    # shows up in the browser's network tab next to TTFB
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    response["Server-Timing"] = f'page;desc="{"hit" if hit else "miss"}";dur={elapsed_ms:.1f}'
+    return response
+
+
+# Marker clusters
+def building_clusters(request):
+    """
+    Clusters and buildings of one zoom inside the map view.
+
+    Query Params:
+    - university: short_name (case-insensitive)
+    - bbox: west,south,east,north
+    - zoom: map zoom, clamped to the map's zoom range
+
+    {"zoom", "features": [{"id", "name", "category", "lat", "lng", "count": 1}
+    or {"cluster_id", "lat", "lng", "count", "expansion_zoom"}, ...]}
+    """
+
+    university_id = counters.university_ids().get(request.GET.get("university", "").lower())
+    if university_id is None:
+        raise Http404("No active university with that name.")
+
+    try:
+        bbox = [float(value) for value in request.GET.get("bbox", "").split(",")]
+        zoom = int(float(request.GET.get("zoom", "")))
+    except (ValueError, OverflowError):
+        return JsonResponse({"error": "bbox=west,south,east,north and zoom are required"}, status=400)
+
+    # NaN compares false both ways, it would get past the order checks
+    if len(bbox) != 4 or not all(map(math.isfinite, bbox)) or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        return JsonResponse({"error": "bbox must be west,south,east,north"}, status=400)
+
+    zoom, features = clusters.clusters(university_id, bbox, zoom)
+    return JsonResponse({"zoom": zoom, "features": features})
+
+
+def campus_locate(request):
+    """
+    Which campus is a point on.
+
+    Query Params:
+    - lat, lng: the point
+    - university: short_name (optional), "inside" then tells whether the
+      point is on that campus rather than on any campus
+
+    {"inside": bool, "university": {"short_name", "name", "url"} or null}
+    """
+
+    try:
+        lat = float(request.GET.get("lat", ""))
+        lng = float(request.GET.get("lng", ""))
+    except ValueError:
+        return JsonResponse({"error": "lat and lng are required"}, status=400)
 
-    if all([
-        university.min_lat,
-        university.max_lat,
-        university.min_lng,
-        university.max_lng
-    ]):
-        campus_boundary = [
-            [university.min_lat, university.min_lng],  # Bottom (south) → copy latitude → this is your min_lat
-            [university.min_lat, university.max_lng],  # Top (north) → copy latitude → this is your max_lat
-            [university.max_lat, university.max_lng],  # Right (east) → copy longitude → this is your max_lng
-            [university.max_lat, university.min_lng],  # Left (west) → copy longitude → this is your min_lng
-        ]
+    located = geofence.locate(lat, lng)
 
-    # Pass JSON to template
-    context = {
-        "university": university,
-        "campus_boundary_json": json.dumps(campus_boundary),
-    }
+    short_name = request.GET.get("university")
+    if short_name:
+        university_id = counters.university_ids().get(short_name.lower())
+        if university_id is None:
+            raise Http404("No active university with that name.")
+        inside = geofence.inside(university_id, lat, lng)
+    else:
+        inside = located is not None
+
+    university = None
+    if located is not None:
+        university = {
+            "short_name": located[1],
+            "name": located[2],
+            "url": reverse("campus-map-short", args=[located[1].lower()]),
+        }
+
+    return JsonResponse({"inside": inside, "university": university})
+
+
+# Offline bundle (PWA)
+def bundle_manifest(request, short_name):
+    """
+    Tiny document the service worker polls:
+    {"university", "version", "size", "generated_at", "url"}.
+    """
 
-    return render(request, "campus_map.html", context)
+    university_id = counters.university_ids().get(short_name.lower())
+    manifest = bundle.get_manifest(university_id) if university_id else None
+
+    if manifest is None:
+        raise Http404("No active university with that name.")
+
+    etag = '"%s"' % manifest["version"]
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(dict(manifest, url=reverse(
+            "bundle-data",
+            args=[manifest["university"].lower(), manifest["version"]],
+        )))
+
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def bundle_data(request, short_name, version):
+    """The bundle itself, its URL changes with its content."""
+
+    university_id = counters.university_ids().get(short_name.lower())
+    if university_id is None:
+        raise Http404("No active university with that name.")
+
+    gzipped = bundle.get_bundle(university_id, version)
+
+    if gzipped is None:
+        # evicted from the cache, the current version can be rebuilt
+        manifest = bundle.get_manifest(university_id)
+        if manifest and manifest["version"] == version:
+            bundle.refresh_bundle(university_id)
+            gzipped = bundle.get_bundle(university_id, version)
+
+    if gzipped is None:
+        raise Http404("Unknown bundle version, fetch the manifest again.")
+
+    if pagecache.accepts_gzip(request):
+        response = HttpResponse(gzipped, content_type="application/json")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = HttpResponse(gzip.decompress(gzipped), content_type="application/json")
+
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+# Map tiles
+def map_tile(request, short_name, layer, z, x, y):
+    """
+    One campus tile from the MBTiles cache. On a miss the browser is sent
+    to the tile server while the cache fetches the tile in the background.
+    """
+
+    university_id = counters.university_ids().get(short_name.lower())
+    if university_id is None:
+        raise Http404("No active university with that name.")
+
+    label = metrics.university_label(request)
+    try:
+        data = tiles.get_tile(university_id, short_name, layer, z, x, y)
+    except tiles.TileNotFound:
+        raise Http404("Tile outside the campus.")
+
+    metrics.cache_result("tiles", data is not None, label)
+
+    if data is None:
+        response = HttpResponseRedirect(tiles.upstream_url(layer, z, x, y))
+        # ask again next time, the proxy will have it by then
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    response = HttpResponse(data, content_type=tiles.content_type(data))
+    response["Cache-Control"] = f"public, max-age={settings.TILE_BROWSER_MAX_AGE}"
+    return response
+
+
+def plan_tile(request, short_name, version, z, x, y):
+    """A site plan tile, its URL changes whenever the plan does."""
+
+    university_id = counters.university_ids().get(short_name.lower())
+    if university_id is None:
+        raise Http404("No active university with that name.")
+
+    name = siteplan.tile_name(f"site_plans/tiles/{university_id}/{version}", z, x, y)
+    try:
+        response = FileResponse(default_storage.open(name, "rb"), content_type="image/png")
+    except (FileNotFoundError, OSError):
+        # outside the plan, or an old version that was cleaned up
+        raise Http404("No such plan tile.")
+
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
 
 
 # Route API
 @api_view(["GET"])
+@throttle_classes([RouteThrottle])
 def get_route(request):
     start = request.GET.get("start")  # "lat,lng"
     end = request.GET.get("end")      # "lat,lng"
@@ -97,8 +342,36 @@ def get_route(request):
     if not start or not end:
         return Response({"error": "start and end parameters required"}, status=400)
 
-    cache_key = f"route_{start}_{end}"
+    university = metrics.university_label(request)
+
+    # feeds DailyStats and the live admin dashboard
+    university_id = counters.university_ids().get(university)
+    if university_id:
+        counters.count("route_requests", university_id)
+
+    # to a building: end at its door nearest to the start
+    entrance = None
+    building_university = None
+    building_id = request.GET.get("building")
+    if building_id:
+        if not building_id.isdigit():
+            return Response({"error": "building must be an id"}, status=400)
+        entrances, building_university = (
+            Building.objects.filter(pk=building_id).values_list("entrances", "university_id").first()
+            or (None, None)
+        )
+        try:
+            start_lat, start_lng = map(float, start.split(","))
+        except ValueError:
+            return Response({"error": "start must be lat,lng"}, status=400)
+        entrance = footprints.nearest_entrance(entrances, start_lat, start_lng)
+        if entrance is not None:
+            end = "%s,%s" % entrance
+
+    # a walk to a building and an ORS route between the same points differ
+    cache_key = f"route_{start}_{end}" + (f"_building_{building_id}" if building_id else "")
     cached = cache.get(cache_key)
+    metrics.cache_result("route", bool(cached), university)
     if cached:
         return Response(cached)
 
@@ -106,6 +379,21 @@ def get_route(request):
         start_lat, start_lng = map(float, start.split(","))
         end_lat, end_lng = map(float, end.split(","))
 
+        # from somewhere on campus: walk the imported network, no ORS call
+        walk = None
+        if building_university is not None:
+            walk = graph.walking_route(building_university, start_lat, start_lng, end_lat, end_lng)
+        if walk is not None:
+            result = {
+                "coordinates": walk["coordinates"],
+                "distance": walk["distance"],
+                "duration": format_duration(walk["seconds"])
+            }
+            if entrance is not None:
+                result["entrance"] = list(entrance)
+            cache.set(cache_key, result, 600)
+            return Response(result)
+
         payload = {
             "coordinates": [
                 [start_lng, start_lat],
@@ -118,7 +406,11 @@ def get_route(request):
             "Content-Type": "application/json"
         }
 
-        ors_response = requests.post(ORS_URL, json=payload, headers=headers)
+        with metrics.timer(
+            "campus_ors_request_duration_seconds",
+            university=university,
+        ):
+            ors_response = requests.post(ORS_URL, json=payload, headers=headers)
         ors_response.raise_for_status()  # auto-throws exception on non-200
 
         data = ors_response.json()
@@ -135,6 +427,8 @@ def get_route(request):
             "distance": summary["distance"],
             "duration": format_duration(summary["duration"])
         }
+        if entrance is not None:
+            result["entrance"] = list(entrance)
 
         cache.set(cache_key, result, 600)  # cache 10 minutes
         return Response(result)
@@ -143,6 +437,41 @@ def get_route(request):
         return Response({"error": str(e)}, status=500)
 
 
+# Analytics API
+@api_view(["POST"])
+@authentication_classes([])
+def track_events(request):
+    """
+    Accepts a batch of map events and queues them.
+
+    Body: {"university": "uba", "events": [{"kind": "search", "query": "lib"}, ...]}
+    Nothing is written here, event_buffer flushes in the background.
+    """
+    serializer = AnalyticsBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    university = serializer.validated_data["university"].lower()
+    received_at = timezone.now()
+
+    event_buffer.add(*[
+        dict(event, university=university, created_at=received_at)
+        for event in serializer.validated_data["events"]
+    ])
+
+    return Response(status=status.HTTP_202_ACCEPTED)
+
+
+# Exports for campus staff (see campus.exports)
+class DailyStatsExport(ExportView):
+    model = DailyStats
+    export_fields = ("university__short_name", "date", "visitors", "route_requests")
+
+
+class SiteVisitExport(ExportView):
+    model = SiteVisit
+    export_fields = ("id", "session_key", "university__short_name", "first_visit", "last_visit")
+
+
 # Helper
 def format_duration(seconds: float):
     seconds = int(seconds)
@@ -1,24 +1,48 @@
 from django.contrib import admin
+from django.db.models import Count, F, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.html import format_html
 from campus.admin import campus_admin_site
+from campus.exports import ExportMixin
+from .clustering import resolve_clusters
 from .models import Feedback
 
 
+class ClusterFilter(admin.SimpleListFilter):
+    """one row per near-duplicate cluster (its first report)"""
+
+    title = "near-duplicates"
+    parameter_name = "grouped"
+
+    def lookups(self, request, model_admin):
+        return (("yes", "One row per cluster"),)
+
+    def queryset(self, request, queryset):
+        if self.value() == "yes":
+            return queryset.filter(cluster_id=F("id"))
+        return queryset
+
+
 @admin.register(Feedback, site=campus_admin_site)
-class FeedbackAdmin(admin.ModelAdmin):
+class FeedbackAdmin(ExportMixin, admin.ModelAdmin):
 
     list_display = (
         "id",
         "subject",
         "status",
         "user",
+        "cluster_size",
         "created_at",
     )
 
     list_filter = (
+        ClusterFilter,
         "status",
         "created_at",
     )
 
+    actions = ExportMixin.actions + ["resolve_cluster"]
+
     search_fields = (
         "subject",
         "message",
@@ -26,4 +50,51 @@ class FeedbackAdmin(admin.ModelAdmin):
         "email",
     )
 
-    ordering = ("-created_at",)
\ No newline at end of file
+    ordering = ("-created_at", "-id")
+
+    # skip the COUNT(*) over the whole table on every changelist page
+    show_full_result_count = False
+
+    export_fields = (
+        "id",
+        "subject",
+        "message",
+        "status",
+        "name",
+        "email",
+        "user__username",
+        "created_at",
+        "updated_at",
+    )
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).annotate(
+            cluster_size=Subquery(
+                Feedback.objects.filter(cluster_id=OuterRef("cluster_id"))
+                .values("cluster_id")
+                .annotate(count=Count("id"))
+                .values("count")
+            )
+        )
+        if request.user.is_superuser:
+            return qs
+        # campus admins only see feedback from their own students
+        return qs.filter(university=request.user.campus_admin.university)
+
+    @admin.display(description="Reports", ordering="cluster_size")
+    def cluster_size(self, obj):
+        if not obj.cluster_size or obj.cluster_size < 2:
+            return obj.cluster_size or "-"
+        return format_html(
+            '<a href="?cluster__id__exact={}">{}</a>', obj.cluster_id, obj.cluster_size
+        )
+
+    @admin.action(description="Resolve selected and all their near-duplicates")
+    def resolve_cluster(self, request, queryset):
+        cluster_ids = {cluster_id or pk for pk, cluster_id in queryset.values_list("id", "cluster_id")}
+        resolved = resolve_clusters(cluster_ids, self.get_queryset(request))
+        # feedback not clustered yet only resolves itself
+        resolved += queryset.filter(cluster__isnull=True).exclude(
+            status="resolved"
+        ).update(status="resolved", updated_at=timezone.now())
+        self.message_user(request, f"{resolved} feedback resolved.")
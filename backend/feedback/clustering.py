@@ -0,0 +1,193 @@
+"""
+Near-duplicate feedback clustering with MinHash + LSH.
+
+Each feedback's subject + message is cut into overlapping 5 character
+shingles, and NUM_PERM hash functions keep the smallest hash of any shingle
+(the MinHash signature). Two signatures agree on a position with
+probability equal to the Jaccard similarity of the shingle sets, so the
+share of equal positions estimates how alike two messages are.
+
+To avoid comparing every pair, the signature is split into BANDS bands of
+ROWS values and each band is hashed into a bucket (FeedbackBand). Only
+feedback sharing a bucket are compared, which is a couple of index lookups
+per feedback however large the table is. With 16 bands of 4 rows, pairs
+at 0.7 similarity share a bucket 99% of the time, pairs at 0.3 about 12%.
+
+A feedback joins the cluster of its most similar older feedback of the same
+university when the estimate reaches FEEDBACK_CLUSTER_THRESHOLD, otherwise
+it starts its own cluster.
+"""
+import hashlib
+import random
+import re
+import struct
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Feedback, FeedbackBand
+
+SHINGLE_SIZE = 5
+BANDS = 16
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+
+# universal hashing (a*x + b) mod PRIME, fixed seed so signatures stay
+# comparable across workers and restarts
+PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+_rng = random.Random(1)
+PERMUTATIONS = [
+    (_rng.randrange(1, PRIME), _rng.randrange(0, PRIME)) for _ in range(NUM_PERM)
+]
+
+SIGNATURE_FORMAT = f"<{NUM_PERM}I"
+
+
+def shingles(text):
+    text = " ".join(re.findall(r"\w+", text.lower()))
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(text):
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), "little")
+        for shingle in shingles(text)
+    ]
+    return [
+        min((a * h + b) % PRIME for h in hashes) & MAX_HASH
+        for a, b in PERMUTATIONS
+    ]
+
+
+def feedback_text(feedback):
+    return f"{feedback.subject}\n{feedback.message}"
+
+
+def pack(sig):
+    return struct.pack(SIGNATURE_FORMAT, *sig)
+
+
+def unpack(data):
+    return struct.unpack(SIGNATURE_FORMAT, bytes(data))
+
+
+def similarity(sig_a, sig_b):
+    """estimated Jaccard similarity of two signatures"""
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / NUM_PERM
+
+
+def buckets(sig):
+    """one signed 64 bit bucket per band, the band number is part of the hash"""
+    result = []
+    for band in range(BANDS):
+        rows = sig[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(
+            struct.pack(f"<I{ROWS}I", band, *rows), digest_size=8
+        ).digest()
+        result.append(int.from_bytes(digest, "little", signed=True))
+    return result
+
+
+def assign_clusters(feedbacks):
+    """
+    Sign a batch of saved feedback and put each one in a cluster.
+    A fixed number of queries per batch: bands insert, candidate lookup,
+    candidate load and one bulk update.
+    """
+    feedbacks = sorted(feedbacks, key=lambda f: (f.created_at, f.pk))
+    if not feedbacks:
+        return 0
+
+    threshold = settings.FEEDBACK_CLUSTER_THRESHOLD
+    signatures = {f.pk: signature(feedback_text(f)) for f in feedbacks}
+    bucket_map = {pk: buckets(sig) for pk, sig in signatures.items()}
+
+    with transaction.atomic():
+        FeedbackBand.objects.bulk_create([
+            FeedbackBand(feedback_id=pk, bucket=bucket)
+            for pk, bucket_list in bucket_map.items()
+            for bucket in bucket_list
+        ])
+
+        # every already clustered feedback sharing a bucket with the batch
+        all_buckets = {bucket for bucket_list in bucket_map.values() for bucket in bucket_list}
+        by_bucket = {}
+        for feedback_id, bucket in (
+            FeedbackBand.objects
+            .filter(bucket__in=all_buckets)
+            .exclude(feedback_id__in=signatures.keys())
+            .values_list("feedback_id", "bucket")
+        ):
+            by_bucket.setdefault(bucket, set()).add(feedback_id)
+
+        known = {
+            pk: (university_id, unpack(minhash), cluster_id, (created_at, pk))
+            for pk, university_id, minhash, cluster_id, created_at in (
+                Feedback.objects
+                .filter(
+                    id__in=set().union(*by_bucket.values()),
+                    minhash__isnull=False,
+                    cluster__isnull=False,
+                )
+                .values_list("id", "university_id", "minhash", "cluster_id", "created_at")
+            )
+        }
+
+        for feedback in feedbacks:
+            sig = signatures[feedback.pk]
+            candidates = set()
+            for bucket in bucket_map[feedback.pk]:
+                candidates |= by_bucket.get(bucket, set())
+
+            best, best_score = None, threshold
+            for pk in candidates:
+                university_id, other_sig, cluster_id, key = known.get(pk, (None, None, None, None))
+                if other_sig is None or university_id != feedback.university_id:
+                    continue
+                # only older feedback, so a cluster is named after its first report
+                if key >= (feedback.created_at, feedback.pk):
+                    continue
+                score = similarity(sig, other_sig)
+                if score >= best_score:
+                    best, best_score = cluster_id, score
+
+            feedback.minhash = pack(sig)
+            feedback.cluster_id = best or feedback.pk
+
+            # later feedback of this batch can match this one
+            known[feedback.pk] = (
+                feedback.university_id, sig, feedback.cluster_id,
+                (feedback.created_at, feedback.pk),
+            )
+            for bucket in bucket_map[feedback.pk]:
+                by_bucket.setdefault(bucket, set()).add(feedback.pk)
+
+        Feedback.objects.bulk_update(feedbacks, ["minhash", "cluster"])
+
+    return len(feedbacks)
+
+
+def cluster_pending(batch_size=500):
+    """Cluster every feedback the job hasn't seen yet, oldest first."""
+    done = 0
+    while True:
+        batch = list(
+            Feedback.objects
+            .filter(minhash__isnull=True)
+            .order_by("created_at", "id")[:batch_size]
+        )
+        if not batch:
+            return done
+        done += assign_clusters(batch)
+
+
+def resolve_clusters(cluster_ids, queryset=None):
+    """Mark every feedback of the given clusters resolved, returns the count."""
+    queryset = Feedback.objects.all() if queryset is None else queryset
+    return queryset.filter(cluster_id__in=cluster_ids).exclude(
+        status="resolved"
+    ).update(status="resolved", updated_at=timezone.now())
@@ -0,0 +1,86 @@
+"""
+Queued feedback ingestion.
+
+FeedbackCreateView only validates, drops duplicates and queues; the
+FeedbackBuffer writes the queue with bulk_create. A duplicate is the same
+user (or guest email) sending the same subject and message again within
+FEEDBACK_DUPLICATE_WINDOW seconds; the fingerprints are kept in the shared
+cache so every worker sees them. A fingerprint is queued with its
+feedback and released again when the batch can't be written, so a lost
+write doesn't also block the resend. Each written batch is then
+clustered with earlier near-duplicates (feedback.clustering); a batch
+whose clustering fails is kept and clustered with the next one.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from campus.buffers import BufferedWriter
+from .clustering import assign_clusters, cluster_pending
+from .models import Feedback
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackBuffer(BufferedWriter):
+    """items are (fingerprint key, Feedback fields) pairs, see claim()"""
+
+    # a batch was written but not clustered, see write()
+    unclustered = False
+
+    def write(self, items):
+        try:
+            created = Feedback.objects.bulk_create([Feedback(**fields) for _, fields in items])
+        except Exception:
+            # the sender may try again, the base class logs the drop
+            release([key for key, _ in items])
+            raise
+
+        # already off the request thread, cluster the batch right away. The
+        # rows are saved either way: when clustering fails their minhash stays
+        # NULL, and the next batch (or cluster_feedback) clusters them first
+        try:
+            if self.unclustered:
+                cluster_pending()
+            else:
+                assign_clusters(created)
+        except Exception:
+            logger.exception("Clustering failed, %d saved feedback left unclustered", len(created))
+            self.unclustered = True
+        else:
+            self.unclustered = False
+
+
+feedback_buffer = FeedbackBuffer(
+    flush_size=settings.FEEDBACK_FLUSH_SIZE,
+    flush_interval=settings.FEEDBACK_FLUSH_INTERVAL,
+)
+
+
+def normalize(text):
+    # "Library  missing." and "library missing. " are the same complaint
+    return " ".join(text.lower().split())
+
+
+def fingerprint(identity, subject, message):
+    content = "\0".join([identity, normalize(subject), normalize(message)])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def claim(identity, subject, message):
+    """
+    The fingerprint key of new feedback, None when this exact feedback was
+    already accepted inside the window. cache.add is atomic, so two
+    workers can't both accept the same one.
+    """
+    key = f"feedback_seen:{fingerprint(identity, subject, message)}"
+    if cache.add(key, 1, settings.FEEDBACK_DUPLICATE_WINDOW):
+        return key
+    return None
+
+
+def release(keys):
+    """forget fingerprints whose feedback was not written"""
+    cache.delete_many(keys)
@@ -0,0 +1,123 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from campus.models import University
+from feedback.models import Feedback
+from feedback.pagination import page_after
+
+BENCH_SUBJECT = "[benchmark]"
+
+# how deep into the list each measured page starts, as a share of all rows
+DEPTHS = (0, 0.01, 0.1, 0.5, 0.9, 0.99)
+
+
+class Command(BaseCommand):
+    """
+    python manage.py benchmark_feedback_pages --rows 1000000
+    Seeds fake feedback up to --rows, then times one triage page at growing
+    depths with keyset (cursor) and OFFSET pagination. Never run it on the
+    production database; --cleanup removes the seeded rows.
+    """
+
+    help = "Compare keyset and OFFSET page latency on the feedback table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--page-size", type=int, default=50)
+        parser.add_argument("--status", help="benchmark the status-filtered list")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--cleanup", action="store_true", help="delete the seeded rows and exit")
+
+    def handle(self, *args, **options):
+        if options["cleanup"]:
+            deleted, _ = Feedback.objects.filter(subject=BENCH_SUBJECT).delete()
+            self.stdout.write(self.style.SUCCESS(f"{deleted} benchmark rows deleted"))
+            return
+
+        self.seed(options["rows"])
+
+        # same queryset the triage API pages over
+        qs = Feedback.objects.select_related("user", "university")
+        if options["status"]:
+            qs = qs.filter(status=options["status"])
+
+        total = qs.count()
+        size = options["page_size"]
+        ordered = qs.order_by("-created_at", "-id")
+
+        self.stdout.write(f"{total} rows, page size {size}, median of {options['repeat']} runs")
+        self.stdout.write(f"{'depth':>10}  {'keyset ms':>10}  {'offset ms':>10}")
+
+        for depth in DEPTHS:
+            offset = min(int(total * depth), max(total - size, 0))
+
+            key = None
+            if offset:
+                # the cursor a client would hold after reading `offset` rows
+                key = ordered.values_list("created_at", "id")[offset - 1]
+
+            keyset_ms = self.median_ms(lambda: page_after(qs, key, size), options["repeat"])
+            offset_ms = self.median_ms(
+                lambda: list(ordered[offset:offset + size]), options["repeat"]
+            )
+
+            self.stdout.write(f"{offset:>10}  {keyset_ms:>10.2f}  {offset_ms:>10.2f}")
+
+    def median_ms(self, fetch, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fetch()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def seed(self, rows, batch_size=10_000):
+        missing = rows - Feedback.objects.filter(subject=BENCH_SUBJECT).count()
+        if missing <= 0:
+            return
+
+        self.stdout.write(f"seeding {missing} rows...")
+        start = time.perf_counter()
+
+        rng = random.Random(0)
+        now = timezone.now()
+        statuses = [choice for choice, _ in Feedback.STATUS_CHOICES]
+        universities = list(University.objects.values_list("id", flat=True)) or [None]
+
+        # raw INSERT: bulk_create would overwrite created_at (auto_now_add)
+        # with the same "now" for every row
+        table = connection.ops.quote_name(Feedback._meta.db_table)
+        columns = ("subject", "message", "status", "university_id", "created_at", "updated_at")
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            table,
+            ", ".join(connection.ops.quote_name(column) for column in columns),
+            ", ".join(["%s"] * len(columns)),
+        )
+
+        while missing > 0:
+            batch = []
+            for _ in range(min(batch_size, missing)):
+                created_at = connection.ops.adapt_datetimefield_value(
+                    now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+                )
+                batch.append((
+                    BENCH_SUBJECT,
+                    "seeded by benchmark_feedback_pages",
+                    rng.choice(statuses),
+                    rng.choice(universities),
+                    created_at,
+                    created_at,
+                ))
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+
+            missing -= len(batch)
+
+        self.stdout.write(f"seeded in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from feedback.clustering import cluster_pending
+from feedback.models import Feedback, FeedbackBand
+
+
+class Command(BaseCommand):
+    """
+    Cluster feedback the ingest buffer hasn't clustered yet (rows from
+    before clustering existed, or a batch that failed). Safe to run on a
+    schedule; --rebuild starts over, e.g. after changing the threshold.
+    """
+
+    help = "Group near-duplicate feedback with MinHash/LSH"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--rebuild", action="store_true", help="forget every cluster first")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        if options["rebuild"]:
+            FeedbackBand.objects.all().delete()
+            Feedback.objects.update(minhash=None, cluster=None)
+
+        done = cluster_pending(options["batch_size"])
+        clusters = Feedback.objects.filter(cluster_id__isnull=False).values("cluster_id").distinct().count()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{done} feedback clustered in {time.perf_counter() - start:.1f}s, "
+            f"{clusters} clusters in total"
+        ))
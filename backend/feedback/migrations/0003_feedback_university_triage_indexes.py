@@ -0,0 +1,52 @@
+# Generated by Django 5.2 on 2026-10-19 19:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_university_from_profile(apps, schema_editor):
+    Feedback = apps.get_model("feedback", "Feedback")
+    Profile = apps.get_model("accounts", "Profile")
+
+    # one UPDATE with a correlated subquery
+    Feedback.objects.filter(user__isnull=False).update(
+        university_id=models.Subquery(
+            Profile.objects.filter(user_id=models.OuterRef("user_id")).values("university_id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_department_remove_profile_department_name_and_more'),
+        ('campus', '0013_dailystats_route_requests'),
+        ('feedback', '0002_alter_feedback_options_feedback_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feedback',
+            name='university',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='feedbacks', to='campus.university'),
+        ),
+        migrations.RunPython(copy_university_from_profile, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['created_at', 'id'], name='feedback_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='feedback_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['university', 'status', 'created_at', 'id'], name='feedback_uni_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='feedback_user_created_idx'),
+        ),
+    ]
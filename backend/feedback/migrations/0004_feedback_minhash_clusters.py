@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-19 19:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feedback', '0003_feedback_university_triage_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feedback',
+            name='cluster',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cluster_members', to='feedback.feedback'),
+        ),
+        migrations.AddField(
+            model_name='feedback',
+            name='minhash',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.CreateModel(
+            name='FeedbackBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField(db_index=True)),
+                ('feedback', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='feedback.feedback')),
+            ],
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from campus.models import University
+
 User = get_user_model()
 
 
@@ -20,6 +22,15 @@ class Feedback(models.Model):
         related_name="feedbacks"
     )
 
+    # copied from the sender's profile so triage can filter without a join
+    university = models.ForeignKey(
+        University,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="feedbacks"
+    )
+
     name = models.CharField(
         max_length=100,
         blank=True,
@@ -51,8 +62,49 @@ class Feedback(models.Model):
         auto_now=True
     )
 
+    # MinHash signature of subject + message (see feedback.clustering),
+    # NULL until the clustering job has seen this feedback
+    minhash = models.BinaryField(
+        null=True,
+        editable=False
+    )
+
+    # oldest feedback of the near-duplicate group, itself for the first one
+    cluster = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="cluster_members"
+    )
+
     class Meta:
         ordering = ["-created_at"]
+        # one per triage filter, all ending in the (created_at, id) page key
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="feedback_created_idx"),
+            models.Index(fields=["status", "created_at", "id"], name="feedback_status_created_idx"),
+            models.Index(fields=["university", "status", "created_at", "id"], name="feedback_uni_status_idx"),
+            models.Index(fields=["user", "created_at", "id"], name="feedback_user_created_idx"),
+        ]
+
+    def __str__(self):
+        return self.subject
+
+
+class FeedbackBand(models.Model):
+    """
+    One LSH band of a feedback's MinHash. Feedback sharing any bucket are
+    candidate near-duplicates, found through the bucket index.
+    """
+
+    feedback = models.ForeignKey(
+        Feedback,
+        on_delete=models.CASCADE,
+        related_name="bands"
+    )
+
+    bucket = models.BigIntegerField(db_index=True)
 
     def __str__(self):
-        return self.subject
\ No newline at end of file
+        return f"{self.feedback_id}: {self.bucket}"
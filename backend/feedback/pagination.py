@@ -0,0 +1,97 @@
+"""
+Keyset (cursor) pagination on (created_at, id), newest first.
+
+OFFSET makes the database walk and throw away every row before the page,
+so page 2000 costs 2000 pages of work. Here the cursor is the key of the
+last row shown and the next page is "rows older than that key", which the
+(filter, created_at, id) indexes on Feedback answer by seeking straight to
+it: every page costs the same however deep it is.
+"""
+import base64
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(obj):
+    key = f"{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns (created_at, id) or raises ValueError."""
+    # bad base64 / utf-8 / field count all raise ValueError subclasses
+    created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+
+    created_at = parse_datetime(created_at)
+    if created_at is None or not pk.isdigit():
+        raise ValueError("bad cursor")
+
+    return created_at, int(pk)
+
+
+def page_after(queryset, key, size):
+    """
+    The `size` rows after `key` (None for the first page) plus one extra
+    row, so the caller can tell whether there is a next page.
+    """
+    queryset = queryset.order_by("-created_at", "-id")
+
+    if key is not None:
+        created_at, pk = key
+        # created_at <= x gives the index a range to seek into, the OR
+        # only breaks ties; "(a < x) OR (a = x AND id < y)" can't seek
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(id__lt=pk),
+            created_at__lte=created_at,
+        )
+
+    return list(queryset[:size + 1])
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+
+    def get_page_size(self, request):
+        size = request.query_params.get(self.page_size_query_param, "")
+        if size.isdigit() and int(size) > 0:
+            return min(int(size), settings.FEEDBACK_MAX_PAGE_SIZE)
+        return settings.FEEDBACK_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+
+        key = None
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                key = decode_cursor(cursor)
+            except ValueError:
+                raise NotFound("Invalid cursor.")
+
+        rows = page_after(queryset, key, size)
+        self.has_next = len(rows) > size
+        self.page = rows[:size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            encode_cursor(self.page[-1]),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "results": data,
+        })
@@ -29,4 +29,38 @@ class FeedbackSerializer(serializers.ModelSerializer):
                     "email": "Email is required for guest users."
                 })
 
-        return attrs
\ No newline at end of file
+        return attrs
+
+
+class FeedbackTriageSerializer(serializers.ModelSerializer):
+    """staff view of a feedback, only the status can be changed"""
+
+    username = serializers.CharField(source="user.username", default=None, read_only=True)
+    university_name = serializers.CharField(source="university.short_name", default=None, read_only=True)
+
+    class Meta:
+        model = Feedback
+        fields = [
+            "id",
+            "subject",
+            "message",
+            "status",
+            "user",
+            "username",
+            "name",
+            "email",
+            "university",
+            "university_name",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = [
+            "subject",
+            "message",
+            "user",
+            "name",
+            "email",
+            "university",
+            "created_at",
+            "updated_at",
+        ]
@@ -1,9 +1,20 @@
+import csv
+import io
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import DatabaseError
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from accounts.models import Profile
+from campus.counters import counter_buffer
+from campus.models import CampusAdminUser, University
+from .clustering import assign_clusters, cluster_pending
+from .ingest import feedback_buffer
 from .models import Feedback
 
 User = get_user_model()
@@ -15,6 +26,9 @@ User = get_user_model()
 class FeedbackAPITestCase(APITestCase):
 
     def setUp(self):
+        cache.clear()
+        feedback_buffer.clear()
+
         self.url = "/api/feedback/submit/"
 
         self.user = User.objects.create_user(
@@ -47,9 +61,13 @@ class FeedbackAPITestCase(APITestCase):
 
         self.assertEqual(
             response.status_code,
-            status.HTTP_201_CREATED
+            status.HTTP_202_ACCEPTED
         )
 
+        # queued, written by the next batch
+        self.assertEqual(Feedback.objects.count(), 0)
+        feedback_buffer.flush()
+
         self.assertEqual(
             Feedback.objects.count(),
             1
@@ -129,9 +147,10 @@ class FeedbackAPITestCase(APITestCase):
 
         self.assertEqual(
             response.status_code,
-            status.HTTP_201_CREATED
+            status.HTTP_202_ACCEPTED
         )
 
+        feedback_buffer.flush()
         feedback = Feedback.objects.first()
 
         self.assertEqual(
@@ -159,4 +178,308 @@ class FeedbackAPITestCase(APITestCase):
         self.assertEqual(
             feedback.status,
             "pending"
-        )
\ No newline at end of file
+        )
+
+    def test_duplicate_feedback_is_stored_once(self):
+        """
+        Resending the same feedback within the window is accepted
+        but only written once.
+        """
+
+        data = {
+            "name": "Bodeh Delton",
+            "email": "Bodeh@example.com",
+            "subject": "Campus Navigation",
+            "message": "Library building missing."
+        }
+
+        first = self.client.post(self.url, data, format="json")
+
+        data["message"] = "library   building missing. "
+        second = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.status_code, status.HTTP_202_ACCEPTED)
+
+        feedback_buffer.flush()
+
+        self.assertEqual(Feedback.objects.count(), 1)
+
+    def test_failed_write_releases_the_fingerprint(self):
+        """
+        A batch that can't be written doesn't block the resend.
+        """
+
+        data = {
+            "name": "Bodeh Delton",
+            "email": "Bodeh@example.com",
+            "subject": "Campus Navigation",
+            "message": "Library building missing."
+        }
+
+        self.client.post(self.url, data, format="json")
+
+        with mock.patch.object(Feedback.objects, "bulk_create", side_effect=DatabaseError("down")), \
+                self.assertLogs("campus.buffers", "ERROR"):
+            self.assertEqual(feedback_buffer.flush(), 0)
+
+        self.client.post(self.url, data, format="json")
+        feedback_buffer.flush()
+
+        self.assertEqual(Feedback.objects.count(), 1)
+
+    def test_failed_clustering_keeps_the_feedback(self):
+        """
+        Feedback whose clustering failed is saved, and clustered with
+        the next batch.
+        """
+
+        data = {
+            "name": "Bodeh Delton",
+            "email": "Bodeh@example.com",
+            "subject": "Campus Navigation",
+            "message": "Library building missing."
+        }
+
+        self.client.post(self.url, data, format="json")
+
+        with mock.patch("feedback.ingest.assign_clusters", side_effect=DatabaseError("down")), \
+                self.assertLogs("feedback.ingest", "ERROR") as logs:
+            self.assertEqual(feedback_buffer.flush(), 1)
+
+        self.assertIn("1 saved feedback left unclustered", logs.output[0])
+        self.assertIsNone(Feedback.objects.get().cluster_id)
+
+        data["message"] = "The library building is missing."
+        self.client.post(self.url, data, format="json")
+        feedback_buffer.flush()
+
+        first, second = Feedback.objects.order_by("created_at", "id")
+        self.assertEqual(first.cluster_id, first.pk)
+        self.assertIsNotNone(second.cluster_id)
+        self.assertFalse(feedback_buffer.unclustered)
+
+
+class FeedbackTriageAPITestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.url = "/api/feedback/triage/"
+
+        self.uba = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon"
+        )
+
+        self.ub = University.objects.create(
+            name="University of Buea",
+            short_name="UB",
+            country="Cameroon"
+        )
+
+        self.admin = User.objects.create_user(
+            username="ubaadmin",
+            password="testpassword123"
+        )
+        CampusAdminUser.objects.create(user=self.admin, university=self.uba)
+
+        self.student = User.objects.create_user(username="student")
+        Profile.objects.create(user=self.student, university=self.uba)
+
+        for i in range(5):
+            Feedback.objects.create(
+                user=self.student,
+                university=self.uba,
+                subject=f"UBa {i}",
+                message="...",
+                status="resolved" if i == 0 else "pending"
+            )
+
+        Feedback.objects.create(university=self.ub, subject="UB", message="...")
+
+    def tearDown(self):
+        counter_buffer.clear()
+
+    def authorize(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_export_is_scoped_and_escapes_formulas(self):
+        Feedback.objects.filter(subject="UBa 1").update(message='=HYPERLINK("http://x","click")')
+        self.authorize(self.admin)
+
+        response = self.client.get("/api/feedback/export/", {"format": "csv"})
+
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(sorted(row["subject"] for row in rows), [f"UBa {i}" for i in range(5)])
+        message = next(row["message"] for row in rows if row["subject"] == "UBa 1")
+        self.assertEqual(message, "'=HYPERLINK(\"http://x\",\"click\")")
+
+    def test_triage_requires_campus_staff(self):
+        self.authorize(self.student)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cursor_walks_every_row_once(self):
+        """
+        Pages follow each other newest first, without gaps or repeats,
+        even when rows share the same created_at.
+        """
+
+        Feedback.objects.update(created_at=Feedback.objects.first().created_at)
+        self.authorize(self.admin)
+
+        seen = []
+        response = self.client.get(self.url, {"page_size": 2})
+
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [row["id"] for row in response.data["results"]]
+
+            if response.data["next"] is None:
+                break
+            response = self.client.get(response.data["next"])
+
+        expected = list(
+            Feedback.objects.filter(university=self.uba)
+            .order_by("-created_at", "-id")
+            .values_list("id", flat=True)
+        )
+
+        # campus admins only get their own university
+        self.assertEqual(seen, expected)
+
+    def test_triage_filters(self):
+        self.authorize(self.admin)
+
+        response = self.client.get(self.url, {"status": "pending", "user": self.student.id})
+
+        self.assertEqual(len(response.data["results"]), 4)
+        self.assertEqual(response.data["results"][0]["username"], "student")
+
+        bad = self.client.get(self.url, {"status": "lost"})
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_cursor_is_rejected(self):
+        self.authorize(self.admin)
+
+        response = self.client.get(self.url, {"cursor": "nonsense"})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_staff_can_change_status(self):
+        feedback = Feedback.objects.filter(university=self.uba).first()
+        other = Feedback.objects.get(university=self.ub)
+        self.authorize(self.admin)
+
+        response = self.client.patch(
+            f"{self.url}{feedback.id}/",
+            {"status": "reviewed", "subject": "changed"},
+            format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        feedback.refresh_from_db()
+        self.assertEqual(feedback.status, "reviewed")
+        self.assertNotEqual(feedback.subject, "changed")
+
+        response = self.client.get(f"{self.url}{other.id}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FeedbackClusteringTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.uba = University.objects.create(
+            name="University of Bamenda",
+            short_name="UBa",
+            country="Cameroon"
+        )
+
+        self.ub = University.objects.create(
+            name="University of Buea",
+            short_name="UB",
+            country="Cameroon"
+        )
+
+    def tearDown(self):
+        counter_buffer.clear()
+
+    def report(self, message, university=None, subject="Wrong building label"):
+        return Feedback.objects.create(
+            university=university or self.uba,
+            subject=subject,
+            message=message
+        )
+
+    def test_near_duplicates_share_a_cluster(self):
+        first = self.report("The library is labeled as the chemistry lab on the map.")
+        second = self.report("the library is labelled as the chemistry lab on the map!!")
+        other = self.report("Please add the new sports complex near the main gate.")
+        elsewhere = self.report(
+            "The library is labeled as the chemistry lab on the map.",
+            university=self.ub
+        )
+
+        self.assertEqual(cluster_pending(), 4)
+
+        for feedback in (first, second, other, elsewhere):
+            feedback.refresh_from_db()
+
+        self.assertEqual(first.cluster_id, first.id)
+        self.assertEqual(second.cluster_id, first.id)
+        self.assertEqual(other.cluster_id, other.id)
+        # clusters never span universities
+        self.assertEqual(elsewhere.cluster_id, elsewhere.id)
+
+    def test_later_batches_join_existing_clusters(self):
+        first = self.report("Engineering block shows up in the wrong place.")
+        assign_clusters([first])
+
+        second = self.report("engineering block shows up in the wrong place")
+        assign_clusters([second])
+
+        second.refresh_from_db()
+        self.assertEqual(second.cluster_id, first.id)
+
+    def test_flushed_feedback_is_clustered(self):
+        feedback_buffer.clear()
+        feedback_buffer.add(("feedback_seen:test", {"subject": "Hi", "message": "Map is great", "name": "A", "email": "a@example.com"}))
+        feedback_buffer.flush()
+
+        feedback = Feedback.objects.get()
+        self.assertEqual(feedback.cluster_id, feedback.id)
+        self.assertIsNotNone(feedback.minhash)
+
+    def test_admin_resolves_whole_cluster(self):
+        first = self.report("The library is labeled as the chemistry lab on the map.")
+        self.report("the library is labelled as the chemistry lab on the map")
+        other = self.report("Please add the new sports complex near the main gate.")
+        cluster_pending()
+
+        User.objects.create_superuser(username="root", password="testpassword123")
+        self.client.login(username="root", password="testpassword123")
+
+        changelist = self.client.get("/admin/feedback/feedback/", {"grouped": "yes"})
+        self.assertContains(changelist, f'?cluster__id__exact={first.id}">2</a>', html=False)
+
+        response = self.client.post("/admin/feedback/feedback/", {
+            "action": "resolve_cluster",
+            "_selected_action": [first.id],
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Feedback.objects.filter(status="resolved").count(), 2)
+
+        other.refresh_from_db()
+        self.assertEqual(other.status, "pending")
+
+        filtered = self.client.get("/admin/feedback/feedback/", {"cluster__id__exact": first.id})
+        self.assertEqual(filtered.status_code, 200)
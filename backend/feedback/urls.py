@@ -1,5 +1,10 @@
 from django.urls import path
-from .views import FeedbackCreateView
+from .views import (
+    FeedbackCreateView,
+    FeedbackExportView,
+    FeedbackTriageDetailView,
+    FeedbackTriageListView,
+)
 
 urlpatterns = [
     path(
@@ -7,4 +12,22 @@ urlpatterns = [
         FeedbackCreateView.as_view(),
         name='feedback-submit'
     ),
-]
\ No newline at end of file
+
+    path(
+        'triage/',
+        FeedbackTriageListView.as_view(),
+        name='feedback-triage'
+    ),
+
+    path(
+        'export/',
+        FeedbackExportView.as_view(),
+        name='feedback-export'
+    ),
+
+    path(
+        'triage/<int:pk>/',
+        FeedbackTriageDetailView.as_view(),
+        name='feedback-triage-detail'
+    ),
+]
@@ -1,16 +1,27 @@
 #kwanyi :)
 # Creating the feedback views.
-from rest_framework import status
+from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from campus.exports import ExportView
+from campus.permissions import IsCampusStaff
+from campus.throttling import FeedbackThrottle
+from .ingest import claim, feedback_buffer
 from .models import Feedback
-from .serializers import FeedbackSerializer
+from .pagination import KeysetPagination
+from .serializers import FeedbackSerializer, FeedbackTriageSerializer
 
 
 class FeedbackCreateView(APIView):
+    """
+    Validates and queues feedback, the write happens in a batch later
+    (see feedback.ingest). Answers 202 right away.
+    """
     permission_classes = [AllowAny]
+    throttle_classes = [FeedbackThrottle]
 
     def post(self, request):
         serializer = FeedbackSerializer(
@@ -20,26 +31,97 @@ class FeedbackCreateView(APIView):
 
         if serializer.is_valid():
 
+            subject = serializer.validated_data["subject"]
+            message = serializer.validated_data["message"]
+
             if request.user.is_authenticated:
-                Feedback.objects.create(
-                    user=request.user,
-                    subject=serializer.validated_data["subject"],
-                    message=serializer.validated_data["message"]
-                )
+                identity = f"user:{request.user.pk}"
+                profile = getattr(request.user, "profile", None)
+                feedback = {
+                    "user_id": request.user.pk,
+                    "university_id": profile.university_id if profile else None,
+                    "subject": subject,
+                    "message": message,
+                }
             else:
-                Feedback.objects.create(
-                    name=serializer.validated_data["name"],
-                    email=serializer.validated_data["email"],
-                    subject=serializer.validated_data["subject"],
-                    message=serializer.validated_data["message"]
-                )
+                identity = f"email:{serializer.validated_data['email'].lower()}"
+                feedback = {
+                    "name": serializer.validated_data["name"],
+                    "email": serializer.validated_data["email"],
+                    "subject": subject,
+                    "message": message,
+                }
+
+            # same answer either way, a resend is simply not stored twice
+            key = claim(identity, subject, message)
+            if key is not None:
+                feedback_buffer.add((key, feedback))
 
             return Response(
                 {"message": "Feedback submitted successfully."},
-                status=status.HTTP_201_CREATED
+                status=status.HTTP_202_ACCEPTED
             )
 
         return Response(
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
-        )
\ No newline at end of file
+        )
+
+
+class StaffFeedbackMixin:
+    permission_classes = [IsCampusStaff]
+    serializer_class = FeedbackTriageSerializer
+
+    def get_queryset(self):
+        qs = Feedback.objects.select_related("user", "university")
+        if self.request.user.is_superuser:
+            return qs
+        # campus admins only see feedback from their own students
+        return qs.filter(university_id=self.request.user.campus_admin.university_id)
+
+
+class FeedbackTriageListView(StaffFeedbackMixin, generics.ListAPIView):
+    """
+    GET /api/feedback/triage/?status=&user=&university=&cursor=&page_size=
+    Newest first, paged with a cursor (see feedback.pagination).
+    """
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        params = self.request.query_params
+
+        status_filter = params.get("status")
+        if status_filter:
+            if status_filter not in dict(Feedback.STATUS_CHOICES):
+                raise ValidationError({"status": "Unknown status."})
+            qs = qs.filter(status=status_filter)
+
+        for name in ("user", "university"):
+            value = params.get(name)
+            if value:
+                if not value.isdigit():
+                    raise ValidationError({name: "Must be an id."})
+                qs = qs.filter(**{f"{name}_id": int(value)})
+
+        return qs
+
+
+class FeedbackTriageDetailView(StaffFeedbackMixin, generics.RetrieveUpdateAPIView):
+    """GET / PATCH {"status": ...} one feedback"""
+
+
+class FeedbackExportView(ExportView):
+    """GET /api/feedback/export/?format=csv|ndjson&university="""
+    model = Feedback
+    export_fields = (
+        "id",
+        "subject",
+        "message",
+        "status",
+        "name",
+        "email",
+        "user__username",
+        "created_at",
+        "updated_at",
+    )
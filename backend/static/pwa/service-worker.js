@@ -1,23 +1,185 @@
-const CACHE_NAME = "uba-campus-v1";
+const CACHE_NAME = "uba-campus-v2";
+const BUNDLE_CACHE = "uba-campus-bundles";
 
 const urlsToCache = [
   "/",
-  "/static/css/style.css",
 ];
 
+const ASSET_TYPES = ["script", "style", "font", "image"];
+
+// how often an open map asks whether its offline bundle is still current
+const POLL_INTERVAL = 5 * 60 * 1000;
+
 self.addEventListener("install", event => {
   event.waitUntil(
     caches.open(CACHE_NAME).then(cache => {
       return cache.addAll(urlsToCache);
     })
   );
+  self.skipWaiting();
+});
+
+self.addEventListener("activate", event => {
+  // drop caches of older service worker versions
+  event.waitUntil(
+    caches.keys().then(names => Promise.all(
+      names
+        .filter(name => name !== CACHE_NAME && name !== BUNDLE_CACHE)
+        .map(name => caches.delete(name))
+    )).then(() => self.clients.claim())
+  );
+});
+
+
+/* OFFLINE BUNDLE
+   /api/bundle/<university>/manifest.json says which bundle version is
+   current; the bundle is only downloaded again when that changes. The
+   buildings it contains answer /api/buildings/ (kept current with
+   ?since= deltas) and its icons answer the icon URLs, so the map works
+   without a connection. */
+
+const bundles = {};  // university (lower case) -> parsed bundle
+
+function bundleKey(university) {
+  return `/offline-bundle/${university}`;
+}
+
+async function loadBundle(university) {
+  if (!bundles[university]) {
+    const cache = await caches.open(BUNDLE_CACHE);
+    const stored = await cache.match(bundleKey(university));
+    if (stored) bundles[university] = await stored.json();
+  }
+  return bundles[university];
+}
+
+async function syncBundle(university) {
+  const cache = await caches.open(BUNDLE_CACHE);
+  const manifestResponse = await fetch(`/api/bundle/${university}/manifest.json`, { cache: "no-cache" });
+  if (!manifestResponse.ok) return;
+
+  const manifest = await manifestResponse.json();
+  const current = await cache.match(bundleKey(university));
+  if (current && current.headers.get("X-Bundle-Version") === manifest.version) return;
+
+  const bundleResponse = await fetch(manifest.url);
+  if (!bundleResponse.ok) return;
+
+  const body = await bundleResponse.text();
+  await cache.put(bundleKey(university), new Response(body, {
+    headers: { "Content-Type": "application/json", "X-Bundle-Version": manifest.version },
+  }));
+  bundles[university] = JSON.parse(body);
+}
+
+const pollers = {};
+
+self.addEventListener("message", event => {
+  const data = event.data || {};
+  if (data.type !== "sync-bundle" || !data.university) return;
+
+  const university = data.university.toLowerCase();
+  event.waitUntil(syncBundle(university).catch(() => {}));
+
+  if (!pollers[university]) {
+    pollers[university] = setInterval(
+      () => syncBundle(university).catch(() => {}),
+      POLL_INTERVAL
+    );
+  }
 });
 
+function jsonResponse(data) {
+  return new Response(JSON.stringify(data), {
+    headers: { "Content-Type": "application/json" },
+  });
+}
+
+function applyDelta(bundle, delta) {
+  if (delta.full) {
+    bundle.buildings = delta.buildings;
+  } else {
+    const gone = new Set(delta.deleted.concat(delta.changed.map(b => b.id)));
+    bundle.buildings = bundle.buildings
+      .filter(b => !gone.has(b.id))
+      .concat(delta.changed)
+      .sort((a, b) => a.id - b.id);
+  }
+  bundle.version = delta.version;
+}
+
+async function buildingsFromBundle(request) {
+  const university = (new URL(request.url).searchParams.get("university") || "").toLowerCase();
+  const bundle = university && await loadBundle(university);
+  if (!bundle) return fetch(request);
+
+  // only what changed since the bundle (or the last delta), usually a few bytes
+  try {
+    const response = await fetch(
+      `/api/buildings/?university=${encodeURIComponent(university)}&since=${bundle.version}`
+    );
+    if (response.ok) {
+      applyDelta(bundle, await response.json());
+      const cache = await caches.open(BUNDLE_CACHE);
+      const stored = await cache.match(bundleKey(university));
+      await cache.put(bundleKey(university), new Response(JSON.stringify(bundle), {
+        headers: {
+          "Content-Type": "application/json",
+          "X-Bundle-Version": stored ? stored.headers.get("X-Bundle-Version") : "",
+        },
+      }));
+    }
+  } catch (err) {
+    // offline: the bundle's copy is the best there is
+  }
+  return jsonResponse(bundle.buildings);
+}
+
+async function iconFromBundles(request) {
+  for (const university of Object.keys(bundles)) {
+    const icons = bundles[university].icons;
+    // keys are the URLs the buildings API emits, relative in the bundle
+    const uri = icons[request.url] || icons[new URL(request.url).pathname];
+    if (uri) return fetch(uri);
+  }
+  return null;
+}
+
+
 self.addEventListener("fetch", event => {
+  const request = event.request;
+  if (request.method !== "GET") return;
+
+  const url = new URL(request.url);
+
+  // live data when online, the bundle's copy when not
+  if (url.pathname === "/api/buildings/") {
+    event.respondWith(buildingsFromBundle(request));
+    return;
+  }
+
+  // the bundle has its own cache, API calls are never served stale
+  if (url.pathname.startsWith("/api/")) return;
+
   event.respondWith(
-    caches.match(event.request).then(response => {
-      return response || fetch(event.request);
-    })
+    iconFromBundles(request).then(icon => icon || caches.match(request).then(cached => {
+      const network = fetch(request).then(response => {
+        // keep the page shell and its assets (incl. CDN scripts) for the
+        // next offline visit; map tiles are left out, there are too many
+        const sameOrigin = url.origin === self.location.origin;
+        const keep = request.mode === "navigate" || (
+          ASSET_TYPES.includes(request.destination)
+          && (request.destination !== "image" || sameOrigin)
+        );
+        if (keep && (response.ok || response.type === "opaque")) {
+          const copy = response.clone();
+          caches.open(CACHE_NAME).then(cache => cache.put(request, copy));
+        }
+        return response;
+      });
+      // pages: fresh when possible; static files: cached first
+      if (request.mode === "navigate") return network.catch(() => cached);
+      return cached || network;
+    }))
   );
 });
-
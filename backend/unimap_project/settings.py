@@ -14,6 +14,7 @@ from datetime import timedelta
 from decouple import config
 import os
 from pathlib import Path
+import tempfile
 
 # BASE DIRECTORY
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -65,6 +66,7 @@ INSTALLED_APPS = [
 
 # MIDDLEWARE
 MIDDLEWARE = [
+    'campus.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -80,15 +82,185 @@ MIDDLEWARE = [
 # REST Framework & JWT
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ),
+    # reverse proxies in front of the app (1 on Heroku): the client IP for
+    # throttling is taken that far back in X-Forwarded-For, never from a
+    # header the client sent itself; 0 uses REMOTE_ADDR
+    'NUM_PROXIES': config("NUM_PROXIES", default=0, cast=int),
 }
 
+# token buckets per endpoint: (burst capacity, tokens refilled per minute)
+# "client" is per user / IP, "university" is shared by the whole campus,
+# "global" by every request (it guards the metered ORS key)
+TOKEN_BUCKETS = {
+    "route": {
+        "client": (10, 30),
+        "university": (200, 1200),
+        "global": (400, 2000),
+    },
+    "register": {
+        "client": (5, 5),
+        "university": (60, 300),
+    },
+    "feedback": {
+        "client": (5, 10),
+        "university": (60, 300),
+    },
+}
+
+# absolute URL of the app page where students imported by cohort choose
+# a password (e.g. https://app.example.org/activate/), the activation mail
+# links to it with ?uid=&token=. Unset, no activation mail is sent.
+ACTIVATION_URL = config("ACTIVATION_URL", default="")
+
+# EMAIL
+# activation links go out over SMTP once EMAIL_HOST is set; without it
+# they are printed to the console, which is only useful locally
+EMAIL_HOST = config("EMAIL_HOST", default="")
+EMAIL_BACKEND = config(
+    "EMAIL_BACKEND",
+    default="django.core.mail.backends.smtp.EmailBackend" if EMAIL_HOST
+    else "django.core.mail.backends.console.EmailBackend",
+)
+EMAIL_PORT = config("EMAIL_PORT", default=587, cast=int)
+EMAIL_HOST_USER = config("EMAIL_HOST_USER", default="")
+EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD", default="")
+EMAIL_USE_TLS = config("EMAIL_USE_TLS", default=True, cast=bool)
+EMAIL_TIMEOUT = config("EMAIL_TIMEOUT", default=10, cast=int)
+DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL", default="webmaster@localhost")
+
+# seconds a worker reuses an authenticated user + profile
+AUTH_CACHE_TTL = config("AUTH_CACHE_TTL", default=60, cast=int)
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
 }
 
+# CACHE
+# counters, throttling and the live dashboard need a cache shared by all
+# gunicorn workers, and cached pages, catalogs, users, cluster indexes and
+# campus boundaries are invalidated through it: set REDIS_URL in production.
+# Without it every worker keeps its own in-memory cache, which is only
+# right for a single worker; the app refuses to start with more
+# (WEB_CONCURRENCY is gunicorn's worker count, set by Heroku).
+REDIS_URL = config("REDIS_URL", default="")
+WEB_CONCURRENCY = config("WEB_CONCURRENCY", default=1, cast=int)
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# METRICS
+# each worker dumps its counters here, /admin/metrics/ merges them
+METRICS_DIR = config(
+    "METRICS_DIR",
+    default=os.path.join(tempfile.gettempdir(), "unimap-metrics")
+)
+METRICS_DUMP_INTERVAL = config("METRICS_DUMP_INTERVAL", default=5, cast=int)
+
+# BUFFERED WRITES
+# flush batches and run background jobs on their own threads; the test
+# runner turns this off so they run inline
+BUFFERED_WRITES_ASYNC = config("BUFFERED_WRITES_ASYNC", default=True, cast=bool)
+TEST_RUNNER = "unimap_project.testing.TestRunner"
+
+# analytics events are written once this many are queued or after N seconds
+ANALYTICS_FLUSH_SIZE = config("ANALYTICS_FLUSH_SIZE", default=200, cast=int)
+ANALYTICS_FLUSH_INTERVAL = config("ANALYTICS_FLUSH_INTERVAL", default=10, cast=int)
+
+# feedback is queued and written in batches
+FEEDBACK_FLUSH_SIZE = config("FEEDBACK_FLUSH_SIZE", default=20, cast=int)
+FEEDBACK_FLUSH_INTERVAL = config("FEEDBACK_FLUSH_INTERVAL", default=5, cast=int)
+# the same feedback sent again within this many seconds is dropped
+FEEDBACK_DUPLICATE_WINDOW = config("FEEDBACK_DUPLICATE_WINDOW", default=60 * 60, cast=int)
+# staff triage API page size (?page_size= can go up to the max)
+FEEDBACK_PAGE_SIZE = config("FEEDBACK_PAGE_SIZE", default=50, cast=int)
+FEEDBACK_MAX_PAGE_SIZE = config("FEEDBACK_MAX_PAGE_SIZE", default=200, cast=int)
+# estimated similarity (0-1) at which feedback joins a near-duplicate cluster
+FEEDBACK_CLUSTER_THRESHOLD = config("FEEDBACK_CLUSTER_THRESHOLD", default=0.6, cast=float)
+
+# visitor / route-request counters are flushed to DailyStats in batches
+COUNTER_FLUSH_SIZE = config("COUNTER_FLUSH_SIZE", default=100, cast=int)
+COUNTER_FLUSH_INTERVAL = config("COUNTER_FLUSH_INTERVAL", default=10, cast=int)
+
+# BUILDINGS DELTA SYNC (?since= on the buildings API)
+# versions are sent this many seconds in the past so late commits aren't missed
+BUILDINGS_SYNC_OVERLAP = config("BUILDINGS_SYNC_OVERLAP", default=5, cast=int)
+# deletions are remembered this long, older clients get a full snapshot
+BUILDINGS_TOMBSTONE_DAYS = config("BUILDINGS_TOMBSTONE_DAYS", default=30, cast=int)
+# more changes than this and a full snapshot is sent instead
+BUILDINGS_DELTA_MAX = config("BUILDINGS_DELTA_MAX", default=200, cast=int)
+
+# PWA OFFLINE BUNDLE
+# building icons up to this size are inlined into the bundle as data URIs
+BUNDLE_MAX_ICON_BYTES = config("BUNDLE_MAX_ICON_BYTES", default=64 * 1024, cast=int)
+
+# IMAGE DERIVATIVES (campus.images)
+# longest edge in pixels of the photo variants served instead of the upload
+IMAGE_THUMB_SIZE = config("IMAGE_THUMB_SIZE", default=320, cast=int)
+IMAGE_MEDIUM_SIZE = config("IMAGE_MEDIUM_SIZE", default=1024, cast=int)
+# building icons are squared to this size, also the cell size of the sprite sheet
+IMAGE_ICON_SIZE = config("IMAGE_ICON_SIZE", default=64, cast=int)
+IMAGE_QUALITY = config("IMAGE_QUALITY", default=80, cast=int)
+
+# MAP TILE PROXY (campus.tiles)
+# one MBTiles file per university and layer, evicted LRU past the size limit
+TILE_CACHE_DIR = config("TILE_CACHE_DIR", default=os.path.join(BASE_DIR, "tile_cache"))
+TILE_CACHE_MAX_MB = config("TILE_CACHE_MAX_MB", default=256, cast=int)
+# zoom range of the map, and metres around the campus bounds that are proxied
+TILE_MIN_ZOOM = config("TILE_MIN_ZOOM", default=16, cast=int)
+TILE_MAX_ZOOM = config("TILE_MAX_ZOOM", default=20, cast=int)
+TILE_BBOX_PADDING = config("TILE_BBOX_PADDING", default=500, cast=int)
+# cached tiles are fetched again after this many days (the old copy serves if that fails)
+TILE_MAX_AGE_DAYS = config("TILE_MAX_AGE_DAYS", default=30, cast=int)
+# last-access times are written at most this often (seconds) per tile
+TILE_TOUCH_INTERVAL = config("TILE_TOUCH_INTERVAL", default=60 * 60, cast=int)
+TILE_FETCH_TIMEOUT = config("TILE_FETCH_TIMEOUT", default=10, cast=int)
+# background threads per worker filling the cache, misses are redirected upstream meanwhile
+TILE_FETCH_WORKERS = config("TILE_FETCH_WORKERS", default=2, cast=int)
+TILE_USER_AGENT = config("TILE_USER_AGENT", default="UniMap campus tile cache")
+TILE_BROWSER_MAX_AGE = config("TILE_BROWSER_MAX_AGE", default=60 * 60 * 24 * 7, cast=int)
+# serve pre-seeded files only, never contact the tile servers
+TILE_OFFLINE = config("TILE_OFFLINE", default=False, cast=bool)
+
+# MARKER CLUSTERS (campus.clusters)
+# buildings closer than this many screen pixels are drawn as one cluster
+CLUSTER_RADIUS = config("CLUSTER_RADIUS", default=60, cast=int)
+
+# BUILDING FOOTPRINTS (campus.footprints)
+# outline detail dropped per zoom, in screen pixels
+FOOTPRINT_TOLERANCE_PX = config("FOOTPRINT_TOLERANCE_PX", default=1.0, cast=float)
+
+# WALKING NETWORK (campus.osm, campus.graph)
+# compiled graph files, mapped read-only by every worker
+GRAPH_DIR = config("GRAPH_DIR", default=os.path.join(BASE_DIR, "graphs"))
+# routes to a building start on the network when the start is this close (metres) to a walkway
+GRAPH_SNAP_DISTANCE = config("GRAPH_SNAP_DISTANCE", default=150, cast=int)
+
+# SITE PLAN TILES (campus.siteplan)
+# uploads larger than this many pixels are refused: they are decoded in one
+# piece, 4-8 bytes per pixel, in a child process (see campus.siteplan)
+SITE_PLAN_MAX_PIXELS = config("SITE_PLAN_MAX_PIXELS", default=16_000_000, cast=int)
+
+# ADMIN DASHBOARD
+# seconds a cached statistics snapshot is served before it is rebuilt
+ADMIN_STATS_TTL = config("ADMIN_STATS_TTL", default=120, cast=int)
+
+# live dashboard: seconds between two polls of the admin index page
+LIVE_STATS_INTERVAL = config("LIVE_STATS_INTERVAL", default=10, cast=int)
+
 # URLS & TEMPLATES
 ROOT_URLCONF = 'unimap_project.urls'
 
@@ -0,0 +1,18 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    manage.py test: buffered batches and background jobs run inline, so
+    nothing touches the test database from another thread.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._inline = override_settings(BUFFERED_WRITES_ASYNC=False)
+        self._inline.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._inline.disable()
+        super().teardown_test_environment(**kwargs)
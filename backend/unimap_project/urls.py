@@ -2,10 +2,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 from campus.admin import campus_admin_site
 from django.urls import path, include
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
+from rest_framework_simplejwt.views import TokenRefreshView
+from accounts.views import CampusTokenObtainPairView
 
 urlpatterns = [
     path('admin/', campus_admin_site.urls),
@@ -19,7 +17,7 @@ urlpatterns = [
     path('api/feedback/', include('feedback.urls')),    #kwanyi :),,. so tireeeed today :/
 
     # JWT Authentication
-    path('api/token/', TokenObtainPairView.as_view()),
+    path('api/token/', CampusTokenObtainPairView.as_view()),
     path('api/token/refresh/', TokenRefreshView.as_view()),
 ]
 